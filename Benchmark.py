@@ -0,0 +1,254 @@
+"""
+    Micro benchmarks for ChessEngine. Every benchmark prints its own table, run one by name:
+
+        python Benchmark.py attacks     # isSquareAttacked against generating every opponent move
+        python Benchmark.py san         # SAN writing and reading per move
+        python Benchmark.py render      # frame times of ChessRender against full redraws, SDL dummy driver
+        python Benchmark.py startup     # cold start of a process: import ChessEngine to the first GetValidMove
+        python Benchmark.py ordering    # search nodes to a fixed depth with move ordering against generation order
+"""
+
+import argparse
+import io
+import time
+
+import ChessEngine
+import Perft
+
+def _Timed(func, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def LegacySquareIsAttacked(gs, r, c):
+    """the old SquareIsAttacked: generate every opponent move and look for one landing on (r, c)"""
+    gs.whiteToMove = not gs.whiteToMove
+    oppMoves = gs.GetAllPossibleMove()
+    gs.whiteToMove = not gs.whiteToMove
+    for move in oppMoves:
+        if move.endRow == r and move.endCol == c:
+            return True
+    return False
+
+def BenchAttacks(repeat = 20):
+    """attacked-square queries over all 64 squares of the perft positions, old path against the tables"""
+    print("%-12s %12s %12s %8s" % ("position", "legacy us", "tables us", "speedup"))
+    for name, fen, expected in Perft.POSITIONS:
+        gs = ChessEngine.GameStart.fromFEN(fen)
+        reference = ChessEngine.GameStart.fromFEN(fen, "bitboard")
+        enemy = 'b' if gs.whiteToMove else 'w'
+        for sq in range(64):
+            if gs.isSquareAttacked(sq, enemy) != reference.isSquareAttacked(sq, enemy):
+                raise AssertionError("%s: isSquareAttacked disagrees with the bitboard backend on square %d" % (name, sq))
+        legacy = _Timed(lambda: [LegacySquareIsAttacked(gs, sq // 8, sq % 8) for sq in range(64)], repeat)
+        tables = _Timed(lambda: [gs.isSquareAttacked(sq, enemy) for sq in range(64)], repeat)
+        print("%-12s %12.1f %12.1f %7.1fx" % (name, legacy / 64 * 1e6, tables / 64 * 1e6, legacy / tables))
+    start = time.perf_counter()
+    passed, nodes = Perft.RunPosition("kiwipete", Perft.POSITIONS[1][1], Perft.POSITIONS[1][2], 3, out = io.StringIO())
+    elapsed = time.perf_counter() - start
+    print("kiwipete perft 3 (castling heavy): %d nodes, %.3fs, %.0f nps" % (nodes, elapsed, nodes / elapsed))
+
+def BenchSAN(repeat = 5):
+    """SAN written and read back for every legal move of the perft positions, per move and per backend"""
+    import ChessPGN
+    print("%-12s %-9s %12s %12s" % ("position", "backend", "ToSAN us", "ParseSAN us"))
+    for name, fen, expected in Perft.POSITIONS:
+        for backend in ("mailbox", "bitboard"):
+            gs = ChessEngine.GameStart.fromFEN(fen, backend)
+            moves = gs.GetValidMove()
+            sans = [ChessPGN.ToSAN(gs, move, moves) for move in moves]
+            for move, san in zip(moves, sans):
+                if ChessPGN.ParseSAN(gs, san).Encode() != move.Encode():
+                    raise AssertionError("%s: %s does not read back as %s" % (name, san, move.GetChessNotation()))
+            write = _Timed(lambda: [ChessPGN.ToSAN(gs, move, moves) for move in moves], repeat)
+            read = _Timed(lambda: [ChessPGN.ParseSAN(gs, san) for san in sans], repeat)
+            print("%-12s %-9s %12.1f %12.1f" % (name, backend, write / len(moves) * 1e6, read / len(moves) * 1e6))
+
+'''
+the drawing code ChessMain had before ChessRender: everything repainted and flipped every frame
+'''
+def LegacyDrawGameState(p, screen, images, board, whiteToMove, validMoves, sqSelected, sqSize):
+    colors = [p.Color("white"), p.Color("gray")]
+    for r in range(8):
+        for c in range(8):
+            p.draw.rect(screen, colors[(r + c) % 2], p.Rect(sqSize * c, sqSize * r, sqSize, sqSize))
+    if sqSelected != ():
+        r, c = sqSelected
+        if board[r][c][0] == ('w' if whiteToMove else 'b'):
+            s = p.Surface((sqSize, sqSize))
+            s.set_alpha(100)
+            s.fill(p.Color('blue'))
+            screen.blit(s, (c * sqSize, r * sqSize))
+            s.fill(p.Color('yellow'))
+            for move in validMoves:
+                if move.startRow == r and move.startCol == c:
+                    screen.blit(s, (move.endCol * sqSize, move.endRow * sqSize))
+    for r in range(8):
+        for c in range(8):
+            if board[r][c] != "--":
+                screen.blit(images[board[r][c]], p.Rect(sqSize * c, sqSize * r, sqSize, sqSize))
+
+def LegacyAnimateMove(p, screen, images, move, board, sqSize):
+    colors = [p.Color("white"), p.Color("gray")]
+    dR = move.endRow - move.startRow
+    dC = move.endCol - move.startCol
+    frameCount = (abs(dR) + abs(dC)) * 10
+    for frame in range(frameCount + 1):
+        r, c = (move.startRow + dR * frame / frameCount, move.startCol + dC * frame / frameCount)
+        LegacyDrawGameState(p, screen, images, board, True, [], (), sqSize)
+        endSquare = p.Rect(move.endCol * sqSize, move.endRow * sqSize, sqSize, sqSize)
+        p.draw.rect(screen, colors[(move.endRow + move.endCol) % 2], endSquare)
+        if move.pieceCaptured != '--':
+            screen.blit(images[move.pieceCaptured], endSquare)
+        screen.blit(images[move.pieceMoved], p.Rect(c * sqSize, r * sqSize, sqSize, sqSize))
+        p.display.flip()
+    return frameCount + 1
+
+class _NoWaitClock():
+    """stands in for pygame.time.Clock so the benchmark measures drawing, not the frame rate cap"""
+    def tick(self, fps = 0):
+        return 0
+
+def BenchRender(plies = 40, idleFrames = 5, sqSize = 64):
+    """
+    Frame times of a scripted game under SDL's dummy video driver: per ply a frame with a piece selected,
+    the move animation, and a few idle frames. Legacy full redraw + flip against ChessRender dirty rectangles.
+    """
+    import os
+    import random
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame as p
+    import ChessHash
+    import ChessRender
+    p.init()
+    screen = p.display.set_mode((sqSize * 8, sqSize * 8))
+    images = {}
+    for piece in ChessHash.PIECES:     #plain sprites, the timing does not depend on the artwork
+        sprite = p.Surface((sqSize, sqSize), p.SRCALPHA)
+        p.draw.circle(sprite, p.Color("ivory" if piece[0] == 'w' else "black"), (sqSize // 2, sqSize // 2), sqSize // 3)
+        images[piece] = sprite.convert_alpha()
+
+    rng = random.Random(7)
+    script = []     #(fen before the move, selected square, move notation)
+    gs = ChessEngine.GameStart()
+    for i in range(plies):
+        moves = gs.GetValidMove()
+        if not moves:
+            break
+        move = rng.choice(moves)
+        script.append((gs.toFEN(), (move.startRow, move.startCol), move.GetChessNotation()))
+        gs.makeMove(move)
+
+    def Run(legacy):
+        renderer = ChessRender.BoardRenderer(screen, images, sqSize)
+        clock = _NoWaitClock()
+        frames = 0
+        drawTime = 0.0
+        animationTime = 0.0
+        animationFrames = 0
+        for fen, selected, notation in script:
+            gs = ChessEngine.GameStart.fromFEN(fen)
+            validMoves = gs.GetValidMove()
+            move = [m for m in validMoves if m.GetChessNotation() == notation][0]
+            for sqSelected in [selected] + [()] * idleFrames:
+                start = time.perf_counter()
+                if legacy:
+                    LegacyDrawGameState(p, screen, images, gs.board, gs.whiteToMove, validMoves, sqSelected, sqSize)
+                    p.display.flip()
+                else:
+                    dirty = renderer.Draw(gs, validMoves, sqSelected)
+                    if dirty:
+                        p.display.update(dirty)
+                drawTime += time.perf_counter() - start
+                frames += 1
+            gs.makeMove(move)
+            start = time.perf_counter()
+            if legacy:
+                animationFrames += LegacyAnimateMove(p, screen, images, move, gs.board, sqSize)
+            else:
+                renderer.AnimateMove(move, gs.board, clock)
+                animationFrames += (abs(move.endRow - move.startRow) + abs(move.endCol - move.startCol)) * 10 + 1
+            animationTime += time.perf_counter() - start
+        return drawTime / frames, animationTime / animationFrames
+
+    print("%-10s %14s %18s" % ("renderer", "frame us", "animation frame us"))
+    for name, legacy in (("legacy", True), ("dirty", False)):
+        frame, animation = Run(legacy)
+        print("%-10s %14.1f %18.1f" % (name, frame * 1e6, animation * 1e6))
+    p.quit()
+
+'''
+run in a fresh interpreter by BenchStartup: import time, first GetValidMove, and which heavy modules came along
+'''
+STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import ChessEngine
+imported = time.perf_counter()
+gs = ChessEngine.GameStart(%r)
+gs.GetValidMove()
+done = time.perf_counter()
+heavy = [name for name in ("pygame", "asyncio", "ctypes", "numpy", "multiprocessing") if name in sys.modules]
+print(imported - start, done - imported, ",".join(heavy))
+"""
+
+def BenchStartup(repeat = 10):
+    """cold start of a worker process: interpreter, import ChessEngine, first GetValidMove, per backend"""
+    import os
+    import subprocess
+    import sys
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def Spawn(script):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", script], cwd = here, check = True, capture_output = True,
+                                text = True).stdout
+        return time.perf_counter() - start, output.split()
+
+    bare = min(Spawn("pass")[0] for i in range(repeat))
+    print("bare interpreter %.1f ms" % (bare * 1e3))
+    print("%-9s %10s %14s %12s  %s" % ("backend", "import ms", "first move ms", "process ms", "heavy modules"))
+    for backend in ("mailbox", "bitboard"):
+        runs = [Spawn(STARTUP_SCRIPT % backend) for i in range(repeat)]
+        wall = min(run[0] for run in runs)
+        importTime = min(float(run[1][0]) for run in runs)
+        firstMove = min(float(run[1][1]) for run in runs)
+        heavy = runs[0][1][2] if len(runs[0][1]) > 2 else "none"
+        print("%-9s %10.1f %14.1f %12.1f  %s" % (backend, importTime * 1e3, firstMove * 1e3, wall * 1e3, heavy))
+
+'''
+Unordered and ordered search the same tree to the same depth, without quiescence: a quiescence search in
+generation order blows up in tactical positions (kiwipete) and would measure that instead of the main search.
+The last column is the ordered search with its quiescence stage, what the engine really plays with
+'''
+def BenchOrdering(depth = 4):
+    """nodes of one search to depth per perft position with move ordering off and on, fresh tables each"""
+    import ChessSearch
+    print("%-12s %12s %12s %8s %12s %10s %10s" % ("position", "unordered", "ordered", "ratio", "+quiescence",
+                                                   "unord s", "ord s"))
+    total = [0, 0, 0]
+    for name, fen, expected in Perft.POSITIONS:
+        runs = []
+        for ordering, quiescence in ((False, False), (True, False), (True, True)):
+            searcher = ChessSearch.Searcher(ttSizeMB = 8)
+            searcher.ordering = ordering
+            searcher.quiescence = quiescence
+            runs.append(searcher.Search(ChessEngine.GameStart.fromFEN(fen), depth = depth))
+        for i in range(3):
+            total[i] += runs[i].nodes
+        print("%-12s %12d %12d %7.1fx %12d %10.2f %10.2f" % (name, runs[0].nodes, runs[1].nodes, runs[0].nodes / runs[1].nodes,
+                                                              runs[2].nodes, runs[0].elapsed, runs[1].elapsed))
+    print("%-12s %12d %12d %7.1fx %12d" % ("total", total[0], total[1], total[0] / total[1], total[2]))
+
+BENCHMARKS = {"attacks": BenchAttacks, "san": BenchSAN, "render": BenchRender, "startup": BenchStartup,
+              "ordering": BenchOrdering}
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "ChessEngine micro benchmarks")
+    parser.add_argument("name", choices = sorted(BENCHMARKS))
+    args = parser.parse_args(argv)
+    BENCHMARKS[args.name]()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+    Engine moves for ChessMain without freezing the window: the search runs in a worker process fed through a
+    queue, the UI polls for the answer between frames.
+    Every request has an id and a shared counter holds the id the UI still wants, so bumping it (Cancel, or a
+    new request) stops a running search at its next clock check and makes the worker drop stale requests.
+    With ponder on, the worker keeps searching the position after the reply it expects from the human; when that
+    move is played the running search just becomes the answer, usually without any wait.
+
+        ai = ChessAI.AIPlayer(movetime = 1.0, ponder = True)
+        ai.Think(gs)
+        ...every frame...
+        reply = ai.Poll()
+        if reply is not None:
+            gs.makeMove(gs.MoveFromCode(reply.code))
+            ai.Ponder(gs, reply.ponderCode)
+"""
+
+import multiprocessing
+import pickle
+import queue
+import time
+
+import ChessBook
+import ChessSearch
+
+PONDER_POLL = 0.01  #seconds between looks at the shared state once a ponder search has nothing left to do
+
+def _Worker(requests, results, wanted, ponderHit, ponderDeadline, ttSizeMB, bookFile):
+    """worker process: search every request that is still wanted, answer (id, code, ponder code, score, depth)"""
+    #the book is mapped, not read: workers of every window share its pages
+    book = ChessBook.PolyglotBook(bookFile) if bookFile else None
+    searcher = ChessSearch.Searcher(ttSizeMB = ttSizeMB, book = book)
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        requestId, data, movetime, ponder = request
+        if wanted.value != requestId:
+            continue    #cancelled while it was waiting in the queue
+
+        def ShouldStop():
+            if wanted.value != requestId:
+                return True
+            return ponder and ponderHit.value == requestId and time.time() >= ponderDeadline.value
+        searcher.shouldStop = ShouldStop
+        gs = pickle.loads(data)
+        if ponder:  #no limit of its own, runs until the ponder hit deadline or a cancel
+            result = searcher.Search(gs, depth = ChessSearch.MAX_DEPTH)
+            while wanted.value == requestId and (ponderHit.value != requestId or time.time() < ponderDeadline.value):
+                time.sleep(PONDER_POLL)     #finished early (mate, max depth), hold the answer until the move is known
+        else:
+            result = searcher.Search(gs, movetime = movetime)
+        if wanted.value != requestId or result.bestMove is None:
+            continue
+        ponderCode = result.pv[1].Encode() if len(result.pv) > 1 else None
+        results.put((requestId, result.bestMove.Encode(), ponderCode, result.score, result.depth))
+
+
+class AIReply():
+    def __init__(self, code, ponderCode, score, depth):
+        self.code = code                #packed move to play, see GameStart.MoveFromCode
+        self.ponderCode = ponderCode    #expected answer (packed, in the position after code) or None
+        self.score = score
+        self.depth = depth
+
+
+class AIPlayer():
+    def __init__(self, movetime = 1.0, ponder = False, ttSizeMB = 16, bookFile = None):
+        self.movetime = movetime
+        self.ponder = ponder
+        self.ttSizeMB = ttSizeMB
+        self.bookFile = bookFile    #Polyglot .bin, None to always search
+        self.process = None
+        self.lastId = 0
+        self.currentId = None   #request whose answer Poll is waiting for
+        self.ponderId = None
+        self.ponderKey = None   #zobrist key of the position the ponder search is in
+        self.ponderStart = 0.0
+
+    def Start(self):
+        """start the worker process, Think does it on first use"""
+        if self.process is not None:
+            return
+        self.requests = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.wanted = multiprocessing.Value('q', 0)
+        self.ponderHit = multiprocessing.Value('q', 0)
+        self.ponderDeadline = multiprocessing.Value('d', 0.0)
+        self.process = multiprocessing.Process(target = _Worker, daemon = True,
+                                               args = (self.requests, self.results, self.wanted, self.ponderHit,
+                                                       self.ponderDeadline, self.ttSizeMB, self.bookFile))
+        self.process.start()
+
+    def Close(self):
+        if self.process is None:
+            return
+        self.Cancel()
+        self.requests.put(None)
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+
+    def Submit(self, gs, ponder):
+        self.Start()
+        self.lastId += 1
+        self.wanted.value = self.lastId
+        self.requests.put((self.lastId, pickle.dumps(gs), self.movetime, ponder))
+        return self.lastId
+
+    def Cancel(self):
+        """forget the running search (and ponder), call it whenever the position changes under the AI"""
+        if self.process is not None:
+            self.lastId += 1
+            self.wanted.value = self.lastId     #matches no request, whatever runs stops
+        self.currentId = None
+        self.ponderId = None
+
+    def IsThinking(self):
+        return self.currentId is not None
+
+    def Think(self, gs):
+        """start looking for a move in gs, or take over the ponder search if gs is the position it expected"""
+        if self.ponderId is not None and gs.zobristKey == self.ponderKey:
+            #the time already spent pondering counts, the answer comes at once when it covers movetime
+            self.ponderDeadline.value = max(time.time(), self.ponderStart + self.movetime)
+            self.ponderHit.value = self.ponderId
+            self.currentId = self.ponderId
+            self.ponderId = None
+            return
+        self.Cancel()
+        self.currentId = self.Submit(gs, False)
+
+    def Ponder(self, gs, ponderCode):
+        """after the AI moved in gs: search the position after the expected human reply while the human thinks"""
+        self.ponderId = None
+        if not self.ponder or ponderCode is None:
+            return
+        position = gs.copy()
+        position.makeMove(position.MoveFromCode(ponderCode))
+        self.ponderKey = position.zobristKey
+        self.ponderStart = time.time()
+        self.ponderId = self.Submit(position, True)
+
+    def Poll(self):
+        """AIReply for the current request once it is there, None while thinking (never blocks)"""
+        while self.currentId is not None:
+            try:
+                requestId, code, ponderCode, score, depth = self.results.get_nowait()
+            except queue.Empty:
+                return None
+            if requestId == self.currentId:
+                self.currentId = None
+                return AIReply(code, ponderCode, score, depth)
+        return None
@@ -0,0 +1,399 @@
+"""
+    Win/draw bitbases for the three basic endings, king and queen (KQK), king and rook (KRK) and king and pawn (KPK)
+    against a lone king, built by retrograde analysis. A table has one bit per position (side to move, strong king,
+    weak king, piece square) telling whether the strong side wins, 64KB each and 192KB for the three, so a probe
+    is an index computation and a bit test.
+    Generating takes a while in Python and is done once, the file is loaded on the first probe:
+
+        python ChessBitbase.py              # writes bitbases.bin next to this file
+        ChessBitbase.Probe(gs)              # 1 the side to move wins, 0 draw, -1 loses, None for other material
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BITBASE_PATH = os.path.join(HERE, "bitbases.bin")
+MAGIC = b"CPBB1\n"
+KINDS = ('Q', 'R', 'P')     #file order, KPK is built last because its promotions are looked up in KQK and KRK
+TABLE_SIZE = 1 << 19        #positions per table: 2 sides to move * 64 * 64 * 64
+KNOWN_WIN = 10000           #search score of a won bitbase position, below every mate score
+
+'''
+squares are row * 8 + col with row 0 the 8th rank as everywhere else, the strong side is always white here:
+positions with a black strong side are flipped top to bottom before the lookup
+'''
+def Index(weakToMove, strongKing, weakKing, piece):
+    return weakToMove << 18 | strongKing << 12 | weakKing << 6 | piece
+
+def _Steps(steps):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        table.append([(r + dr) * 8 + c + dc for dr, dc in steps if 0 <= r + dr < 8 and 0 <= c + dc < 8])
+    return table
+
+KING_STEPS = _Steps([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+KING_ZONE = [set(steps) for steps in KING_STEPS]
+PAWN_ATTACKS = [set(steps) for steps in _Steps([(-1, -1), (-1, 1)])]
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+DIRECTIONS = {'Q': ROOK_DIRECTIONS + BISHOP_DIRECTIONS, 'R': ROOK_DIRECTIONS}
+
+def _Rays(directions):
+    """RAYS[sq] = one list of squares per direction, nearest first"""
+    rays = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        lines = []
+        for dr, dc in directions:
+            line = []
+            row, col = r + dr, c + dc
+            while 0 <= row < 8 and 0 <= col < 8:
+                line.append(row * 8 + col)
+                row, col = row + dr, col + dc
+            lines.append(line)
+        rays.append(lines)
+    return rays
+
+RAYS = {kind: _Rays(directions) for kind, directions in DIRECTIONS.items()}
+
+def _Between(directions):
+    """BETWEEN[a][b] = bit mask of the squares strictly between a and b on a line, -1 when not on one line"""
+    table = [[-1] * 64 for sq in range(64)]
+    for a, lines in enumerate(_Rays(directions)):
+        for line in lines:
+            mask = 0
+            for b in line:
+                table[a][b] = mask
+                mask |= 1 << b
+    return table
+
+BETWEEN = {kind: _Between(directions) for kind, directions in DIRECTIONS.items()}
+
+def Attacks(kind, piece, target, occupied):
+    """does the strong piece on piece hit target, occupied is the bit mask of the other men on the board"""
+    if kind == 'P':
+        return target in PAWN_ATTACKS[piece]
+    between = BETWEEN[kind][piece][target]
+    return between != -1 and between & occupied == 0
+
+def IsValid(kind, weakToMove, strongKing, weakKing, piece):
+    if strongKing == weakKing or piece == strongKing or piece == weakKing or weakKing in KING_ZONE[strongKing]:
+        return False
+    if kind == 'P' and not 8 <= piece < 56:
+        return False
+    #the side that just moved cannot have left its king in check, the lone king never gives one
+    return weakToMove or not Attacks(kind, piece, weakKing, 1 << strongKing | 1 << weakKing)
+
+def WeakMoves(kind, strongKing, weakKing, piece):
+    """(squares the lone king can go to without taking, can it take the piece) in a legal position"""
+    occupied = 1 << strongKing  #the king itself does not block what attacks the squares behind it
+    squares = []
+    canTake = False
+    for sq in KING_STEPS[weakKing]:
+        if sq in KING_ZONE[strongKing] or sq == strongKing:
+            continue
+        if sq == piece:
+            canTake = piece not in KING_ZONE[strongKing]
+        elif not Attacks(kind, piece, sq, occupied):
+            squares.append(sq)
+    return squares, canTake
+
+def StrongUnmoves(kind, strongKing, weakKing, piece):
+    """positions with the strong side to move from which one of its moves reaches this one (weak side to move)"""
+    occupied = 1 << strongKing | 1 << weakKing
+    for sq in KING_STEPS[strongKing]:
+        if sq != piece and sq not in KING_ZONE[weakKing] and not Attacks(kind, piece, weakKing, 1 << sq | 1 << weakKing):
+            yield Index(0, sq, weakKing, piece)
+    if kind == 'P':
+        back = piece + 8
+        if back < 56 and not occupied >> back & 1:
+            if not Attacks(kind, back, weakKing, 0):
+                yield Index(0, strongKing, weakKing, back)
+            if piece // 8 == 4 and not occupied >> (back + 8) & 1 and not Attacks(kind, back + 8, weakKing, 0):
+                yield Index(0, strongKing, weakKing, back + 8)  #double step from the 2nd rank
+        return
+    for line in RAYS[kind][piece]:
+        for sq in line:
+            if occupied >> sq & 1:
+                break
+            if not Attacks(kind, sq, weakKing, occupied):
+                yield Index(0, strongKing, weakKing, sq)
+
+def Generate(kind, tables = None):
+    """
+    bytearray with a 1 for every position the strong side wins, see Index. Black to move mates are won, a position
+    with the strong side to move is won when one move reaches a won position, one with the weak side to move when
+    every move does; the wins are propagated backwards from the mates with a counter of unresolved moves per
+    position. tables must hold the KQK and KRK results (unpacked) for KPK promotions
+    """
+    won = bytearray(TABLE_SIZE)
+    left = bytearray(TABLE_SIZE)    #weak side to move: moves not yet known to lose, 255 when it can take the piece
+    queue = []
+    for strongKing in range(64):
+        for weakKing in range(64):
+            for piece in range(64):
+                if not IsValid(kind, 1, strongKing, weakKing, piece):
+                    continue
+                i = Index(1, strongKing, weakKing, piece)
+                squares, canTake = WeakMoves(kind, strongKing, weakKing, piece)
+                if canTake:
+                    left[i] = 255
+                elif squares:
+                    left[i] = len(squares)
+                elif Attacks(kind, piece, weakKing, 1 << strongKing):
+                    won[i] = 1  #mate, stalemate stays a draw
+                    queue.append(i)
+                if kind == 'P' and piece < 16 and IsValid(kind, 0, strongKing, weakKing, piece):
+                    #a promotion wins when the new queen (or rook, against stalemate) wins
+                    target = piece - 8
+                    if target != strongKing and target != weakKing:
+                        if tables['Q'][Index(1, strongKing, weakKing, target)] or \
+                           tables['R'][Index(1, strongKing, weakKing, target)]:
+                            j = Index(0, strongKing, weakKing, piece)
+                            won[j] = 1
+                            queue.append(j)
+
+    while queue:
+        i = queue.pop()
+        strongKing, weakKing, piece = i >> 12 & 63, i >> 6 & 63, i & 63
+        if i >> 18:
+            for j in StrongUnmoves(kind, strongKing, weakKing, piece):
+                if not won[j]:
+                    won[j] = 1
+                    queue.append(j)
+        else:
+            for sq in KING_STEPS[weakKing]:
+                if sq == piece or sq == strongKing or sq in KING_ZONE[strongKing]:
+                    continue
+                j = Index(1, strongKing, sq, piece)
+                if not won[j] and left[j] != 255 and IsValid(kind, 1, strongKing, sq, piece):
+                    left[j] -= 1
+                    if left[j] == 0:
+                        won[j] = 1
+                        queue.append(j)
+    return won
+
+def Pack(won):
+    bits = bytearray(len(won) // 8)
+    for i in range(0, len(won), 8):
+        byte = 0
+        for b in range(8):
+            byte |= won[i + b] << b
+        bits[i >> 3] = byte
+    return bytes(bits)
+
+def GenerateAll(log = None):
+    """{kind: packed table} for every kind"""
+    unpacked = {}
+    tables = {}
+    for kind in KINDS:
+        start = time.perf_counter()
+        unpacked[kind] = Generate(kind, unpacked)
+        tables[kind] = Pack(unpacked[kind])
+        if log is not None:
+            log("K%sK: %d won positions in %.1fs" % (kind.lower() if kind == 'P' else kind, sum(unpacked[kind]),
+                                                   time.perf_counter() - start))
+    return tables
+
+def Save(tables, path = None):
+    path = path or BITBASE_PATH
+    temp = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp, "wb") as f:
+        f.write(MAGIC)
+        for kind in KINDS:
+            f.write(tables[kind])
+    os.replace(temp, path)  #a probing process never sees half a file
+
+def Load(path = None):
+    """{kind: packed table} from path, empty when there is no (valid) file"""
+    try:
+        with open(path or BITBASE_PATH, "rb") as f:
+            data = f.read()
+    except OSError:
+        return {}
+    size = TABLE_SIZE // 8
+    if not data.startswith(MAGIC) or len(data) != len(MAGIC) + size * len(KINDS):
+        return {}
+    return {kind: data[len(MAGIC) + n * size:len(MAGIC) + (n + 1) * size] for n, kind in enumerate(KINDS)}
+
+_tables = None  #loaded on the first probe
+
+def Use(tables):
+    """probe these tables from now on (freshly generated ones, or {} to switch the bitbases off)"""
+    global _tables
+    _tables = tables
+
+def Material(gs):
+    """(kind, strong color, strong king, weak king, piece) when gs is KQK, KRK or KPK, else None"""
+    if gs.pieceCount != 3:  #kept by makeMove, the board is only looked at in three men endings
+        return None
+    men = []
+    for r in range(8):
+        row = gs.board[r]
+        for c in range(8):
+            if row[c] != '--':
+                men.append((row[c], r * 8 + c))
+    kings = {}
+    strong = None
+    for name, sq in men:
+        if name[1] == 'K':
+            kings[name[0]] = sq
+        elif name[1] in ('Q', 'R', 'p'):
+            strong = (name[1].upper(), name[0], sq)
+    if strong is None or len(kings) != 2:
+        return None
+    kind, color, piece = strong
+    return kind, color, kings[color], kings['b' if color == 'w' else 'w'], piece
+
+def Probe(gs):
+    """1 when the side to move wins, 0 for a draw, -1 when it loses, None when gs is not in a bitbase"""
+    global _tables
+    material = Material(gs)
+    if material is None:
+        return None
+    if _tables is None:
+        _tables = Load()
+    kind, color, strongKing, weakKing, piece = material
+    if kind not in _tables:
+        return None
+    strongToMove = gs.whiteToMove == (color == 'w')
+    if color == 'b':    #flip the board so the strong side plays up
+        strongKing, weakKing, piece = strongKing ^ 56, weakKing ^ 56, piece ^ 56
+    i = Index(0 if strongToMove else 1, strongKing, weakKing, piece)
+    if not _tables[kind][i >> 3] >> (i & 7) & 1:
+        return 0
+    return 1 if strongToMove else -1
+
+def Score(gs, result, evaluation):
+    """search score of a probed win or loss: KNOWN_WIN plus the evaluation and a push of the lone king to the edge"""
+    strong, weak = (gs.WhiteKingLocation, gs.BlackKingLocation) if (result > 0) == gs.whiteToMove else \
+                   (gs.BlackKingLocation, gs.WhiteKingLocation)
+    edge = max(3 - weak[0], weak[0] - 4) + max(3 - weak[1], weak[1] - 4)
+    distance = max(abs(strong[0] - weak[0]), abs(strong[1] - weak[1]))
+    bonus = KNOWN_WIN + 60 * edge + 20 * (7 - distance)     #mating needs the kings close and the lone one cornered
+    return evaluation + bonus if result > 0 else evaluation - bonus
+
+'''
+Verify checks the tables against GameStart, which knows nothing of how they were built. Solve is a plain minimax
+over the legal moves that only knows the rules: mate, stalemate, and the draw once the last strong piece is gone
+(taken, or promoted to a knight or bishop). Most positions are decided deeper than it can look, those are skipped
+'''
+SOLVE_DEPTH = 5
+EDGE = [sq for sq in range(64) if sq // 8 in (0, 7) or sq % 8 in (0, 7)]
+
+def Solve(gs, depth, known = None):
+    """
+    1 the side to move mates within depth plies, -1 it is mated, 0 it draws whatever happens, None not proven.
+    known is a dict to share results between calls: key -> (result, plies searched)
+    """
+    if known is not None:
+        entry = known.get(gs.zobristKey)
+        if entry is not None and (entry[0] is not None or entry[1] >= depth):
+            return entry[0]
+    result = _Solve(gs, depth, known)
+    if known is not None:
+        known[gs.zobristKey] = (result, depth)
+    return result
+
+def _Solve(gs, depth, known):
+    moves = gs.GetValidMove()
+    if not moves:
+        return -1 if gs.inCheck else 0
+    if depth == 0:
+        return None
+    best = -1
+    proven = True
+    lone = all(move.pieceMoved[1] == 'K' for move in moves)     #can not win, one unproven move and it is unproven
+    for move in moves:
+        gs.makeMove(move)
+        if gs.pieceCount == 2 or move.isPawnPromotion and move.promotionPiece in ('N', 'B'):
+            result = 0
+        else:
+            result = Solve(gs, depth - 1, known)
+        gs.undoMove()
+        if result is None:
+            if lone:
+                return None
+            proven = False
+        elif -result == 1:
+            return 1
+        else:
+            best = max(best, -result)
+    return best if proven else None
+
+def Backup(gs):
+    """result of gs from the probes one ply ahead (mate, stalemate and captures taken from the move generator)"""
+    moves = gs.GetValidMove()
+    if not moves:
+        return -1 if gs.inCheck else 0
+    outcomes = []
+    for move in moves:
+        gs.makeMove(move)
+        outcome = Probe(gs)     #None: bare kings after a capture, or a minor piece promotion
+        gs.undoMove()
+        outcomes.append(0 if outcome is None else -outcome)
+    return max(outcomes)
+
+def Verify(samples, seed = 1, backend = "mailbox", depth = SOLVE_DEPTH):
+    """
+    compare the bitbases with GameStart on random positions. Every probe has to agree with the probes one ply ahead
+    (see Backup), which still holds for a table that calls a drawn cycle won, and with the result Solve proves by
+    iterative deepening to depth plies, where it proves one. Returns (positions sampled, positions proven by
+    the search), raises AssertionError on the first mismatch
+    """
+    import ChessEngine
+    rng = random.Random(seed)
+    known = {}
+    sampled = checked = 0
+    while sampled < samples:
+        kind = rng.choice(KINDS)
+        strongKing, weakKing, piece = rng.randrange(64), rng.randrange(64), rng.randrange(64)
+        if rng.randrange(2):    #half of them with the lone king on the edge, where short mates are
+            weakKing = rng.choice(EDGE)
+        weakToMove = rng.randrange(2)
+        if not IsValid(kind, weakToMove, strongKing, weakKing, piece):
+            continue
+        rows = [['1'] * 8 for r in range(8)]
+        for sq, letter in ((strongKing, 'K'), (weakKing, 'k'), (piece, kind)):
+            rows[sq // 8][sq % 8] = letter
+        placement = "/".join("".join(row) for row in rows)
+        gs = ChessEngine.GameStart.fromFEN("%s %s - - 0 1" % (placement, 'b' if weakToMove else 'w'), backend)
+        gs.allowUnderpromotion = True   #a rook promotion can win where the queen stalemates
+        actual = Probe(gs)
+        expected = Backup(gs)
+        if actual != expected:
+            raise AssertionError("%s: bitbase says %d, its moves say %d" % (gs.toFEN(), actual, expected))
+        sampled += 1
+        for plies in range(1, depth + 1):
+            expected = Solve(gs, plies, known)
+            if expected is not None:
+                break
+        if expected is None:
+            continue
+        if actual != expected:
+            raise AssertionError("%s: bitbase says %d, a %d ply search says %d" % (gs.toFEN(), actual, plies, expected))
+        checked += 1
+    return sampled, checked
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "generate the KQK, KRK and KPK bitbases")
+    parser.add_argument("--output", default = BITBASE_PATH)
+    parser.add_argument("--verify", type = int, default = 0, metavar = "N",
+                        help = "then check N random positions against a brute force search")
+    parser.add_argument("--depth", type = int, default = SOLVE_DEPTH, help = "plies of the brute force search")
+    args = parser.parse_args(argv)
+    tables = GenerateAll(print)
+    Save(tables, args.output)
+    print("wrote %s (%d bytes)" % (args.output, os.path.getsize(args.output)))
+    if args.verify:
+        Use(tables)
+        print("%d positions sampled, %d proven by the search and matching" % Verify(args.verify, depth = args.depth))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,526 @@
+"""
+    Bitboard backend for GameStart. Every piece type of every color is kept in one 64 bit integer,
+    bit (row * 8 + col) is set when that piece stands on that square, so row 0 col 0 (a8) is bit 0
+    and row 7 col 7 (h1) is bit 63. Select it with ChessEngine.GameStart(backend="bitboard").
+"""
+
+from array import array
+
+import ChessEngine
+from ChessEngine import DOUBLE_PUSH, KING_CASTLE, QUEEN_CASTLE, CAPTURE, EP_CAPTURE, PROMOTION, PROMOTION_PIECES
+
+PIECES = ('wp', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bp', 'bR', 'bN', 'bB', 'bQ', 'bK')
+FULL = (1 << 64) - 1
+
+# (row step, col step, square step) for the 8 ray directions, the first 4 are orthogonal
+DIRECTIONS = ((-1, 0, -8), (0, -1, -1), (1, 0, 8), (0, 1, 1), (-1, -1, -9), (-1, 1, -7), (1, -1, 7), (1, 1, 9))
+
+def _OnBoard(r, c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+def _StepTable(steps):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        for dr, dc in steps:
+            if _OnBoard(r + dr, c + dc):
+                mask |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(mask)
+    return table
+
+'''
+Tables are built once when the module is imported
+'''
+KNIGHT_ATTACKS = _StepTable(((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)))
+KING_ATTACKS = _StepTable(((-1, -1), (-1, 1), (1, -1), (1, 1), (-1, 0), (1, 0), (0, 1), (0, -1)))
+# squares a pawn of the given color attacks from each square
+PAWN_ATTACKS = {'w': _StepTable(((-1, -1), (-1, 1))), 'b': _StepTable(((1, -1), (1, 1)))}
+
+RAYS = []  # RAYS[d][sq] every square from sq (excluded) to the edge of the board in direction d
+for _dr, _dc, _step in DIRECTIONS:
+    _table = []
+    for _sq in range(64):
+        _r, _c = divmod(_sq, 8)
+        _mask = 0
+        for _i in range(1, 8):
+            if not _OnBoard(_r + _dr * _i, _c + _dc * _i):
+                break
+            _mask |= 1 << ((_r + _dr * _i) * 8 + _c + _dc * _i)
+        _table.append(_mask)
+    RAYS.append(_table)
+
+RANK_4 = 0xFF << 32   # white double pushes land on row 4
+RANK_5 = 0xFF << 24   # black double pushes land on row 3
+PROMOTION_ROWS = (0xFF, 0xFF << 56)  # row 0 for white, row 7 for black
+PROMOTION_PIECE_CODES = (3, 2, 1, 0)   # queen first, index into PROMOTION_PIECES
+
+def RayAttacks(sq, occupied, d):
+    """squares attacked from sq in direction d, stopping at (and including) the first blocker"""
+    ray = RAYS[d][sq]
+    blockers = ray & occupied
+    if blockers:
+        if DIRECTIONS[d][2] > 0:
+            first = (blockers & -blockers).bit_length() - 1
+        else:
+            first = blockers.bit_length() - 1
+        ray ^= RAYS[d][first]
+    return ray
+
+'''
+Slider attacks only depend on the blockers on the rays, minus the last square of every ray (a piece there
+stops nothing further). They are computed ray by ray the first time a square meets a blocker pattern and
+looked up in a dict per square after that, a few thousand patterns per square at most
+'''
+def _RelevantMasks(directions):
+    masks = []
+    for sq in range(64):
+        mask = 0
+        for d in directions:
+            ray = RAYS[d][sq]
+            if ray:
+                last = ray.bit_length() - 1 if DIRECTIONS[d][2] > 0 else (ray & -ray).bit_length() - 1
+                mask |= ray ^ (1 << last)
+        masks.append(mask)
+    return masks
+
+ROOK_MASKS = _RelevantMasks(range(4))
+BISHOP_MASKS = _RelevantMasks(range(4, 8))
+ROOK_CACHE = [{} for sq in range(64)]
+BISHOP_CACHE = [{} for sq in range(64)]
+
+def RookAttacks(sq, occupied):
+    blockers = occupied & ROOK_MASKS[sq]
+    attacks = ROOK_CACHE[sq].get(blockers)
+    if attacks is None:
+        attacks = RayAttacks(sq, blockers, 0) | RayAttacks(sq, blockers, 1) | RayAttacks(sq, blockers, 2) | RayAttacks(sq, blockers, 3)
+        ROOK_CACHE[sq][blockers] = attacks
+    return attacks
+
+def BishopAttacks(sq, occupied):
+    blockers = occupied & BISHOP_MASKS[sq]
+    attacks = BISHOP_CACHE[sq].get(blockers)
+    if attacks is None:
+        attacks = RayAttacks(sq, blockers, 4) | RayAttacks(sq, blockers, 5) | RayAttacks(sq, blockers, 6) | RayAttacks(sq, blockers, 7)
+        BISHOP_CACHE[sq][blockers] = attacks
+    return attacks
+
+def Squares(bb):
+    """yield the index of every set bit, lowest first"""
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+class BitboardGameStart(ChessEngine.GameStart):
+    backend = "bitboard"
+    nativePackedMoves = True
+
+    def __init__(self, backend = "bitboard"):
+        self._boardView = None
+        super().__init__()
+
+    '''
+    board is only a view: it is built from the bitboards the first time someone reads it after a move.
+    It is read-only (8 tuples of 8 strings), a write to one square would never reach the bitboards.
+    Assigning a new 8x8 list of strings reloads every bitboard from it, makeMove is the way to change it.
+    '''
+    @property
+    def board(self):
+        if self._boardView is None:
+            squares = self.squares
+            self._boardView = tuple(tuple(squares[i:i + 8]) for i in range(0, 64, 8))
+        return self._boardView
+
+    @board.setter
+    def board(self, rows):
+        self.pieceBoards = {piece: 0 for piece in PIECES}
+        self.colorBoards = {'w': 0, 'b': 0}
+        self.occupied = 0
+        self.squares = ['--'] * 64
+        for r in range(8):
+            for c in range(8):
+                if rows[r][c] != '--':
+                    self._PutPiece(r * 8 + c, rows[r][c])
+                    if rows[r][c] == 'wK':
+                        self.WhiteKingLocation = (r, c)
+                    elif rows[r][c] == 'bK':
+                        self.BlackKingLocation = (r, c)
+        self._boardView = None
+
+    def _PutPiece(self, sq, piece):
+        bit = 1 << sq
+        self.pieceBoards[piece] |= bit
+        self.colorBoards[piece[0]] |= bit
+        self.occupied |= bit
+        self.squares[sq] = piece
+
+    def _RemovePiece(self, sq, piece):
+        bit = 1 << sq
+        self.pieceBoards[piece] ^= bit
+        self.colorBoards[piece[0]] ^= bit
+        self.occupied ^= bit
+        self.squares[sq] = '--'
+
+    def makeMove(self, move):
+        record = self.SaveUndo()
+        start = move.startRow * 8 + move.startCol
+        end = move.endRow * 8 + move.endCol
+        color = move.pieceMoved[0]
+        self._RemovePiece(start, move.pieceMoved)
+        if move.isEnpassant:
+            capturedSq = move.startRow * 8 + move.endCol
+            move.pieceCaptured = self.squares[capturedSq]
+            self._RemovePiece(capturedSq, move.pieceCaptured)
+        elif move.pieceCaptured != '--':
+            self._RemovePiece(end, move.pieceCaptured)
+        record.captured = move.pieceCaptured
+        self.halfmoveClock = 0 if move.pieceMoved[1] == 'p' or move.pieceCaptured != '--' else self.halfmoveClock + 1
+        self._PutPiece(end, color + move.promotionPiece if move.isPawnPromotion else move.pieceMoved)
+
+        if move.isCastle:
+            if move.endCol - move.startCol == 2:    #king side castle
+                self._RemovePiece(end + 1, color + 'R')
+                self._PutPiece(end - 1, color + 'R')
+            else:   #queen side castle
+                self._RemovePiece(end - 2, color + 'R')
+                self._PutPiece(end + 1, color + 'R')
+
+        if move.pieceMoved == 'wK':
+            self.WhiteKingLocation = (move.endRow, move.endCol)
+        elif move.pieceMoved == 'bK':
+            self.BlackKingLocation = (move.endRow, move.endCol)
+
+        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
+            self.enpassantPossible = ((move.endRow + move.startRow) // 2, move.startCol)
+        else:
+            self.enpassantPossible = ()
+
+        self.moveLog.append(move)
+        self.whiteToMove = not self.whiteToMove
+        self.updateCastleRights(move)
+        self.UpdateZobristKey(move, record)
+        self.UpdateEval(move)
+        self._boardView = None
+
+    def undoMove(self):
+        if len(self.moveLog) == 0:
+            return
+        move = self.moveLog.pop()
+        record = self.undoStack[len(self.moveLog)]
+        start = move.startRow * 8 + move.startCol
+        end = move.endRow * 8 + move.endCol
+        color = move.pieceMoved[0]
+        self._RemovePiece(end, self.squares[end])
+        self._PutPiece(start, move.pieceMoved)
+        if move.isEnpassant:
+            self._PutPiece(move.startRow * 8 + move.endCol, record.captured)
+        elif record.captured != '--':
+            self._PutPiece(end, record.captured)
+
+        if move.isCastle:
+            if move.endCol - move.startCol == 2:
+                self._RemovePiece(end - 1, color + 'R')
+                self._PutPiece(end + 1, color + 'R')
+            else:
+                self._RemovePiece(end + 1, color + 'R')
+                self._PutPiece(end - 2, color + 'R')
+
+        self.whiteToMove = not self.whiteToMove
+        self.RestoreUndo(record)
+        self._boardView = None
+
+    def AttackersOf(self, sq, byColor, occupied = None, removed = 0):
+        """bitboard of byColor pieces attacking sq. occupied/removed let callers ask about a board
+        where some pieces have already moved away or been captured"""
+        if occupied is None:
+            occupied = self.occupied
+        keep = ~removed
+        pb = self.pieceBoards
+        enemy = 'b' if byColor == 'w' else 'w'
+        queens = pb[byColor + 'Q']
+        attackers = KNIGHT_ATTACKS[sq] & pb[byColor + 'N']
+        attackers |= KING_ATTACKS[sq] & pb[byColor + 'K']
+        attackers |= PAWN_ATTACKS[enemy][sq] & pb[byColor + 'p']   #a pawn attacks sq if sq's own pawn attack pattern hits it
+        attackers |= RookAttacks(sq, occupied) & (pb[byColor + 'R'] | queens)
+        attackers |= BishopAttacks(sq, occupied) & (pb[byColor + 'B'] | queens)
+        return attackers & keep
+
+    def SquareIsAttacked(self, r, c):
+        return self.AttackersOf(r * 8 + c, 'b' if self.whiteToMove else 'w') != 0
+
+    def isSquareAttacked(self, sq, byColor):
+        return self.AttackersOf(sq, byColor) != 0
+
+    def InCheck(self):
+        color = 'w' if self.whiteToMove else 'b'
+        return self.AttackersOf(self.pieceBoards[color + 'K'].bit_length() - 1, 'b' if self.whiteToMove else 'w') != 0
+
+    def PinnedPieces(self, color, kingSq):
+        """bitboard of color's pieces that stand alone between their king and an enemy slider"""
+        enemy = 'b' if color == 'w' else 'w'
+        pb = self.pieceBoards
+        own = self.colorBoards[color]
+        occupied = self.occupied
+        straight = pb[enemy + 'R'] | pb[enemy + 'Q']
+        diagonal = pb[enemy + 'B'] | pb[enemy + 'Q']
+        pinned = 0
+        for d in range(8):
+            sliders = straight if d < 4 else diagonal
+            if RAYS[d][kingSq] & sliders:
+                blocker = RayAttacks(kingSq, occupied, d) & own
+                if blocker and RayAttacks(kingSq, occupied ^ blocker, d) & sliders:
+                    pinned |= blocker
+        return pinned
+
+    def _KingSafeAfter(self, code, color, enemy, kingSq):
+        """true if the packed move does not leave color's king attacked"""
+        start = code & 63
+        end = (code >> 6) & 63
+        occupied = (self.occupied & ~(1 << start)) | (1 << end)
+        removed = 1 << end
+        if code >> 12 == EP_CAPTURE:
+            capturedSq = (start & ~7) | (end & 7)
+            occupied &= ~(1 << capturedSq)
+            removed |= 1 << capturedSq
+        if start == kingSq:
+            kingSq = end
+        return self.AttackersOf(kingSq, enemy, occupied, removed) == 0
+
+    def GeneratePseudoPacked(self, codes):
+        """append the pseudo legal moves of the side to move (castling excluded) to codes as packed ints"""
+        color = 'w' if self.whiteToMove else 'b'
+        enemy = 'b' if self.whiteToMove else 'w'
+        self.GenerateCapturesPacked(color, enemy, codes.append)
+        self.GenerateQuietsPacked(color, enemy, codes.append)
+
+    def _PieceReach(self, kind, sq, occupied):
+        if kind == 'N':
+            return KNIGHT_ATTACKS[sq]
+        if kind == 'B':
+            return BishopAttacks(sq, occupied)
+        if kind == 'R':
+            return RookAttacks(sq, occupied)
+        if kind == 'Q':
+            return RookAttacks(sq, occupied) | BishopAttacks(sq, occupied)
+        return KING_ATTACKS[sq]
+
+    def GenerateCapturesPacked(self, color, enemy, append):
+        """pseudo legal captures, enpassant and promotions (quiet pushes to the last row too) of color"""
+        pb = self.pieceBoards
+        occupied = self.occupied
+        enemies = self.colorBoards[enemy]
+        pawns = pb[color + 'p']
+        promotionRow = PROMOTION_ROWS[0] if color == 'w' else PROMOTION_ROWS[1]
+        promotions = PROMOTION_PIECE_CODES if self.allowUnderpromotion else (3,)
+
+        step = -8 if color == 'w' else 8
+        single = (pawns >> 8 if color == 'w' else pawns << 8) & ~occupied & promotionRow
+        for to in Squares(single):
+            for piece in promotions:
+                append((to - step) | to << 6 | (PROMOTION | piece) << 12)
+        epBit = 0
+        if self.enpassantPossible != ():
+            epBit = 1 << (self.enpassantPossible[0] * 8 + self.enpassantPossible[1])
+        for sq in Squares(pawns):
+            attacks = PAWN_ATTACKS[color][sq]
+            for to in Squares(attacks & enemies):
+                if (1 << to) & promotionRow:
+                    for piece in promotions:
+                        append(sq | to << 6 | (PROMOTION | CAPTURE | piece) << 12)
+                else:
+                    append(sq | to << 6 | CAPTURE << 12)
+            if attacks & epBit:
+                append(sq | (epBit.bit_length() - 1) << 6 | EP_CAPTURE << 12)
+
+        capture = CAPTURE << 12
+        for kind in 'NBRQK':
+            for sq in Squares(pb[color + kind]):
+                targets = self._PieceReach(kind, sq, occupied) & enemies
+                while targets:  #Squares inlined, this loop and the one of the quiet moves are the hot ones
+                    low = targets & -targets
+                    append(sq | (low.bit_length() - 1) << 6 | capture)
+                    targets ^= low
+
+    def GenerateQuietsPacked(self, color, enemy, append):
+        """pseudo legal moves of color that capture nothing and do not promote, castling excluded"""
+        pb = self.pieceBoards
+        occupied = self.occupied
+        empty = FULL & ~occupied
+        pawns = pb[color + 'p']
+        promotionRow = PROMOTION_ROWS[0] if color == 'w' else PROMOTION_ROWS[1]
+        if color == 'w':
+            step = -8
+            single = (pawns >> 8) & empty
+            double = ((single >> 8) & empty) & RANK_4
+        else:
+            step = 8
+            single = (pawns << 8) & empty
+            double = ((single << 8) & empty) & RANK_5
+        for to in Squares(single & ~promotionRow):
+            append((to - step) | to << 6)
+        for to in Squares(double):
+            append((to - 2 * step) | to << 6 | DOUBLE_PUSH << 12)
+
+        for kind in 'NBRQK':
+            for sq in Squares(pb[color + kind]):
+                targets = self._PieceReach(kind, sq, occupied) & empty
+                while targets:
+                    low = targets & -targets
+                    append(sq | (low.bit_length() - 1) << 6)
+                    targets ^= low
+
+    def GenerateCastlePacked(self, color, enemy, append):
+        home = 60 if color == 'w' else 4
+        if not self.pieceBoards[color + 'K'] & (1 << home):
+            return
+        rights = self.currentCastlingRights
+        kingSide = rights.wks if color == 'w' else rights.bks
+        queenSide = rights.wqs if color == 'w' else rights.bqs
+        rook = self.pieceBoards[color + 'R']
+        if kingSide and rook & (1 << (home + 3)) and not self.occupied & (0b11 << (home + 1)):
+            if not self.AttackersOf(home + 1, enemy) and not self.AttackersOf(home + 2, enemy):
+                append(home | (home + 2) << 6 | KING_CASTLE << 12)
+        if queenSide and rook & (1 << (home - 4)) and not self.occupied & (0b111 << (home - 3)):
+            if not self.AttackersOf(home - 1, enemy) and not self.AttackersOf(home - 2, enemy):
+                append(home | (home - 2) << 6 | QUEEN_CASTLE << 12)
+
+    '''
+    The legality context belongs to one position. A staged generator keeps its own copy in local variables:
+    while it is suspended the search expands children, and their generation overwrites inCheck / checks / pins
+    '''
+    def _LegalityContext(self):
+        """(color, enemy, king square, pinned pieces, checkers) of the side to move, also sets inCheck and checks"""
+        color = 'w' if self.whiteToMove else 'b'
+        enemy = 'b' if self.whiteToMove else 'w'
+        kingSq = self.pieceBoards[color + 'K'].bit_length() - 1
+        checkers = self.AttackersOf(kingSq, enemy)
+        self.checks = [divmod(sq, 8) for sq in Squares(checkers)]
+        self.inCheck = checkers != 0
+        self.pins = []
+        return color, enemy, kingSq, self.PinnedPieces(color, kingSq), checkers
+
+    def _IsLegal(self, code, color, enemy, kingSq, pinned, checkers):
+        start = code & 63
+        #only king moves, pinned pieces, enpassant and check evasions can leave the king attacked
+        if checkers or start == kingSq or (pinned >> start) & 1 or code >> 12 == EP_CAPTURE:
+            return self._KingSafeAfter(code, color, enemy, kingSq)
+        return True
+
+    def GetValidMovesPacked(self, out = None):
+        """legal moves as packed ints without building a Move for any of them. Also sets inCheck, checks,
+        checkMate, staleMate and drawByRule like GetValidMove. Pass out to refill a buffer you keep per ply"""
+        if out is None:
+            out = array('H')
+        color, enemy, kingSq, pinned, checkers = self._LegalityContext()
+        pseudo = array('H')
+        self.GeneratePseudoPacked(pseudo)
+        if not checkers:
+            self.GenerateCastlePacked(color, enemy, pseudo.append)
+        del out[:]
+        if checkers:
+            for code in pseudo:
+                if self._KingSafeAfter(code, color, enemy, kingSq):
+                    out.append(code)
+        else:   #_IsLegal inlined, most moves need no look at the king at all
+            careful = pinned | 1 << kingSq
+            for code in pseudo:
+                if careful >> (code & 63) & 1 or code >> 12 == EP_CAPTURE:
+                    if not self._KingSafeAfter(code, color, enemy, kingSq):
+                        continue
+                out.append(code)
+
+        self.checkMate = self.inCheck and len(out) == 0
+        self.staleMate = not self.inCheck and len(out) == 0
+        self.drawByRule = self.GetDrawByRule() if len(out) else None
+        return out
+
+    def GenerateMovesPacked(self, first = None):
+        """
+        Packed legal moves in stages: first (if it is legal here), captures and promotions, then quiet moves
+        and castling. Quiet moves are only generated once the captures are used up, and every move is checked
+        for legality only when it is its turn. Undo whatever you made before resuming the generator.
+        """
+        color, enemy, kingSq, pinned, checkers = self._LegalityContext()
+        captures = array('H')
+        self.GenerateCapturesPacked(color, enemy, captures.append)
+        quiets = None
+        if first is not None:
+            if first not in captures:
+                quiets = array('H')
+                self.GenerateQuietsPacked(color, enemy, quiets.append)
+                if not checkers:
+                    self.GenerateCastlePacked(color, enemy, quiets.append)
+                if first not in quiets:
+                    first = None
+            if first is not None and self._IsLegal(first, color, enemy, kingSq, pinned, checkers):
+                yield first
+        for code in captures:
+            if code != first and self._IsLegal(code, color, enemy, kingSq, pinned, checkers):
+                yield code
+        if quiets is None:
+            quiets = array('H')
+            self.GenerateQuietsPacked(color, enemy, quiets.append)
+            if not checkers:
+                self.GenerateCastlePacked(color, enemy, quiets.append)
+        for code in quiets:
+            if code != first and self._IsLegal(code, color, enemy, kingSq, pinned, checkers):
+                yield code
+
+    def GenerateStages(self):
+        color, enemy, kingSq, pinned, checkers = self._LegalityContext()
+        captures = array('H')
+        self.GenerateCapturesPacked(color, enemy, captures.append)
+        yield [self.MoveFromCode(code) for code in captures if self._IsLegal(code, color, enemy, kingSq, pinned, checkers)]
+        quiets = array('H')
+        self.GenerateQuietsPacked(color, enemy, quiets.append)
+        if not checkers:
+            self.GenerateCastlePacked(color, enemy, quiets.append)
+        yield [self.MoveFromCode(code) for code in quiets if self._IsLegal(code, color, enemy, kingSq, pinned, checkers)]
+
+    def GenerateMoves(self, first = None):
+        for code in self.GenerateMovesPacked(first):
+            yield self.MoveFromCode(code)
+
+    def hasLegalMove(self):
+        """king moves first since they are the cheapest to rule out, then everything else"""
+        color, enemy, kingSq, pinned, checkers = self._LegalityContext()
+        targets = KING_ATTACKS[kingSq] & ~self.colorBoards[color]
+        for to in Squares(targets):
+            if self._KingSafeAfter(kingSq | to << 6, color, enemy, kingSq):
+                return True
+        if checkers & (checkers - 1):
+            return False    #double check, only the king could move
+        codes = array('H')
+        self.GenerateCapturesPacked(color, enemy, codes.append)
+        self.GenerateQuietsPacked(color, enemy, codes.append)
+        for code in codes:
+            if (code & 63) != kingSq and self._IsLegal(code, color, enemy, kingSq, pinned, checkers):
+                return True
+        return False
+
+    def MoveFromCode(self, code):
+        start = code & 63
+        end = (code >> 6) & 63
+        flags = code >> 12
+        move = ChessEngine.Move.FromPieces((start >> 3, start & 7), (end >> 3, end & 7), self.squares[start],
+                                           self.squares[end], flags == EP_CAPTURE, flags == KING_CASTLE or flags == QUEEN_CASTLE)
+        if flags & PROMOTION and flags & 3 != 3:
+            move = move.WithPromotion(PROMOTION_PIECES[flags & 3])
+        return move
+
+    def GetAllPossibleMove(self):
+        """pseudo legal moves for the side to move, castling excluded"""
+        codes = array('H')
+        self.GeneratePseudoPacked(codes)
+        return [self.MoveFromCode(code) for code in codes]
+
+    def GetCastleMoves(self, r, c, moves):
+        codes = array('H')
+        self.GenerateCastlePacked('w' if self.whiteToMove else 'b', 'b' if self.whiteToMove else 'w', codes.append)
+        moves.extend(self.MoveFromCode(code) for code in codes)
+
+    def GetValidMove(self):
+        """legal moves as Move objects, built from GetValidMovesPacked"""
+        return [self.MoveFromCode(code) for code in self.GetValidMovesPacked()]
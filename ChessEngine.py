@@ -2,10 +2,82 @@
     This class responsible for store all information about chess state and all valid move at the current state
 """
 
-from asyncio.windows_events import NULL
+from array import array
+import ChessEval
+import ChessHash
+
+'''
+Packed moves are 16 bit ints: bits 0-5 start square, bits 6-11 end square (square = row * 8 + col)
+and bits 12-15 the flags below. GetValidMovesPacked returns them in an array('H').
+'''
+QUIET = 0
+DOUBLE_PUSH = 1
+KING_CASTLE = 2
+QUEEN_CASTLE = 3
+CAPTURE = 4
+EP_CAPTURE = 5
+PROMOTION = 8   #or'd with CAPTURE for a capturing promotion, the low 2 bits pick the piece
+PROMOTION_PIECES = ('N', 'B', 'R', 'Q')
+
+'''
+Attack tables built once at import. They are indexed by square = row * 8 + col and hold (row, col)
+tuples so the result can index board directly, every square in them is on the board.
+'''
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))   #first 4 orthogonal, last 4 diagonal
+KNIGHT_STEPS = ((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2))
+KING_STEPS = ((-1, -1), (-1, 1), (1, -1), (1, 1), (-1, 0), (1, 0), (0, 1), (0, -1))
+
+def BuildStepTable(steps):
+    return [tuple((sq // 8 + dr, sq % 8 + dc) for dr, dc in steps if 0 <= sq // 8 + dr < 8 and 0 <= sq % 8 + dc < 8)
+            for sq in range(64)]
+
+def BuildRayTable():
+    """RAY_TABLE[sq][d] is every square from sq (excluded) to the edge in DIRECTIONS[d], nearest first"""
+    table = []
+    for sq in range(64):
+        rays = []
+        for dr, dc in DIRECTIONS:
+            rays.append(tuple((sq // 8 + dr * i, sq % 8 + dc * i) for i in range(1, 8)
+                              if 0 <= sq // 8 + dr * i < 8 and 0 <= sq % 8 + dc * i < 8))
+        table.append(tuple(rays))
+    return table
+
+KNIGHT_TABLE = BuildStepTable(KNIGHT_STEPS)
+KING_TABLE = BuildStepTable(KING_STEPS)
+PAWN_ATTACKER_TABLE = {'w': BuildStepTable(((1, -1), (1, 1))),     #where a white pawn attacking sq stands
+                       'b': BuildStepTable(((-1, -1), (-1, 1)))}
+RAY_TABLE = BuildRayTable()
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_PIECES = {'p': 'p', 'r': 'R', 'n': 'N', 'b': 'B', 'q': 'Q', 'k': 'K'}
+UNDO_RESERVE = 128  #undo records made with every GameStart, the stack doubles when a game goes deeper
+FIFTY_MOVE_PLIES = 100  #halfmove clock at which the game is drawn by the fifty move rule
+#(castle mask bit, row, rook col, color): a castling right needs its king and rook on these home squares
+CASTLE_HOMES = ((1, 7, 7, 'w'), (2, 7, 0, 'w'), (4, 0, 7, 'b'), (8, 0, 0, 'b'))
 
 class GameStart():
-    def __init__(self):
+    backend = "mailbox"
+    allowUnderpromotion = False     #the UI always promotes to a queen, perft needs the knight, bishop and rook promotions too
+    nativePackedMoves = False       #True when GetValidMovesPacked is cheaper than GetValidMove, not a wrapper around it
+    #move generator of every piece type, looked up by name on each call so a wrapped method (ChessInstrument) is seen
+    moveFunc = {'p' : 'GetPawnMoves',
+                'R' : 'GetRookMoves',
+                'N' : 'GetKnightMoves',
+                'B' : 'GetBishopMoves',
+                'Q' : 'GetQueenMoves',
+                'K' : 'GetKingMoves'}
+
+    def __new__(cls, backend = "mailbox"):
+        """ backend can be "mailbox" (list of lists of strings, the default) or "bitboard"
+            (one 64 bit integer per piece, see ChessBitboard) """
+        if backend == "bitboard" and cls is GameStart:
+            from ChessBitboard import BitboardGameStart
+            cls = BitboardGameStart
+        elif backend not in ("mailbox", "bitboard"):
+            raise ValueError("unknown backend: " + str(backend))
+        return super().__new__(cls)
+
+    def __init__(self, backend = "mailbox"):
         """ The Board is size 8x8 with each elenment contain 2 character.
             The First character represent for color of pieces which is black or white 
             The Second character represent for type of pieces which can be rook, knight, bishop, queen, king or pawn
@@ -20,31 +92,271 @@ class GameStart():
             ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"],
         ]
-        self.moveFunc = {'p' : self.GetPawnMoves,
-                         'R' : self.GetRookMoves,
-                         'N' : self.GetKnightMoves,
-                         'B' : self.GetBishopMoves,
-                         'Q' : self.GetQueenMoves,
-                         'K' : self.GetKingMoves}
-
         self.whiteToMove = True
         self.moveLog = []
         self.WhiteKingLocation = (7, 4)
         self.BlackKingLocation = (0, 4)
         self.checkMate = False
         self.staleMate = False
+        self.drawByRule = None  #"repetition" or "fifty moves" when GetValidMove finds the game drawn by rule
         self.inCheck = False
         self.pins = []
         self.checks = []
 
         self.enpassantPossible = () #location of enpassant square
-        self.enpassantPossibleLog = []
-
         self.currentCastlingRights = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.wqs, 
-                                                    self.currentCastlingRights.bks, self.currentCastlingRights.bqs)]
+        self.undoStack = [UndoRecord() for i in range(UNDO_RESERVE)]    #undoStack[ply] is filled by the move made at ply
+        self.halfmoveClock = 0  #plies since the last capture or pawn move, kept by makeMove/undoMove
+        self.priorKeys = []     #keys of the positions before the one the game started from, back to its last irreversible move
+        #fullmove counter of the position the game started from, toFEN adds the moves made since
+        self.startFullmoveNumber = 1
+        self.startWhiteToMove = True
+        self.ResetZobristKey()
+        self.ResetEval()
+
+    @classmethod
+    def fromFEN(cls, fen, backend = "mailbox"):
+        """new game set up from a FEN string (the move counters are optional, so EPD positions work too)"""
+        gs = cls(backend)
+        gs.SetFEN(fen)
+        return gs
+
+    def SetFEN(self, fen):
+        """replace the position with the one in fen and forget the move history, raises ValueError on a bad FEN"""
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: " + fen)
+        board = []
+        for rank in fields[0].split('/'):
+            row = []
+            for ch in rank:
+                if ch.isdigit():
+                    row.extend(['--'] * int(ch))
+                elif ch.lower() in FEN_PIECES:
+                    row.append(('w' if ch.isupper() else 'b') + FEN_PIECES[ch.lower()])
+                else:
+                    raise ValueError("bad piece '%s' in FEN: %s" % (ch, fen))
+            if len(row) != 8:
+                raise ValueError("rank '%s' is not 8 squares: %s" % (rank, fen))
+            board.append(row)
+        if len(board) != 8 or fields[1] not in ('w', 'b'):
+            raise ValueError("bad FEN: " + fen)
+        for king in ('wK', 'bK'):
+            if sum(row.count(king) for row in board) != 1:
+                raise ValueError("FEN needs exactly one %s king: %s" % ("white" if king == 'wK' else "black", fen))
+
+        castling = fields[2]
+        castleMask = ('K' in castling) | ('Q' in castling) << 1 | ('k' in castling) << 2 | ('q' in castling) << 3
+        for bit, row, rookCol, color in CASTLE_HOMES:
+            if board[row][4] != color + 'K' or board[row][rookCol] != color + 'R':
+                castleMask &= ~bit  #the FEN claims a right the board no longer has
+        if fields[3] == '-':
+            enpassant = ()
+        elif len(fields[3]) != 2 or fields[3][0] not in "abcdefgh" or fields[3][1] not in "36":
+            raise ValueError("bad enpassant square '%s' in FEN: %s" % (fields[3], fen))
+        else:
+            enpassant = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        counters = [int(field) for field in fields[4:6] if field.isdigit()]    #EPD has operations here instead
+        self.SetPosition(board, fields[1] == 'w', castleMask, enpassant, counters[0] if len(counters) > 0 else 0,
+                         counters[1] if len(counters) > 1 else 1)
+        row, col = self.BlackKingLocation if self.whiteToMove else self.WhiteKingLocation
+        if self.isSquareAttacked(row * 8 + col, 'w' if self.whiteToMove else 'b'):
+            raise ValueError("the side that just moved is in check: " + fen)
+
+    def SetPosition(self, board, whiteToMove, castleMask, enpassant, halfmoveClock = 0, fullmoveNumber = 1, priorKeys = ()):
+        """
+        replace the position and forget the move history, board is 8 lists of 8 piece strings (kept, not copied).
+        priorKeys are the keys of the positions that led here (oldest first) for the repetition rule, see RecentKeys
+        """
+        self.board = board
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == 'wK':
+                    self.WhiteKingLocation = (r, c)
+                elif board[r][c] == 'bK':
+                    self.BlackKingLocation = (r, c)
+        self.whiteToMove = whiteToMove
+        self.currentCastlingRights = CastleRights(False, False, False, False)
+        self.currentCastlingRights.SetMask(castleMask)
+        self.enpassantPossible = enpassant
+        self.moveLog = []
+        self.checkMate = self.staleMate = self.inCheck = False
+        self.drawByRule = None
+        self.pins = []
+        self.checks = []
+        self.halfmoveClock = halfmoveClock
+        self.priorKeys = list(priorKeys)[-halfmoveClock:] if halfmoveClock else []
+        self.startFullmoveNumber = fullmoveNumber
+        self.startWhiteToMove = whiteToMove
+        self.ResetZobristKey()
+        self.ResetEval()
+
+    '''
+    Pickles (worker processes, ChessAI) and copy() carry the position only, never the Move objects of the history:
+    the copy starts its own history where the original is now, like a game set up from a FEN.
+    '''
+    def __getstate__(self):
+        rights = self.currentCastlingRights
+        state = {"squares": [piece for row in self.board for piece in row], "whiteToMove": self.whiteToMove,
+                 "castle": rights.Mask(), "enpassant": self.enpassantPossible,
+                 "halfmove": self.halfmoveClock, "fullmove": self.GetFullmoveNumber(), "keys": self.RecentKeys(),
+                 "checkMate": self.checkMate, "staleMate": self.staleMate, "drawByRule": self.drawByRule}
+        if "allowUnderpromotion" in self.__dict__:
+            state["allowUnderpromotion"] = self.allowUnderpromotion
+        return state
+
+    def __setstate__(self, state):
+        squares = state["squares"]
+        self.undoStack = [UndoRecord() for i in range(UNDO_RESERVE)]
+        if "allowUnderpromotion" in state:
+            self.allowUnderpromotion = state["allowUnderpromotion"]
+        self.SetPosition([squares[i:i + 8] for i in range(0, 64, 8)], state["whiteToMove"], state["castle"],
+                         state["enpassant"], state["halfmove"], state["fullmove"], state["keys"])
+        self.checkMate = state["checkMate"]
+        self.staleMate = state["staleMate"]
+        self.drawByRule = state["drawByRule"]
+
+    def copy(self):
+        """independent GameStart (same backend) at this position, without the move history"""
+        gs = self.__class__.__new__(self.__class__)
+        gs.__setstate__(self.__getstate__())
+        return gs
+
+    def toFEN(self):
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1].upper() if piece[0] == 'w' else piece[1].lower()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        rights = self.currentCastlingRights
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        if self.enpassantPossible == ():
+            enpassant = "-"
+        else:
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        return "%s %s %s %s %d %d" % ("/".join(ranks), "w" if self.whiteToMove else "b", castling or "-", enpassant,
+                                      self.GetHalfmoveClock(), self.GetFullmoveNumber())
+
+    def GetHalfmoveClock(self):
+        """plies since the last capture or pawn move"""
+        return self.halfmoveClock
+
+    '''
+    The keys of earlier positions are already in the undo stack (record.key is the key before the move of that ply).
+    A capture or pawn move can never be undone on the board, so a repetition is only looked for as far back as
+    the halfmove clock goes, and only among positions with the same side to move: at most 50 compares, usually none.
+    '''
+    def RepetitionCount(self, limit = 3):
+        """how many times the current position has occurred, counting stops at limit"""
+        clock = self.halfmoveClock
+        if clock < 4:
+            return 1
+        key = self.zobristKey
+        stack = self.undoStack
+        priorKeys = self.priorKeys
+        ply = len(self.moveLog)
+        oldest = max(ply - clock, -len(priorKeys))     #negative plies are positions from before the game started
+        count = 1
+        for i in range(ply - 4, oldest - 1, -2):
+            if (stack[i].key if i >= 0 else priorKeys[i]) == key:
+                count += 1
+                if count >= limit:
+                    break
+        return count
+
+    def RecentKeys(self):
+        """keys of the positions before this one back to the last irreversible move, oldest first"""
+        ply = len(self.moveLog)
+        keys = [record.key for record in self.undoStack[max(0, ply - self.halfmoveClock):ply]]
+        missing = self.halfmoveClock - len(keys)
+        if missing > 0 and self.priorKeys:
+            keys = self.priorKeys[-missing:] + keys
+        return keys
+
+    def IsDrawByRule(self, repetitions = 3):
+        """fifty move rule or the position seen repetitions times, does not look for a mate on the 100th ply"""
+        if self.halfmoveClock < 4:
+            return False
+        return self.halfmoveClock >= FIFTY_MOVE_PLIES or self.RepetitionCount(repetitions) >= repetitions
+
+    def GetDrawByRule(self):
+        """'fifty moves', 'repetition' (threefold) or None"""
+        if self.halfmoveClock >= FIFTY_MOVE_PLIES:
+            return "fifty moves"
+        if self.RepetitionCount(3) >= 3:
+            return "repetition"
+        return None
+
+    def GetFullmoveNumber(self):
+        plies = len(self.moveLog) + (0 if self.startWhiteToMove else 1)
+        return self.startFullmoveNumber + plies // 2
+
+    def ResetZobristKey(self):
+        """recompute the position key from scratch, call it after setting up a position by hand"""
+        self.zobristKey = ChessHash.ComputeKey(self)
+
+    def UpdateZobristKey(self, move, record):
+        """called at the end of makeMove, record holds the castling rights and enpassant square before the move, O(1)"""
+        self.zobristKey = ChessHash.MoveKey(self.zobristKey, move, record.castle, self.currentCastlingRights.Mask(),
+                                            record.enpassant, self.enpassantPossible)
+
+    def ResetEval(self):
+        """recompute the running evaluation terms from scratch, call it after setting up a position by hand"""
+        self.mgScore, self.egScore, self.phase, self.pieceCount = ChessEval.ComputeScores(self)
+
+    def UpdateEval(self, move):
+        """called at the end of makeMove, see ChessEval.MoveDelta"""
+        mg, eg, phase = ChessEval.MoveDelta(move)
+        self.mgScore += mg
+        self.egScore += eg
+        self.phase += phase
+        if move.pieceCaptured != '--':
+            self.pieceCount -= 1
+
+    def SaveUndo(self):
+        """fill the undo record of the ply about to be played with the state makeMove changes, returns the record"""
+        ply = len(self.moveLog)
+        stack = self.undoStack
+        if ply == len(stack):
+            stack.extend([UndoRecord() for i in range(len(stack) or UNDO_RESERVE)])
+        record = stack[ply]
+        record.castle = self.currentCastlingRights.Mask()
+        record.enpassant = self.enpassantPossible
+        record.whiteKing = self.WhiteKingLocation
+        record.blackKing = self.BlackKingLocation
+        record.key = self.zobristKey
+        record.mg = self.mgScore
+        record.eg = self.egScore
+        record.phase = self.phase
+        record.pieceCount = self.pieceCount
+        record.halfmove = self.halfmoveClock
+        return record
+
+    def RestoreUndo(self, record):
+        """put back everything SaveUndo saved, the board is up to the caller"""
+        self.currentCastlingRights.SetMask(record.castle)
+        self.enpassantPossible = record.enpassant
+        self.WhiteKingLocation = record.whiteKing
+        self.BlackKingLocation = record.blackKing
+        self.zobristKey = record.key
+        self.mgScore = record.mg
+        self.egScore = record.eg
+        self.phase = record.phase
+        self.pieceCount = record.pieceCount
+        self.halfmoveClock = record.halfmove
 
     def makeMove(self, move):
+        record = self.SaveUndo()
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move)
@@ -56,19 +368,20 @@ class GameStart():
             self.BlackKingLocation = (move.endRow, move.endCol)
         # make pawn promotion
         if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
-
-        # enpassant handler
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-            self.enpassantPossible = ((move.endRow + move.startRow) // 2, move.startCol) 
-        else:
-            self.enpassantPossible = ()
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionPiece
 
         # make enpassant move
         if move.isEnpassant:
-            self.enpassantPossibleLog.append(self.enpassantPossible)
             move.pieceCaptured = self.board[move.startRow][move.endCol]
             self.board[move.startRow][move.endCol] = '--'
+        record.captured = move.pieceCaptured
+        self.halfmoveClock = 0 if move.pieceMoved[1] == 'p' or move.pieceCaptured != '--' else self.halfmoveClock + 1
+
+        # enpassant handler, the old square is in the undo record
+        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
+            self.enpassantPossible = ((move.endRow + move.startRow) // 2, move.startCol) 
+        else:
+            self.enpassantPossible = ()
 
         # make castle move
         if move.isCastle:
@@ -81,8 +394,8 @@ class GameStart():
         
         #update castling rights
         self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.wqs, 
-                                                    self.currentCastlingRights.bks, self.currentCastlingRights.bqs))
+        self.UpdateZobristKey(move, record)
+        self.UpdateEval(move)
         
     '''
     undo last move
@@ -90,23 +403,15 @@ class GameStart():
     def undoMove(self):
         if (len(self.moveLog) != 0):
             move = self.moveLog.pop()
+            record = self.undoStack[len(self.moveLog)]
             self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            self.board[move.endRow][move.endCol] = record.captured
             self.whiteToMove = not self.whiteToMove
-            #update king location
-            if move.pieceMoved == 'wK':
-                self.WhiteKingLocation = (move.startRow, move.startCol)
-            if move.pieceMoved == 'bK':
-                self.BlackKingLocation = (move.startRow, move.startCol)
 
             #undo enpassant move
             if move.isEnpassant:
                 self.board[move.endRow][move.endCol] = '--'     #this square should be empty not enemy pawn
-                self.board[move.startRow][move.endCol] = move.pieceCaptured #this is the right square
-                self.enpassantPossible = self.enpassantPossibleLog.pop() #allow enpassant next move 
-            #undo 2 square pawn advance should make enpassant possible = () again
-            if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
+                self.board[move.startRow][move.endCol] = record.captured #this is the right square
 
             #undo castle move
             if move.isCastle:
@@ -117,13 +422,8 @@ class GameStart():
                 else:   #Queen side castle
                     self.board[move.endRow][move.endCol-2] = self.board[move.endRow][move.endCol+1]
                     self.board[move.endRow][move.endCol+1] = '--'
-            #update current and track log of castle rights
-            self.castleRightsLog.pop()
-            castleRights = self.castleRightsLog[-1]
-            self.currentCastlingRights.wks = castleRights.wks
-            self.currentCastlingRights.wqs = castleRights.wqs
-            self.currentCastlingRights.bks = castleRights.bks
-            self.currentCastlingRights.bqs = castleRights.bqs    
+            #castle rights, enpassant square, king locations, key and eval of the previous position
+            self.RestoreUndo(record)
                 
 
     # '''naive algorithm '''
@@ -163,26 +463,60 @@ class GameStart():
         if move.pieceMoved == 'bK':
             self.currentCastlingRights.bks = False
             self.currentCastlingRights.bqs = False
-        if move.pieceMoved == 'wR':
+        if move.pieceMoved == 'wR' and move.startRow == 7:
             if move.startCol == 7:
                 self.currentCastlingRights.wks = False
             if move.startCol == 0:
                 self.currentCastlingRights.wqs = False
-        if move.pieceMoved == 'bR':
+        if move.pieceMoved == 'bR' and move.startRow == 0:
             if move.startCol == 7:
                 self.currentCastlingRights.bks = False
             if move.startCol == 0:
                 self.currentCastlingRights.bqs = False
+        #a rook captured on its starting square can not castle anymore
+        if move.pieceCaptured == 'wR' and move.endRow == 7:
+            if move.endCol == 7:
+                self.currentCastlingRights.wks = False
+            if move.endCol == 0:
+                self.currentCastlingRights.wqs = False
+        if move.pieceCaptured == 'bR' and move.endRow == 0:
+            if move.endCol == 7:
+                self.currentCastlingRights.bks = False
+            if move.endCol == 0:
+                self.currentCastlingRights.bqs = False
 
     def SquareIsAttacked(self, r, c):
-        self.whiteToMove = not self.whiteToMove #switch to opp move so we can get opponent's move
-        oppMoves = self.GetAllPossibleMove()    
-        self.whiteToMove = not self.whiteToMove #switch back to current player's turn
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:   #this square(r, c) is under attack
+        return self.isSquareAttacked(r * 8 + c, 'b' if self.whiteToMove else 'w')
+
+    def isSquareAttacked(self, sq, byColor):
+        """true if any byColor piece attacks square sq (row * 8 + col), found by looking outward from sq"""
+        board = self.board
+        for r, c in KNIGHT_TABLE[sq]:
+            if board[r][c] == byColor + 'N':
+                return True
+        for r, c in PAWN_ATTACKER_TABLE[byColor][sq]:
+            if board[r][c] == byColor + 'p':
                 return True
+        for r, c in KING_TABLE[sq]:
+            if board[r][c] == byColor + 'K':
+                return True
+        rays = RAY_TABLE[sq]
+        for d in range(8):
+            slider = 'R' if d < 4 else 'B'
+            for r, c in rays[d]:
+                piece = board[r][c]
+                if piece != '--':
+                    if piece[0] == byColor and (piece[1] == slider or piece[1] == 'Q'):
+                        return True
+                    break
         return False
 
+    def InCheck(self):
+        """is the side to move in check, cheaper than CheckForPinsAndCheck when the pins are not needed"""
+        if self.whiteToMove:
+            return self.isSquareAttacked(self.WhiteKingLocation[0] * 8 + self.WhiteKingLocation[1], 'b')
+        return self.isSquareAttacked(self.BlackKingLocation[0] * 8 + self.BlackKingLocation[1], 'w')
+
     '''advance algorithm'''
     def GetValidMove(self):
         moves = []
@@ -196,27 +530,9 @@ class GameStart():
 
         if self.inCheck:
             if len(self.checks) == 1:
-                moves = self.GetAllPossibleMove()
-                #to block a check, you must move your piece into square beetween enemy and king
-                check = self.checks[0]
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol]
-                validSquares = []
-                #if the piece is checking is knight, you must capture this knight or move your king
-                if pieceChecking[1] == 'N':
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    for i in range(1, 8):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i) #check[2] and check[3] are check direction
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol:   #once it reach piece checking, stop continue checking  
-                            break
-                #get rid of all the move that not blocking the check or move king
-                for i in range(len(moves) -1, -1, -1):
-                    if moves[i].pieceMoved[1] != 'K':
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
+                #get rid of all the move that not blocking the check or move king, in one pass
+                validSquares = self.GetCheckBlockSquares(kingRow, kingCol)
+                moves = [move for move in self.GetAllPossibleMove() if self.EvadesCheck(move, validSquares)]
             else:   #in case double check only king move is valid
                 self.GetKingMoves(kingRow, kingCol, moves)
         else:
@@ -230,8 +546,134 @@ class GameStart():
             else:
                 self.checkMate = False
                 self.staleMate = True
+        else:
+            self.checkMate = self.staleMate = False
+        self.drawByRule = self.GetDrawByRule() if moves else None   #a mate on the 100th ply still counts
+        if self.allowUnderpromotion:
+            self.AddUnderpromotions(moves)
         return moves
 
+    def GetCheckBlockSquares(self, kingRow, kingCol):
+        """squares a non king move must land on to answer the single check in self.checks"""
+        #to block a check, you must move your piece into square beetween enemy and king
+        check = self.checks[0]
+        checkRow = check[0]
+        checkCol = check[1]
+        #if the piece is checking is knight, you must capture this knight or move your king
+        if self.board[checkRow][checkCol][1] == 'N':
+            return {(checkRow, checkCol)}
+        validSquares = set()
+        for i in range(1, 8):
+            validSquare = (kingRow + check[2] * i, kingCol + check[3] * i) #check[2] and check[3] are check direction
+            validSquares.add(validSquare)
+            if validSquare[0] == checkRow and validSquare[1] == checkCol:   #once it reach piece checking, stop continue checking  
+                break
+        return validSquares
+
+    def EvadesCheck(self, move, validSquares):
+        if move.pieceMoved[1] == 'K':
+            return True     #king moves are only generated to safe squares
+        if move.isEnpassant and (move.startRow, move.endCol) == self.checks[0][:2]:
+            return True     #enpassant removes the checking pawn without landing on its square
+        return (move.endRow, move.endCol) in validSquares
+
+    def hasLegalMove(self):
+        """
+        True as soon as one legal move is found, piece by piece, without building the whole list.
+        Enough to tell checkmate or stalemate apart from a game that goes on, see IsGameOver
+        """
+        self.inCheck, self.pins, self.checks = self.CheckForPinsAndCheck()
+        allyColor = 'w' if self.whiteToMove else 'b'
+        kingRow, kingCol = self.WhiteKingLocation if self.whiteToMove else self.BlackKingLocation
+        moves = []
+        self.GetKingMoves(kingRow, kingCol, moves)
+        if len(moves) > 0:
+            return True
+        if len(self.checks) > 1:
+            return False
+        #castling needs the square next to the king to be safe, so without king moves there is no castling either
+        validSquares = self.GetCheckBlockSquares(kingRow, kingCol) if self.inCheck else None
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece[0] == allyColor and piece[1] != 'K':
+                    moves = []
+                    getattr(self, self.moveFunc[piece[1]])(r, c, moves)
+                    for move in moves:
+                        if validSquares is None or self.EvadesCheck(move, validSquares):
+                            return True
+        return False
+
+    def IsGameOver(self):
+        """set checkMate / staleMate / drawByRule from hasLegalMove and tell whether any of them happened"""
+        if self.hasLegalMove():
+            self.checkMate = self.staleMate = False
+            self.drawByRule = self.GetDrawByRule()
+        else:
+            self.checkMate = self.inCheck
+            self.staleMate = not self.inCheck
+            self.drawByRule = None
+        return self.checkMate or self.staleMate or self.drawByRule is not None
+
+    def GenerateMoves(self, first = None):
+        """
+        Legal moves in stages: the packed move first (usually a hash move, skipped if it is not legal here),
+        then captures and promotions, then quiet moves. Stop iterating whenever you like. The position must be
+        the same each time the generator resumes, so undo what you made before asking for the next move.
+        This backend builds the whole list up front, the bitboard backend really generates stage by stage.
+        """
+        moves = self.GetValidMove()
+        if first is not None:
+            for move in moves:
+                if move.Encode() == first:
+                    yield move
+                    break
+            else:
+                first = None
+        for move in moves:
+            if (move.pieceCaptured != '--' or move.isPawnPromotion or move.isEnpassant) and (first is None or move.Encode() != first):
+                yield move
+        for move in moves:
+            if not (move.pieceCaptured != '--' or move.isPawnPromotion or move.isEnpassant) and (first is None or move.Encode() != first):
+                yield move
+
+    def GenerateStages(self):
+        """
+        Legal moves as two lists: captures and promotions, then the quiet moves when the generator is resumed
+        (resume it at the same position). This backend builds both from one GetValidMove, the bitboard backend
+        only generates the quiet moves when they are asked for.
+        """
+        moves = self.GetValidMove()
+        yield [move for move in moves if move.pieceCaptured != '--' or move.isPawnPromotion or move.isEnpassant]
+        yield [move for move in moves if not (move.pieceCaptured != '--' or move.isPawnPromotion or move.isEnpassant)]
+
+    def GetValidMovesPacked(self, out = None):
+        """legal moves as packed ints in an array('H'). Pass out to refill a buffer you keep per ply"""
+        if out is None:
+            out = array('H')
+        else:
+            del out[:]
+        for move in self.GetValidMove():
+            out.append(move.Encode())
+        return out
+
+    def MoveFromCode(self, code):
+        """rich Move for a packed move of the current position"""
+        start = code & 63
+        end = (code >> 6) & 63
+        flags = code >> 12
+        move = Move((start >> 3, start & 7), (end >> 3, end & 7), self.board,
+                    enpassant = flags == EP_CAPTURE, castle = flags == KING_CASTLE or flags == QUEEN_CASTLE)
+        if flags & PROMOTION and flags & 3 != 3:
+            move = move.WithPromotion(PROMOTION_PIECES[flags & 3])
+        return move
+
+    def AddUnderpromotions(self, moves):
+        for i in range(len(moves)):
+            if moves[i].isPawnPromotion:
+                for piece in ('R', 'B', 'N'):
+                    moves.append(moves[i].WithPromotion(piece))
+
     def CheckForPinsAndCheck(self):
         pins = []   # store the location of pieces is pinned and direction pin from
         checks = [] #store the type of the piece is checking
@@ -248,54 +690,46 @@ class GameStart():
             startCol = self.BlackKingLocation[1]
 
         #check outward from king for pins and check, keep track on pins
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range (len(directions)):
-            d = directions[j]
+        rays = RAY_TABLE[startRow * 8 + startCol]
+        for j in range (len(DIRECTIONS)):
+            d = DIRECTIONS[j]
             possiblePins = ()   #mark for piece that possible a pin piece
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != 'K':
-                        if possiblePins == ():
-                            possiblePins = (endRow, endCol, d[0], d[1])
-                        else:
+            i = 0
+            for endRow, endCol in rays[j]:
+                i += 1
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == allyColor and endPiece[1] != 'K':
+                    if possiblePins == ():
+                        possiblePins = (endRow, endCol, d[0], d[1])
+                    else:
+                        break
+                elif endPiece[0] == enemyColor:
+                    type = endPiece[1]
+                    # there are 5 possiblities we might face again
+                    # 1/ orthogonally away from king and it's a rook
+                    # 2/ diagonally away from king and it's a bishop
+                    # 3/ 1 square away diagonally from king and it's a pawn
+                    # 4/ any direction from king and it's a quuen
+                    # 5/ any direction 1 square away from king and it's a another king
+                    if (0 <= j <= 3 and type == 'R') or \
+                        (4 <= j <= 7 and type == 'B') or \
+                        (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <= 5))) or \
+                        (type == 'Q') or (i == 1 and type == 'K'):
+                        if possiblePins == ():  #there were no blocking piece
+                            inCheck = True
+                            checks.append((endRow, endCol, d[0], d[1]))
                             break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        # there are 5 possiblities we might face again
-                        # 1/ orthogonally away from king and it's a rook
-                        # 2/ diagonally away from king and it's a bishop
-                        # 3/ 1 square away diagonally from king and it's a pawn
-                        # 4/ any direction from king and it's a quuen
-                        # 5/ any direction 1 square away from king and it's a another king
-                        if (0 <= j <= 3 and type == 'R') or \
-                            (4 <= j <= 7 and type == 'B') or \
-                            (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <= 5))) or \
-                            (type == 'Q') or (i == 1 and type == 'K'):
-                            if possiblePins == ():  #there were no blocking piece
-                                inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else:   #piece is blocking will be pinned
-                                pins.append(possiblePins)
-                                break
-                        else: #none of enemy is checking
+                        else:   #piece is blocking will be pinned
+                            pins.append(possiblePins)
                             break
-                else:
-                    break
-        
+                    else: #none of enemy is checking
+                        break
+    
         #check for kngiht check
-        KnightMoves = ((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2))
-        for m in KnightMoves:
-            endRow = startRow + m[0]
-            endCol = startRow + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == 'N':
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
+        for endRow, endCol in KNIGHT_TABLE[startRow * 8 + startCol]:
+            if self.board[endRow][endCol] == enemyColor + 'N':
+                inCheck = True
+                checks.append((endRow, endCol, endRow - startRow, endCol - startCol))
         
         return inCheck, pins, checks
 
@@ -307,7 +741,7 @@ class GameStart():
                 turn = self.board[r][c][0]
                 if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
                     piece = self.board[r][c][1]
-                    self.moveFunc[piece](r, c, moves) #call the approiate move function base on piece type
+                    getattr(self, self.moveFunc[piece])(r, c, moves) #call the approiate move function base on piece type
         return moves
     
     '''
@@ -333,7 +767,7 @@ class GameStart():
             enemyColor = 'w'
 
         if self.board[r + moveAmount][c] == '--':
-            if not piecePinned or pinDirection == (moveAmount, 0):
+            if not piecePinned or pinDirection == (moveAmount, 0) or pinDirection == (-moveAmount, 0):
                 moves.append(Move((r, c), (r + moveAmount, c), self.board))
                 if r == startRow and self.board[r + moveAmount*2][c] == '--':
                     moves.append(Move((r, c), (r + moveAmount*2, c), self.board))
@@ -342,15 +776,32 @@ class GameStart():
             if not piecePinned or pinDirection == (moveAmount, -1):
                 if self.board[r + moveAmount][c-1][0] == enemyColor:
                     moves.append(Move((r, c), (r + moveAmount, c-1), self.board))
-                if (r+moveAmount, c-1) == self.enpassantPossible:
+                if (r+moveAmount, c-1) == self.enpassantPossible and not self.EnpassantExposesKing(r, c, c-1):
                     moves.append(Move((r, c), (r + moveAmount, c-1), self.board, enpassant = True))
 
         if c+1 <= 7:
             if not piecePinned or pinDirection == (moveAmount, 1):
                 if self.board[r + moveAmount][c+1][0] == enemyColor:
                     moves.append(Move((r, c), (r + moveAmount, c+1), self.board))
-                if (r+moveAmount, c+1) == self.enpassantPossible:
+                if (r+moveAmount, c+1) == self.enpassantPossible and not self.EnpassantExposesKing(r, c, c+1):
                     moves.append(Move((r, c), (r + moveAmount, c+1), self.board, enpassant = True))
+
+    def EnpassantExposesKing(self, r, c, captureCol):
+        """enpassant takes two pawns off row r at once, which the pin check can not see:
+           true if that leaves our king on row r open to an enemy rook or queen"""
+        kingRow, kingCol = self.WhiteKingLocation if self.whiteToMove else self.BlackKingLocation
+        if kingRow != r:
+            return False
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        step = 1 if kingCol < c else -1
+        col = kingCol + step
+        while 0 <= col < 8:
+            if col != c and col != captureCol:
+                piece = self.board[r][col]
+                if piece != '--':
+                    return piece[0] == enemyColor and piece[1] in ('R', 'Q')
+            col += step
+        return False
    
     '''
     Get all the Rooks moves for the located row and col and these move to moves 
@@ -365,7 +816,7 @@ class GameStart():
             if self.pins[i][0] == r and self.pins[i][1] == c:
                 piecePinned = True
                 pinDirection = (self.pins[i][2], self.pins[i][3])      
-                if self.board[r][c] != 'Q':
+                if self.board[r][c][1] != 'Q':   #queen keep the pin for its bishop moves
                     self.pins.remove(self.pins[i])
                 break
 
@@ -420,7 +871,8 @@ class GameStart():
             if self.pins[i][0] == r and self.pins[i][1] == c:
                 piecePinned = True
                 pinDirection = (self.pins[i][2], self.pins[i][3])      
-                self.pins.remove(self.pins[i])
+                if self.board[r][c][1] != 'Q':   #queen keep the pin for its rook moves
+                    self.pins.remove(self.pins[i])
                 break
 
         direction = ((-1, -1), (-1, 1), (1, -1), (1, 1))
@@ -451,28 +903,16 @@ class GameStart():
     Get all the King moves for the located row and col and these move to moves 
     '''
     def GetKingMoves(self, r, c, moves):
-        direction = ((-1, -1), (-1, 1), (1, -1), (1, 1), (-1, 0), (1, 0), (0, 1), (0, -1))
         allyColor = 'w' if self.whiteToMove else 'b'
-        for dir in direction:
-            endRow = r + dir[0]
-            endCol = c + dir[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8: #onboard
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:
-                    #temporary put king in next move to see if they are in check so those move is not valid
-                    if allyColor == 'w':
-                        self.WhiteKingLocation = (endRow, endCol)
-                    else:
-                        self.BlackKingLocation = (endRow, endCol)
-                    
-                    inCheck, pins, checks = self.CheckForPinsAndCheck()
-                    if not inCheck:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    #place king back to original location
-                    if allyColor == 'w':
-                        self.WhiteKingLocation = (r, c)
-                    else:
-                        self.BlackKingLocation = (r, c)     
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        king = self.board[r][c]
+        #lift the king while testing, otherwise it would hide the square behind it from a slider checking along that line
+        self.board[r][c] = '--'
+        for endRow, endCol in KING_TABLE[r * 8 + c]:
+            endPiece = self.board[endRow][endCol]
+            if endPiece[0] != allyColor and not self.isSquareAttacked(endRow * 8 + endCol, enemyColor):
+                moves.append(Move.FromPieces((r, c), (endRow, endCol), king, endPiece))
+        self.board[r][c] = king
     
     def GetCastleMoves(self, r, c, moves):
         # if self.inCheck:
@@ -501,7 +941,25 @@ class CastleRights():
     def __str__(self):
         return str(self.wks) + ", " + str(self.wqs) + ", " + str(self.bks) + ", " + str(self.bqs)
 
+    def Mask(self):
+        """the 4 rights as bits: wks 1, wqs 2, bks 4, bqs 8"""
+        return self.wks | self.wqs << 1 | self.bks << 2 | self.bqs << 3
+
+    def SetMask(self, mask):
+        self.wks = mask & 1 != 0
+        self.wqs = mask & 2 != 0
+        self.bks = mask & 4 != 0
+        self.bqs = mask & 8 != 0
+
+'''
+what undoMove needs besides the Move, one per ply in GameStart.undoStack and reused from game to game
+'''
+class UndoRecord():
+    __slots__ = ('captured', 'castle', 'enpassant', 'whiteKing', 'blackKing', 'key', 'mg', 'eg', 'phase', 'pieceCount', 'halfmove')
+
 class Move():
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'isPawnPromotion',
+                 'promotionPiece', 'isEnpassant', 'isCastle', 'moveID')
 
     ranksToRows = {"1" : 7, "2" : 6, "3" : 5, "4" : 4, 
                   "5" : 3, "6" : 2, "7" : 1, "8" : 0}
@@ -509,6 +967,7 @@ class Move():
     filesToCols = {"h" : 7, "g" : 6, "f" : 5, "e" : 4, 
                   "d" : 3, "c" : 2, "b" : 1, "a" : 0}
     colsToFiles = {v : k for k, v in filesToCols.items()}
+    promotionIDs = {"Q" : 0, "R" : 10000, "B" : 20000, "N" : 30000}
 
     def __init__(self, startSq, endSq, board, enpassant = False, castle = False):
         self.startRow = startSq[0]
@@ -517,8 +976,25 @@ class Move():
         self.endCol = endSq[1]
         self.pieceMoved = board[self.startRow][self.startCol]
         self.pieceCaptured = board[self.endRow][self.endCol]
+        self.SetFlags(enpassant, castle)
+
+    @classmethod
+    def FromPieces(cls, startSq, endSq, pieceMoved, pieceCaptured, enpassant = False, castle = False):
+        """build a move without a board, for backends that already know what sits on both squares"""
+        move = cls.__new__(cls)
+        move.startRow = startSq[0]
+        move.startCol = startSq[1]
+        move.endRow = endSq[0]
+        move.endCol = endSq[1]
+        move.pieceMoved = pieceMoved
+        move.pieceCaptured = pieceCaptured
+        move.SetFlags(enpassant, castle)
+        return move
+
+    def SetFlags(self, enpassant, castle):
         #pawn promotion
         self.isPawnPromotion = (self.pieceMoved == 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7)
+        self.promotionPiece = 'Q'
 
         #pawn espassant
         self.isEnpassant = enpassant
@@ -528,6 +1004,31 @@ class Move():
 
         self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
 
+    def WithPromotion(self, piece):
+        """copy of this promotion move that promotes to piece ('Q', 'R', 'B' or 'N') instead"""
+        move = Move.FromPieces((self.startRow, self.startCol), (self.endRow, self.endCol), self.pieceMoved, self.pieceCaptured)
+        move.promotionPiece = piece
+        move.moveID += self.promotionIDs[piece]
+        return move
+
+    def Encode(self):
+        """the packed 16 bit form of this move, see GameStart.GetValidMovesPacked"""
+        if self.isCastle:
+            flags = KING_CASTLE if self.endCol > self.startCol else QUEEN_CASTLE
+        elif self.isEnpassant:
+            flags = EP_CAPTURE
+        elif self.isPawnPromotion:
+            flags = PROMOTION | PROMOTION_PIECES.index(self.promotionPiece)
+            if self.pieceCaptured != '--':
+                flags |= CAPTURE
+        elif self.pieceCaptured != '--':
+            flags = CAPTURE
+        elif self.pieceMoved[1] == 'p' and abs(self.endRow - self.startRow) == 2:
+            flags = DOUBLE_PUSH
+        else:
+            flags = QUIET
+        return (self.startRow * 8 + self.startCol) | (self.endRow * 8 + self.endCol) << 6 | flags << 12
+
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.moveID == other.moveID
@@ -535,7 +1036,10 @@ class Move():
 
     def GetChessNotation(self):
         #we can change that later
-        return self.GetRankFile(self.startRow, self.startCol) + self.GetRankFile(self.endRow, self.endCol)
+        notation = self.GetRankFile(self.startRow, self.startCol) + self.GetRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionPiece.lower()
+        return notation
 
     def GetRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
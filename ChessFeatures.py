@@ -0,0 +1,166 @@
+"""
+    Board to tensor conversion for training data, many positions at a time with NumPy.
+    A batch of N positions (GameStart objects or FEN strings) becomes
+        planes      uint8 (N, 12, 8, 8)   one plane per piece in ChessHash.PIECES order, [row][col] like gs.board
+        sideToMove  uint8 (N,)            1 when white is to move
+        castling    uint8 (N, 4)          white king side, white queen side, black king side, black queen side
+        enpassant   uint8 (N, 8)          one hot file of the enpassant square, all zero when there is none
+    The squares of the whole batch are joined into one byte string and turned into plane indices by a lookup
+    table, so the per square work happens inside NumPy.
+
+        features = ChessFeatures.EncodeBatch(fens)
+        ChessFeatures.WriteDataset("positions.epd", "data/train")     # data/train_planes.npy, ... as memmaps
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import ChessHash
+
+PIECES = ChessHash.PIECES
+FIELDS = ("planes", "sideToMove", "castling", "enpassant")
+EMPTY = len(PIECES)     #plane index of an empty square, dropped when the planes are filled
+
+'''
+byte lookup tables to plane index: FEN letters for FEN input, the two characters of gs.board strings for GameStart input
+'''
+FEN_LOOKUP = np.full(256, EMPTY, dtype = np.uint8)
+BOARD_LOOKUP = np.full((256, 256), EMPTY, dtype = np.uint8)
+for _i, _piece in enumerate(PIECES):
+    FEN_LOOKUP[ord(_piece[1].upper() if _piece[0] == 'w' else _piece[1].lower())] = _i
+    BOARD_LOOKUP[ord(_piece[0]), ord(_piece[1])] = _i
+
+_EXPAND = str.maketrans(dict([(str(n), '.' * n) for n in range(1, 9)] + [('/', '')]))     #FEN placement to 64 characters
+
+
+class Features():
+    def __init__(self, planes, sideToMove, castling, enpassant):
+        self.planes = planes
+        self.sideToMove = sideToMove
+        self.castling = castling
+        self.enpassant = enpassant
+
+    def __len__(self):
+        return len(self.sideToMove)
+
+    def Slice(self, start, stop):
+        """view of positions start..stop, writing to it writes to this batch"""
+        return Features(self.planes[start:stop], self.sideToMove[start:stop], self.castling[start:stop],
+                        self.enpassant[start:stop])
+
+def Allocate(n):
+    """zeroed Features for n positions, to reuse as out = across batches"""
+    return Features(np.zeros((n, len(PIECES), 8, 8), dtype = np.uint8), np.zeros(n, dtype = np.uint8),
+                    np.zeros((n, 4), dtype = np.uint8), np.zeros((n, 8), dtype = np.uint8))
+
+def EncodeBatch(positions, out = None):
+    """
+    Features of a sequence of GameStart objects and/or FEN strings (EPD lines work too).
+    out is filled in place when given and must hold exactly len(positions) positions.
+    """
+    n = len(positions)
+    if out is None:
+        out = Allocate(n)
+    elif len(out) != n:
+        raise ValueError("out holds %d positions, got %d" % (len(out), n))
+    else:
+        out.planes.fill(0)
+        out.castling.fill(0)
+        out.enpassant.fill(0)
+    if n == 0:
+        return out
+
+    indices = np.empty((n, 64), dtype = np.uint8)
+    fens = [i for i in range(n) if isinstance(positions[i], str)]
+    games = [i for i in range(n) if not isinstance(positions[i], str)]
+    if fens:
+        fields = [positions[i].split() for i in fens]
+        placement = "".join(f[0].translate(_EXPAND) for f in fields).encode("ascii")
+        if len(placement) != 64 * len(fens):
+            raise ValueError("bad FEN placement in batch")
+        indices[fens] = FEN_LOOKUP[np.frombuffer(placement, dtype = np.uint8)].reshape(-1, 64)
+        for i, f in zip(fens, fields):
+            out.sideToMove[i] = f[1] == 'w'
+            out.castling[i] = ('K' in f[2], 'Q' in f[2], 'k' in f[2], 'q' in f[2])
+            if f[3] != '-':
+                out.enpassant[i, ord(f[3][0]) - ord('a')] = 1
+    if games:
+        squares = "".join("".join("".join(row) for row in positions[i].board) for i in games).encode("ascii")
+        pairs = np.frombuffer(squares, dtype = np.uint8).reshape(-1, 64, 2)
+        indices[games] = BOARD_LOOKUP[pairs[:, :, 0], pairs[:, :, 1]]
+        for i in games:
+            gs = positions[i]
+            rights = gs.currentCastlingRights
+            out.sideToMove[i] = gs.whiteToMove
+            out.castling[i] = (rights.wks, rights.wqs, rights.bks, rights.bqs)
+            if gs.enpassantPossible != ():
+                out.enpassant[i, gs.enpassantPossible[1]] = 1
+
+    #one scatter for the whole batch: plane index per occupied (position, square)
+    position, square = np.nonzero(indices != EMPTY)
+    out.planes.reshape(n, len(PIECES), 64)[position, indices[position, square], square] = 1
+    return out
+
+def OpenDataset(prefix, n, mode = "w+"):
+    """Features backed by prefix_<field>.npy memmap files, created for n positions with mode "w+", "r" to read back"""
+    shapes = {"planes": (n, len(PIECES), 8, 8), "sideToMove": (n,), "castling": (n, 4), "enpassant": (n, 8)}
+    arrays = []
+    for field in FIELDS:
+        path = "%s_%s.npy" % (prefix, field)
+        if mode == "w+":
+            arrays.append(np.lib.format.open_memmap(path, mode = mode, dtype = np.uint8, shape = shapes[field]))
+        else:
+            arrays.append(np.load(path, mmap_mode = mode))
+    return Features(*arrays)
+
+def WriteDataset(source, prefix, count = None, chunkSize = 65536):
+    """
+    Encode every position of source into memmapped .npy files (see OpenDataset), chunkSize positions at a time,
+    so only one chunk is ever in memory. source is a FEN/EPD file path (read with ChessPositions) or an
+    iterable of GameStart / FEN strings, then count must be given. Returns the number of positions written,
+    rows past it stay zero when source runs out early.
+    """
+    if isinstance(source, str):
+        import ChessPositions
+        if count is None:
+            count = sum(1 for line in ChessPositions.IterLines(source))
+        source = ChessPositions.IterLines(source)
+    elif count is None:
+        raise ValueError("count is needed to size the files when source is not a path")
+    if count == 0:
+        return 0    #numpy cannot map an empty array
+    dataset = OpenDataset(prefix, count)
+    written = 0
+    chunk = []
+    for position in source:
+        if written + len(chunk) >= count:
+            break
+        chunk.append(position)
+        if len(chunk) == chunkSize:
+            EncodeBatch(chunk, dataset.Slice(written, written + len(chunk)))
+            written += len(chunk)
+            chunk = []
+    if chunk:
+        EncodeBatch(chunk, dataset.Slice(written, written + len(chunk)))
+        written += len(chunk)
+    for array in (dataset.planes, dataset.sideToMove, dataset.castling, dataset.enpassant):
+        array.flush()
+    return written
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "write the tensor features of a FEN/EPD file as .npy memmaps")
+    parser.add_argument("path")
+    parser.add_argument("prefix", help = "output files are <prefix>_planes.npy, <prefix>_sideToMove.npy, ...")
+    parser.add_argument("--chunk", type = int, default = 65536, help = "positions encoded at a time")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    written = WriteDataset(args.path, args.prefix, chunkSize = args.chunk)
+    elapsed = time.perf_counter() - start
+    print("%d positions in %.3fs, %.0f positions/s" % (written, elapsed, written / elapsed if elapsed else 0.0))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+    Zobrist keys for GameStart positions and a fixed size transposition table to cache search results by key.
+    GameStart keeps gs.zobristKey up to date in makeMove/undoMove, ComputeKey is only for setting up a position
+    (or checking the incremental key in tests).
+"""
+
+import random
+from array import array
+
+PIECES = ('wp', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bp', 'bR', 'bN', 'bB', 'bQ', 'bK')
+
+_rng = random.Random(0x5EED)    #fixed seed so the keys are the same in every process
+PIECE_KEYS = {piece: [_rng.getrandbits(64) for sq in range(64)] for piece in PIECES}   #PIECE_KEYS[piece][row * 8 + col]
+SIDE_KEY = _rng.getrandbits(64)     #xor'd in when black is to move
+CASTLE_KEYS = [_rng.getrandbits(64) for i in range(16)]     #indexed by the 4 castling rights as bits, see CastleMask
+ENPASSANT_KEYS = [_rng.getrandbits(64) for col in range(8)]     #by file of the enpassant square
+
+def CastleMask(rights):
+    return rights.wks | rights.wqs << 1 | rights.bks << 2 | rights.bqs << 3
+
+def ComputeKey(gs):
+    """key of gs built from scratch"""
+    key = 0
+    for r in range(8):
+        row = gs.board[r]
+        for c in range(8):
+            if row[c] != '--':
+                key ^= PIECE_KEYS[row[c]][r * 8 + c]
+    if not gs.whiteToMove:
+        key ^= SIDE_KEY
+    key ^= CASTLE_KEYS[CastleMask(gs.currentCastlingRights)]
+    if gs.enpassantPossible != ():
+        key ^= ENPASSANT_KEYS[gs.enpassantPossible[1]]
+    return key
+
+def MoveKey(key, move, oldCastle, newCastle, oldEnpassant, newEnpassant):
+    """key after move, given the key before it and the castling rights (as CastleMask bits) / enpassant square on both sides of it"""
+    color = move.pieceMoved[0]
+    start = move.startRow * 8 + move.startCol
+    end = move.endRow * 8 + move.endCol
+    key ^= PIECE_KEYS[move.pieceMoved][start]
+    if move.isPawnPromotion:
+        key ^= PIECE_KEYS[color + move.promotionPiece][end]
+    else:
+        key ^= PIECE_KEYS[move.pieceMoved][end]
+    if move.isEnpassant:
+        key ^= PIECE_KEYS[move.pieceCaptured][move.startRow * 8 + move.endCol]
+    elif move.pieceCaptured != '--':
+        key ^= PIECE_KEYS[move.pieceCaptured][end]
+    if move.isCastle:
+        rook = PIECE_KEYS[color + 'R']
+        if move.endCol - move.startCol == 2:    #king side, rook jumps from end + 1 to end - 1
+            key ^= rook[end + 1] ^ rook[end - 1]
+        else:
+            key ^= rook[end - 2] ^ rook[end + 1]
+    key ^= SIDE_KEY
+    key ^= CASTLE_KEYS[oldCastle] ^ CASTLE_KEYS[newCastle]
+    if oldEnpassant != ():
+        key ^= ENPASSANT_KEYS[oldEnpassant[1]]
+    if newEnpassant != ():
+        key ^= ENPASSANT_KEYS[newEnpassant[1]]
+    return key
+
+
+'''
+score bound stored with an entry
+'''
+EXACT = 0
+LOWER = 1   #score is at least this (beta cutoff)
+UPPER = 2   #score is at most this (failed low)
+
+class TranspositionTable():
+    """
+    Fixed size hash table keyed by zobrist key. Every bucket has two slots:
+    slot 0 keeps the deepest result (replaced only by an equal or deeper search, or by anything once it is
+    left over from an older search) and slot 1 always takes the newest result.
+    All fields live in flat arrays so the memory used is fixed by sizeMB. They are allocated by Allocate,
+    which the Searcher calls when a search starts, so creating a table (at import or startup) costs nothing.
+    """
+    ENTRY_BYTES = 8 + 2 + 4 + 1 + 4 + 1     #key, depth, score, flag, move, generation
+
+    def __init__(self, sizeMB = 16):
+        entries = max(2, int(sizeMB * 1024 * 1024) // self.ENTRY_BYTES)
+        buckets = 1
+        while buckets * 4 <= entries:   #power of two number of buckets so a mask picks the bucket
+            buckets *= 2
+        self.sizeMB = sizeMB
+        self.bucketCount = buckets
+        self.mask = buckets - 1
+        self.keys = None
+        self.generation = 0
+        self.ResetStats()
+
+    def Allocate(self):
+        """create the slot arrays if they are not there yet, Probe/Store need them"""
+        if self.keys is not None:
+            return
+        size = self.bucketCount * 2
+        self.keys = array('Q', [0]) * size
+        self.depths = array('h', [-1]) * size
+        self.scores = array('i', [0]) * size
+        self.flags = array('b', [0]) * size
+        self.moves = array('i', [0]) * size
+        self.generations = array('B', [0]) * size
+
+    def ResetStats(self):
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0     #probe found the bucket full of other positions
+        self.stores = 0
+
+    def Clear(self):
+        if self.keys is not None:
+            size = self.bucketCount * 2
+            self.keys = array('Q', [0]) * size
+            self.depths = array('h', [-1]) * size
+        self.generation = 0
+        self.ResetStats()
+
+    def NewSearch(self):
+        """age the table, entries from older searches can be overwritten by anything"""
+        self.generation = (self.generation + 1) & 0xFF
+
+    def Probe(self, key):
+        """(depth, score, flag, move) stored for key, or None"""
+        i = (key & self.mask) << 1
+        for slot in (i, i + 1):
+            if self.keys[slot] == key and self.depths[slot] >= 0:
+                self.hits += 1
+                return self.depths[slot], self.scores[slot], self.flags[slot], self.moves[slot]
+        self.misses += 1
+        if self.depths[i] >= 0 or self.depths[i + 1] >= 0:
+            self.collisions += 1
+        return None
+
+    def Store(self, key, depth, score, flag, move = 0):
+        i = (key & self.mask) << 1
+        if self.keys[i] == key or self.depths[i] <= depth or self.generations[i] != self.generation:
+            slot = i
+        else:
+            slot = i + 1
+        self.keys[slot] = key
+        self.depths[slot] = depth
+        self.scores[slot] = score
+        self.flags[slot] = flag
+        self.moves[slot] = move
+        self.generations[slot] = self.generation
+        self.stores += 1
+
+    def Hashfull(self):
+        """permille of the first 1000 slots that hold an entry of the current search"""
+        if self.keys is None:
+            return 0
+        sample = min(1000, self.bucketCount * 2)
+        used = sum(1 for slot in range(sample) if self.depths[slot] >= 0 and self.generations[slot] == self.generation)
+        return used * 1000 // sample
+
+    def Stats(self):
+        probes = self.hits + self.misses
+        return {"sizeMB": self.sizeMB, "entries": self.bucketCount * 2, "hits": self.hits, "misses": self.misses,
+                "collisions": self.collisions, "stores": self.stores,
+                "hitRate": self.hits / probes if probes else 0.0, "hashfull": self.Hashfull()}
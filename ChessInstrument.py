@@ -0,0 +1,234 @@
+"""
+    Opt-in instrumentation of move generation and search: call counts and cumulative time per function, Move
+    objects created, and a hook that hands every timed call to an external profiler.
+    Enable swaps counting wrappers in for the methods listed in TARGETS and Disable puts the originals back, so
+    while it is off the engine runs its own unwrapped functions and pays nothing at all.
+    Only this process is instrumented, worker processes of a pool keep their own (disabled) state.
+
+        ChessInstrument.Enable()
+        ChessSearch.FindBestMove(gs, depth = 3)
+        print(ChessInstrument.ToJSON())
+        ChessInstrument.Disable()
+
+        python ChessInstrument.py --depth 3 [--json stats.json]
+"""
+
+import argparse
+import functools
+import importlib
+import inspect
+import json
+import sys
+import time
+
+'''
+(module, class or None for a module level function, attribute) of everything Enable wraps.
+Methods are wrapped on every class that defines them itself, so an overriding backend gets its own entry.
+Move creation is counted through Move.SetFlags, which both constructors and WithPromotion go through.
+A generator function is counted once per generator and timed on every resumption, see _WrapGenerator
+'''
+TARGETS = [
+    ("ChessEngine", "GameStart", "makeMove"),
+    ("ChessEngine", "GameStart", "undoMove"),
+    ("ChessEngine", "GameStart", "GetValidMove"),
+    ("ChessEngine", "GameStart", "CheckForPinsAndCheck"),
+    ("ChessEngine", "GameStart", "GetAllPossibleMove"),
+    ("ChessEngine", "GameStart", "GenerateStages"),
+    ("ChessEngine", "GameStart", "GenerateMoves"),
+    ("ChessEngine", "GameStart", "GetValidMovesPacked"),
+    ("ChessEngine", "GameStart", "MoveFromCode"),
+    ("ChessEngine", "GameStart", "GetPawnMoves"),
+    ("ChessEngine", "GameStart", "GetRookMoves"),
+    ("ChessEngine", "GameStart", "GetKnightMoves"),
+    ("ChessEngine", "GameStart", "GetBishopMoves"),
+    ("ChessEngine", "GameStart", "GetQueenMoves"),
+    ("ChessEngine", "GameStart", "GetKingMoves"),
+    ("ChessEngine", "GameStart", "GetCastleMoves"),
+    ("ChessEngine", "GameStart", "hasLegalMove"),
+    ("ChessEngine", "GameStart", "SquareIsAttacked"),
+    ("ChessEngine", "Move", "SetFlags"),
+    ("ChessBitboard", "BitboardGameStart", "makeMove"),
+    ("ChessBitboard", "BitboardGameStart", "undoMove"),
+    ("ChessBitboard", "BitboardGameStart", "GetValidMove"),
+    ("ChessBitboard", "BitboardGameStart", "GetValidMovesPacked"),
+    ("ChessBitboard", "BitboardGameStart", "GetAllPossibleMove"),
+    ("ChessBitboard", "BitboardGameStart", "GenerateStages"),
+    ("ChessBitboard", "BitboardGameStart", "GenerateMoves"),
+    ("ChessBitboard", "BitboardGameStart", "GenerateMovesPacked"),
+    ("ChessBitboard", "BitboardGameStart", "GeneratePseudoPacked"),
+    ("ChessBitboard", "BitboardGameStart", "GenerateCapturesPacked"),
+    ("ChessBitboard", "BitboardGameStart", "GenerateQuietsPacked"),
+    ("ChessBitboard", "BitboardGameStart", "GenerateCastlePacked"),
+    ("ChessBitboard", "BitboardGameStart", "_LegalityContext"),
+    ("ChessBitboard", "BitboardGameStart", "_KingSafeAfter"),
+    ("ChessBitboard", "BitboardGameStart", "MoveFromCode"),
+    ("ChessBitboard", "BitboardGameStart", "GetCastleMoves"),
+    ("ChessBitboard", "BitboardGameStart", "hasLegalMove"),
+    ("ChessBitboard", "BitboardGameStart", "SquareIsAttacked"),
+    ("ChessSearch", "Searcher", "Negamax"),
+    ("ChessSearch", "Searcher", "Quiesce"),
+    ("ChessOrder", None, "StaticExchange"),
+    ("ChessSearch", None, "Evaluate"),
+]
+
+_calls = {}     #name -> calls since the last Reset
+_times = {}     #name -> seconds inside the function (nested calls included, like a profiler's cumulative time)
+_originals = []     #(owner, attribute, original) to put back on Disable
+_hook = None
+_timers = False
+_resetAt = time.perf_counter()
+
+def IsEnabled():
+    return bool(_originals)
+
+def _WrapGenerator(name, function):
+    """
+    calling a generator function only builds the generator, its work is done in the next() calls that follow.
+    The time of every resumption goes to name, the hook sees each of them, the call is counted once
+    """
+    clock = time.perf_counter
+    @functools.wraps(function)
+    def TimedGenerator(*args, **kwargs):
+        generator = function(*args, **kwargs)
+        _calls[name] += 1
+        try:
+            while True:
+                start = clock()
+                try:
+                    value = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed = clock() - start
+                    _times[name] += elapsed
+                    if _hook is not None:
+                        _hook(name, start, elapsed)
+                yield value
+        finally:
+            generator.close()   #the consumer stopped early
+    return TimedGenerator
+
+def _Wrap(name, function, timers):
+    _calls.setdefault(name, 0)
+    _times.setdefault(name, 0.0)
+    if timers and inspect.isgeneratorfunction(function):
+        return _WrapGenerator(name, function)
+    if not timers:
+        @functools.wraps(function)
+        def Counted(*args, **kwargs):
+            _calls[name] += 1
+            return function(*args, **kwargs)
+        return Counted
+
+    clock = time.perf_counter
+    @functools.wraps(function)
+    def Timed(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = clock() - start
+            _calls[name] += 1
+            _times[name] += elapsed
+            if _hook is not None:
+                _hook(name, start, elapsed)
+    return Timed
+
+def Enable(timers = True, hook = None, targets = None):
+    """
+    start counting. timers also measures the time of every call (a few hundred ns each), hook(name, start, elapsed)
+    is then called after every call with perf_counter times, for feeding an external profiler or tracer
+    """
+    global _hook, _timers
+    Disable()
+    _hook = hook
+    _timers = timers or hook is not None
+    for moduleName, className, attribute in targets or TARGETS:
+        module = importlib.import_module(moduleName)
+        owner = getattr(module, className) if className else module
+        if attribute not in vars(owner):
+            continue    #inherited, the class that defines it is wrapped
+        original = vars(owner)[attribute]
+        name = "%s.%s" % (className or moduleName, attribute)
+        setattr(owner, attribute, _Wrap(name, original, _timers))
+        _originals.append((owner, attribute, original))
+
+def Disable():
+    """put the original functions back, the counters are kept until Reset"""
+    global _hook
+    while _originals:
+        owner, attribute, original = _originals.pop()
+        setattr(owner, attribute, original)
+    _hook = None
+
+def Reset():
+    global _resetAt
+    for name in _calls:
+        _calls[name] = 0
+        _times[name] = 0.0
+    _resetAt = time.perf_counter()
+
+def Snapshot():
+    """plain dict copy of the counters: {"elapsed", "timers", "functions": {name: {"calls", "time"}}}"""
+    functions = {}
+    for name in _calls:
+        if _calls[name]:
+            functions[name] = {"calls": _calls[name], "time": _times[name] if _timers else None}
+    return {"elapsed": time.perf_counter() - _resetAt, "timers": _timers, "functions": functions}
+
+def ToJSON(path = None, snapshot = None):
+    """the snapshot as JSON text, also written to path when given"""
+    text = json.dumps(snapshot or Snapshot(), indent = 2, sort_keys = True)
+    if path is not None:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+    return text
+
+class Instrumented():
+    """with Instrumented() as stats: ... enables on entry, disables on exit and leaves the Snapshot in stats.result"""
+    def __init__(self, timers = True, hook = None):
+        self.timers = timers
+        self.hook = hook
+        self.result = None
+
+    def __enter__(self):
+        Reset()
+        Enable(self.timers, self.hook)
+        return self
+
+    def __exit__(self, *exc):
+        Disable()
+        self.result = Snapshot()
+
+def FormatTable(snapshot):
+    lines = ["%-40s %10s %10s %10s" % ("function", "calls", "time (s)", "us/call")]
+    rows = sorted(snapshot["functions"].items(), key = lambda item: -(item[1]["time"] or item[1]["calls"]))
+    for name, row in rows:
+        if row["time"] is None:
+            lines.append("%-40s %10d %10s %10s" % (name, row["calls"], "-", "-"))
+        else:
+            lines.append("%-40s %10d %10.3f %10.2f" % (name, row["calls"], row["time"], row["time"] * 1e6 / row["calls"]))
+    return "\n".join(lines)
+
+def main(argv = None):
+    import ChessEngine
+    import ChessSearch
+    parser = argparse.ArgumentParser(description = "counters and timers of one search")
+    parser.add_argument("--fen", default = ChessEngine.STARTING_FEN)
+    parser.add_argument("--depth", type = int, default = 3)
+    parser.add_argument("--backend", choices = ("mailbox", "bitboard"), default = "mailbox")
+    parser.add_argument("--no-timers", action = "store_true", help = "count calls only")
+    parser.add_argument("--json", help = "write the snapshot to this file")
+    args = parser.parse_args(argv)
+
+    gs = ChessEngine.GameStart.fromFEN(args.fen, args.backend)
+    with Instrumented(timers = not args.no_timers) as stats:
+        result = ChessSearch.FindBestMove(gs, depth = args.depth)
+    print(result)
+    print(FormatTable(stats.result))
+    if args.json:
+        ToJSON(args.json, stats.result)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,44 @@
 """This is the main file. This file handling user input and displaying the current game state object"""
 
-from ctypes.wintypes import HICON
+import ChessAI
 import ChessEngine
-import pygame as p
+
+#pygame and the renderer are imported by main(), not here: the AI worker process re-imports this module
+#when processes are spawned (Windows, macOS) and it only needs the engine
+p = None
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15
 IMAGES = {}
-
-""" Initialize a global dictionaty images. And this is called only one"""
-def LoadImages():
-    pieces = ['wR', 'wN', 'wB', 'wQ', 'wK', 'wp', 'bR', 'bN', 'bB', 'bQ', 'bK', 'bp']
-    for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + '.png'), (SQ_SIZE, SQ_SIZE))
+PLAYER_ONE = True   #white is played by a human, False lets the AI play it
+PLAYER_TWO = False  #same for black
+AI_MOVETIME = 1.0   #seconds per AI move
+AI_PONDER = True    #keep thinking on the human's turn
+AI_BOOK = None      #path of a Polyglot .bin opening book for the AI, None to search every move
+
+""" Fill the global dictionary images with the pieces at sqSize, read from the images zip (cached on disk per size)"""
+def LoadImages(sqSize = SQ_SIZE):
+    import ChessSprites
+    IMAGES.clear()
+    IMAGES.update(ChessSprites.LoadSprites(sqSize))
 
 """The main driver for our code. This will handle user input and updating graphics"""
 def main():
+    global p
+    import pygame as p
+    import ChessRender
     p.init()
-    screen = p.display.set_mode((HEIGHT, WIDTH))
+    screen = p.display.set_mode((HEIGHT, WIDTH), p.RESIZABLE)
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
     gs = ChessEngine.GameStart()
-    LoadImages()
+    sqSize = SQ_SIZE
+    LoadImages(sqSize)
+    renderer = ChessRender.BoardRenderer(screen, IMAGES, sqSize, DIMENSION)
+    resized = False
+    ai = ChessAI.AIPlayer(AI_MOVETIME, AI_PONDER, bookFile = AI_BOOK)   #searches in its own process, the window stays responsive
     running = True
     validMove = gs.GetValidMove()
     moveMade = False #flag when move is made
@@ -32,14 +47,29 @@ def main():
     playerClicks = [] #keep tracking of player clicks (two tuple [(6, 4), (4, 4)])
     gameOver = False
     while running:
+        humanTurn = (gs.whiteToMove and PLAYER_ONE) or (not gs.whiteToMove and PLAYER_TWO)
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type == p.VIDEOEXPOSE:
+                renderer.Invalidate()
+            elif e.type == p.VIDEORESIZE:
+                #the board keeps square, sprites of a size seen before come from the atlas cache
+                newSize = max(16, min(e.w, e.h) // DIMENSION)
+                if newSize != sqSize:
+                    sqSize = newSize
+                    LoadImages(sqSize)
+                screen = p.display.get_surface()
+                screen.fill(p.Color("white"))
+                renderer = ChessRender.BoardRenderer(screen, IMAGES, sqSize, DIMENSION)
+                resized = True
             elif e.type == p.MOUSEBUTTONDOWN:
-                if not gameOver:
+                if not gameOver and humanTurn:
                     location = p.mouse.get_pos() #(x, y) location of mouse
-                    col = location[0] // SQ_SIZE
-                    row = location[1] // SQ_SIZE
+                    col = location[0] // sqSize
+                    row = location[1] // sqSize
+                    if row >= DIMENSION or col >= DIMENSION:
+                        continue    #click beside the board
                     if sqSelected == (row, col): #if square is already choose
                         sqSelected = () #deselect it
                         playerClicks = []
@@ -62,112 +92,65 @@ def main():
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:
                     if not gameOver:
+                        ai.Cancel()
                         gs.undoMove()
+                        #against the AI take its reply back too, or it would just play it again
+                        while (PLAYER_ONE or PLAYER_TWO) and len(gs.moveLog) > 0 and \
+                                not ((gs.whiteToMove and PLAYER_ONE) or (not gs.whiteToMove and PLAYER_TWO)):
+                            gs.undoMove()
                         moveMade = True
                         animate = False
                 if e.key == p.K_r:
+                    ai.Cancel()
                     gs = ChessEngine.GameStart()
                     validMove = gs.GetValidMove()
                     sqSelected = ()
                     playerClicks = []
                     moveMade = False
                     animate = False
-
-            if moveMade:
-                if animate:
-                    AnimateMove(gs.moveLog[-1], screen, gs.board, clock)
-                validMove = gs.GetValidMove()
-                moveMade = False
-                animate = False
-
-        drawGameState(screen, gs, validMove, sqSelected) 
-
+                    gameOver = False
+
+        #AI move: start a search when it is its turn, pick the answer up once it is there
+        if not gameOver and not humanTurn and not moveMade:
+            if not ai.IsThinking():
+                ai.Think(gs)
+            reply = ai.Poll()
+            if reply is not None:
+                gs.makeMove(gs.MoveFromCode(reply.code))
+                moveMade = True
+                animate = True
+                ai.Ponder(gs, reply.ponderCode)
+
+        if moveMade:
+            if animate:
+                renderer.AnimateMove(gs.moveLog[-1], gs.board, clock)
+            validMove = gs.GetValidMove()
+            moveMade = False
+            animate = False
+
+        text = None
         if gs.checkMate:
             gameOver = True
             if gs.whiteToMove:
-                DrawText(screen, 'Black win by checkmate')
+                text = 'Black win by checkmate'
             else:
-                DrawText(screen, 'White win by checkmate')
+                text = 'White win by checkmate'
         elif gs.staleMate:
             gameOver = True
-            DrawText(screen, 'Stalemate')
-           
-        clock.tick(MAX_FPS)
-        p.display.flip()
-
-def DrawHightLightSquare(screen, gs, validMoves, sqSelected):
-    if sqSelected != ():
-        r, c = sqSelected
-        if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
-            #hight light selected square
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100) #transperancy value -> 0 transparent; 255 opaque
-            s.fill(p.Color('blue'))
-            screen.blit(s, (c*SQ_SIZE, r*SQ_SIZE))
-            s.fill(p.Color('yellow')) #color of square that piece can move to
-            for move in validMoves:
-                if move.startRow == r and move.startCol == c:
-                    screen.blit(s, (move.endCol * SQ_SIZE, move.endRow * SQ_SIZE)) 
-
-
-def drawGameState(screen, gs, validMoves, sqSelected):
-    DrawBoard(screen)   #draw square on the board
-    #can draw hight light suare or move suggestion(later)
-    DrawHightLightSquare(screen, gs, validMoves, sqSelected)
-    DrawPieces(screen, gs.board) # draw pieces on top of those square
-
-"""
-Draw the square on the board
-"""
-def DrawBoard(screen):
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[(r + c) % 2]
-            p.draw.rect(screen, color, p.Rect(SQ_SIZE*c, SQ_SIZE*r, SQ_SIZE, SQ_SIZE))
-
-
-"""
-Draw the pieces on the board in the current gamestate.board
-"""
-def DrawPieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":
-                screen.blit(IMAGES[piece], p.Rect(SQ_SIZE*c, SQ_SIZE*r, SQ_SIZE, SQ_SIZE))
-
-def DrawText(screen, text):
-    font = p.font.SysFont('Helvitca', 32, True, False)
-    textObject = font.render(text, 0, p.Color('Blue'))
-    textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
-    screen.blit(textObject, textLocation)
+            text = 'Stalemate'
+        elif gs.drawByRule is not None:
+            gameOver = True
+            text = 'Draw by ' + gs.drawByRule
+        #only the squares that changed since the last frame are drawn and sent to the display
+        dirty = renderer.Draw(gs, validMove, sqSelected, text)
+        if resized:
+            p.display.flip()    #the margin around the board changed too
+            resized = False
+        elif dirty:
+            p.display.update(dirty)
 
-'''
-Draw animate move
-'''
-def AnimateMove(move, screen, board, clock):
-    global colors
-    dR = move.endRow - move.startRow
-    dC = move.endCol - move.startCol
-    framePerSquare = 10 #frames to move one square
-    frameCount = (abs(dR) + abs(dC))*framePerSquare
-    for frame in range(frameCount+1):
-        r, c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount)
-        DrawBoard(screen)
-        DrawPieces(screen, board)
-        #erease the piece from ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = p.Rect(move.endCol * SQ_SIZE, move.endRow * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endSquare)
-        #draw capture piece onto rectangle
-        if move.pieceCaptured != '--':
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
-        #draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
-        clock.tick(60)
+        clock.tick(MAX_FPS)
+    ai.Close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,304 @@
+"""
+    Engine against engine matches, to tell whether a change is an improvement. Two configurations of
+    ChessSearch.Searcher play each other on a pool of worker processes, every opening of a FEN/EPD file twice with
+    the colors swapped. Finished games are appended to a PGN file as they come in, and a sequential probability
+    ratio test (SPRT) ends the match as soon as the results say the first engine is elo1 stronger than the second
+    or at most elo0.
+    An engine is "name" or "name:key=value,...": hash, book, depth, nodes and movetime are understood, any other key
+    is set as an attribute of that engine's Searcher (bookBest=true, ...).
+
+        python ChessMatch.py openings.epd --nodes 5000 --engine new --engine base:hash=1 --games 4000 --pgn match.pgn
+"""
+
+import argparse
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import ChessBook
+import ChessEngine
+import ChessPGN
+import ChessPositions
+import ChessSearch
+
+DEFAULT_MAX_PLIES = 400     #games still going after this many plies are adjudicated a draw
+REPORT_EVERY = 10           #games between two status lines
+
+class EngineConfig():
+    def __init__(self, name, ttSizeMB = 16, bookFile = None, depth = None, nodes = None, movetime = None, options = None):
+        self.name = name
+        self.ttSizeMB = ttSizeMB
+        self.bookFile = bookFile
+        self.depth = depth          #search limits per move, see Searcher.Search
+        self.nodes = nodes
+        self.movetime = movetime
+        self.options = options or {}    #Searcher attributes to set
+
+def ParseValue(text):
+    if text.lower() in ("true", "false"):
+        return text.lower() == "true"
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+def ParseEngine(text, depth = None, nodes = None, movetime = None):
+    """EngineConfig from "name:key=value,...", limits not given in text default to the ones passed in"""
+    name, _, rest = text.partition(":")
+    config = EngineConfig(name or text, depth = depth, nodes = nodes, movetime = movetime)
+    probe = ChessSearch.Searcher(ttSizeMB = 1)  #table is allocated lazily, this costs nothing
+    for item in filter(None, rest.split(",")):
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError("expected key=value in engine %s: %s" % (name, item))
+        value = ParseValue(value)
+        if key == "hash":
+            config.ttSizeMB = value
+        elif key == "book":
+            config.bookFile = value
+        elif key == "movetime":
+            config.movetime = float(value)
+        elif key in ("depth", "nodes"):
+            setattr(config, key, value)
+        elif hasattr(probe, key):
+            config.options[key] = value
+        else:
+            raise ValueError("unknown engine option %s" % key)
+    return config
+
+
+'''
+worker side: every worker keeps one Searcher per engine name for the whole match, the tables are cleared between games
+'''
+_searchers = {}
+
+def _GetSearcher(config):
+    searcher = _searchers.get(config.name)
+    if searcher is None:
+        book = ChessBook.PolyglotBook(config.bookFile) if config.bookFile else None
+        searcher = ChessSearch.Searcher(ttSizeMB = config.ttSizeMB, book = book)
+        for key, value in config.options.items():
+            setattr(searcher, key, value)
+        _searchers[config.name] = searcher
+    return searcher
+
+def InsufficientMaterial(gs):
+    """bare kings, or a single knight or bishop besides them"""
+    if gs.phase > 1:
+        return False
+    minors = 0
+    for row in gs.board:
+        for piece in row:
+            if piece != '--' and piece[1] != 'K':
+                if piece[1] not in 'NB':
+                    return False
+                minors += 1
+    return minors <= 1
+
+
+class GameRecord():
+    def __init__(self, index, fen, white, black, result, reason, sans, elapsed):
+        self.index = index      #game number in the match, from 0
+        self.fen = fen          #opening position
+        self.white = white      #engine names
+        self.black = black
+        self.result = result    #"1-0", "0-1" or "1/2-1/2"
+        self.reason = reason    #checkmate, stalemate, repetition, fifty moves, insufficient material, move limit
+        self.sans = sans
+        self.elapsed = elapsed
+
+def PlayGame(index, fen, white, black, backend = "mailbox", maxPlies = DEFAULT_MAX_PLIES):
+    """GameRecord of one game between two EngineConfigs from fen"""
+    start = time.perf_counter()
+    gs = ChessEngine.GameStart.fromFEN(fen, backend)
+    gs.allowUnderpromotion = True
+    for config in (white, black):
+        _GetSearcher(config).tt.Clear()
+    sans = []
+    while True:
+        moves = gs.GetValidMove()
+        if not moves:
+            if gs.inCheck:
+                result, reason = ("0-1" if gs.whiteToMove else "1-0"), "checkmate"
+            else:
+                result, reason = "1/2-1/2", "stalemate"
+            break
+        if gs.drawByRule is not None:
+            result, reason = "1/2-1/2", gs.drawByRule
+            break
+        if InsufficientMaterial(gs):
+            result, reason = "1/2-1/2", "insufficient material"
+            break
+        if len(sans) >= maxPlies:
+            result, reason = "1/2-1/2", "move limit"
+            break
+        config = white if gs.whiteToMove else black
+        move = _GetSearcher(config).Search(gs, config.depth, config.nodes, config.movetime).bestMove
+        sans.append(ChessPGN.ToSAN(gs, move, moves))
+        gs.makeMove(move)
+    return GameRecord(index, fen, white.name, black.name, result, reason, sans, time.perf_counter() - start)
+
+def _PlayGame(task):
+    return PlayGame(*task)
+
+def GameText(record, event = "ChessMatch"):
+    """PGN of a GameRecord"""
+    headers = {"Event": event, "Round": record.index + 1, "White": record.white, "Black": record.black,
+               "Result": record.result, "SetUp": "1", "FEN": record.fen, "Termination": record.reason,
+               "PlyCount": len(record.sans)}
+    fields = record.fen.split()
+    return ChessPGN.FormatGame(headers, record.sans, record.result, fields[1] == "w", int(fields[5]))
+
+
+'''
+match statistics from the point of view of the first engine
+'''
+def EloFromScore(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+def ScoreFromElo(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+class MatchStats():
+    def __init__(self):
+        self.wins = self.draws = self.losses = 0
+        self.start = time.perf_counter()
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def Add(self, record, first):
+        if record.result == "1/2-1/2":
+            self.draws += 1
+        elif (record.result == "1-0") == (record.white == first):
+            self.wins += 1
+        else:
+            self.losses += 1
+
+    def Moments(self):
+        """(mean score per game, variance of one game's score)"""
+        n = self.games
+        score = (self.wins + self.draws / 2) / n
+        variance = (self.wins * (1 - score) ** 2 + self.draws * (0.5 - score) ** 2 + self.losses * score ** 2) / n
+        return score, variance
+
+    def Elo(self):
+        """(elo difference, half width of its 95% confidence interval)"""
+        if self.games == 0:
+            return 0.0, 0.0
+        score, variance = self.Moments()
+        margin = 1.96 * math.sqrt(variance / self.games)
+        return EloFromScore(score), (EloFromScore(score + margin) - EloFromScore(score - margin)) / 2
+
+    def LLR(self, elo0, elo1):
+        """log likelihood ratio of elo1 against elo0 (generalized SPRT, normal approximation of the game scores)"""
+        if self.games == 0:
+            return 0.0
+        score, variance = self.Moments()
+        if variance == 0:
+            return 0.0  #every game the same result, nothing to measure the spread with yet
+        s0, s1 = ScoreFromElo(elo0), ScoreFromElo(elo1)
+        return (s1 - s0) * (2 * score - s0 - s1) * self.games / (2 * variance)
+
+    def GamesPerMinute(self):
+        elapsed = time.perf_counter() - self.start
+        return self.games * 60 / elapsed if elapsed > 0 else 0.0
+
+def SPRTBounds(alpha, beta):
+    """(lower, upper) LLR bounds: below lower accept elo0, above upper accept elo1"""
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+def Tasks(openings, first, second, games, backend, maxPlies):
+    for index in range(games):
+        fen = openings[(index // 2) % len(openings)]
+        white, black = (first, second) if index % 2 == 0 else (second, first)
+        yield index, fen, white, black, backend, maxPlies
+
+def RunMatch(openings, first, second, games, workers = None, backend = "mailbox", maxPlies = DEFAULT_MAX_PLIES,
+             pgnPath = None, sprt = (0.0, 10.0), alpha = 0.05, beta = 0.05, report = print):
+    """
+    Play up to games games (SPRT may stop it earlier, sprt None plays them all), streaming every finished game to
+    pgnPath. report gets a status line every REPORT_EVERY games and at the end. Returns (MatchStats, verdict) with
+    verdict "H1" (elo1 accepted), "H0" (elo0 accepted) or None
+    """
+    workers = workers or os.cpu_count() or 1
+    stats = MatchStats()
+    verdict = None
+    lower, upper = SPRTBounds(alpha, beta)
+    out = open(pgnPath, "a", encoding = "utf-8") if pgnPath else None
+
+    def Status():
+        elo, margin = stats.Elo()
+        line = "games %d (+%d =%d -%d)  elo %+.1f +- %.1f  %.1f games/min" % (
+            stats.games, stats.wins, stats.draws, stats.losses, elo, margin, stats.GamesPerMinute())
+        if sprt is not None:
+            line += "  LLR %.2f [%.2f, %.2f]" % (stats.LLR(*sprt), lower, upper)
+        return line
+
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for record in pool.imap_unordered(_PlayGame, Tasks(openings, first, second, games, backend, maxPlies)):
+                stats.Add(record, first.name)
+                if out is not None:
+                    out.write(GameText(record))
+                    out.flush()     #a match stopped by hand keeps every finished game
+                if stats.games % REPORT_EVERY == 0:
+                    report(Status())
+                if sprt is not None:
+                    llr = stats.LLR(*sprt)
+                    if llr >= upper or llr <= lower:
+                        verdict = "H1" if llr >= upper else "H0"
+                        break   #leaving the with terminates the games still running
+    finally:
+        if out is not None:
+            out.close()
+    report(Status())
+    if verdict is not None:
+        report("SPRT: %s is %s" % (first.name, ("stronger by at least %g elo" % sprt[1]) if verdict == "H1"
+                                    else ("at most %g elo stronger" % sprt[0])))
+    return stats, verdict
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "play two engine configurations against each other")
+    parser.add_argument("openings", help = "FEN or EPD file, every position is played with both colors")
+    parser.add_argument("--engine", action = "append", default = [], metavar = "NAME[:key=value,...]",
+                        help = "give it twice: the engine under test, then the one to compare it with")
+    parser.add_argument("--games", type = int, default = 1000)
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--depth", type = int, default = None)
+    parser.add_argument("--nodes", type = int, default = None)
+    parser.add_argument("--movetime", type = float, default = None, help = "seconds per move")
+    parser.add_argument("--backend", choices = ("mailbox", "bitboard"), default = "mailbox")
+    parser.add_argument("--max-plies", type = int, default = DEFAULT_MAX_PLIES)
+    parser.add_argument("--pgn", default = "match.pgn", help = "finished games are appended here")
+    parser.add_argument("--sprt", type = float, nargs = 2, default = [0.0, 10.0], metavar = ("ELO0", "ELO1"))
+    parser.add_argument("--no-sprt", action = "store_true", help = "play every game")
+    parser.add_argument("--alpha", type = float, default = 0.05)
+    parser.add_argument("--beta", type = float, default = 0.05)
+    args = parser.parse_args(argv)
+
+    if len(args.engine) != 2:
+        parser.error("exactly two --engine are needed")
+    if args.depth is None and args.nodes is None and args.movetime is None:
+        args.nodes = 5000
+    try:
+        first, second = [ParseEngine(text, args.depth, args.nodes, args.movetime) for text in args.engine]
+    except ValueError as e:
+        parser.error(str(e))
+    if first.name == second.name:
+        parser.error("the two engines need different names")
+    openings = [fen for fen, ops in ChessPositions.ReadPositions(args.openings)]
+    if not openings:
+        parser.error("no positions in " + args.openings)
+    RunMatch(openings, first, second, args.games, args.workers, args.backend, args.max_plies, args.pgn,
+             None if args.no_sprt else tuple(args.sprt), args.alpha, args.beta)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+    Move ordering for the search, and static exchange evaluation (SEE) for its quiescence stage.
+    The hash move goes first. Captures and promotions follow, by MVV-LVA (most valuable victim, least valuable
+    attacker). Next come the killers of the ply (quiet moves that made a beta cutoff at the same ply elsewhere in
+    the tree), then the other quiet moves by their history score (how much cutoff work the same from-to move has done).
+    Captures that lose material by SEE go last.
+
+        orderer = ChessOrder.MoveOrderer()
+        for move in orderer.Moves(gs, ttMove, ply):
+            ...
+            orderer.Cutoff(move, depth, ply)
+"""
+
+import ChessEval
+
+#piece values of the exchanges, the middlegame values of the evaluation. The king can never be won back
+SEE_VALUES = dict(ChessEval.MG_VALUES, K = 20000)
+MAX_PLY = 128   #killer slots, the search never goes that deep
+HISTORY_LIMIT = 1 << 24     #history scores are halved once one gets this big
+
+KNIGHT_STEPS = ((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2))
+KING_STEPS = ((-1, -1), (-1, 1), (1, -1), (1, 1), (-1, 0), (1, 0), (0, 1), (0, -1))
+ORTHOGONAL = ((-1, 0), (1, 0), (0, -1), (0, 1))
+DIAGONAL = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+def IsTactical(move):
+    """captures (enpassant too) and promotions, what the quiescence search looks at"""
+    return move.pieceCaptured != '--' or move.isPawnPromotion or move.isEnpassant
+
+def MvvLva(move):
+    """capture ordering score, the victim counts first and the cheaper attacker breaks ties"""
+    victim = 'p' if move.isEnpassant else move.pieceCaptured[1]
+    score = SEE_VALUES[victim] * 16 if victim != '-' else 0
+    if move.isPawnPromotion:
+        score += (SEE_VALUES[move.promotionPiece] - SEE_VALUES['p']) * 16
+    return score - SEE_VALUES[move.pieceMoved[1]] // 16
+
+def CaptureOrder(move):
+    """sort key of captures, MVV-LVA with the packed move breaking ties so both backends search the same tree"""
+    return MvvLva(move) << 16 | move.Encode()
+
+def HistoryIndex(move):
+    return (0 if move.pieceMoved[0] == 'w' else 4096) + (move.startRow * 8 + move.startCol) * 64 + move.endRow * 8 + move.endCol
+
+'''
+SEE plays out every capture on the target square, each side always taking back with its cheapest piece,
+and lets either side stop when going on would lose more. Pieces already used are in gone, so a slider behind
+them (a rook behind a rook, a bishop behind a pawn) joins in on its turn. Pins are not looked at
+'''
+def LeastValuableAttacker(board, r, c, color, gone):
+    """(value, row, col) of the cheapest piece of color attacking (r, c) while the squares in gone are empty, or None"""
+    pawnRow = r + 1 if color == 'w' else r - 1
+    if 0 <= pawnRow < 8:
+        for pawnCol in (c - 1, c + 1):
+            if 0 <= pawnCol < 8 and board[pawnRow][pawnCol] == color + 'p' and (pawnRow, pawnCol) not in gone:
+                return SEE_VALUES['p'], pawnRow, pawnCol
+    for dr, dc in KNIGHT_STEPS:
+        row, col = r + dr, c + dc
+        if 0 <= row < 8 and 0 <= col < 8 and board[row][col] == color + 'N' and (row, col) not in gone:
+            return SEE_VALUES['N'], row, col
+    best = None
+    for directions, slider in ((DIAGONAL, 'B'), (ORTHOGONAL, 'R')):
+        for dr, dc in directions:
+            row, col = r + dr, c + dc
+            while 0 <= row < 8 and 0 <= col < 8:
+                piece = board[row][col]
+                if piece != '--' and (row, col) not in gone:
+                    if piece[0] == color and (piece[1] == slider or piece[1] == 'Q'):
+                        value = SEE_VALUES[piece[1]]
+                        if best is None or value < best[0]:
+                            best = (value, row, col)
+                    break
+                row += dr
+                col += dc
+    if best is not None:
+        return best
+    for dr, dc in KING_STEPS:
+        row, col = r + dr, c + dc
+        if 0 <= row < 8 and 0 <= col < 8 and board[row][col] == color + 'K' and (row, col) not in gone:
+            return SEE_VALUES['K'], row, col
+    return None
+
+def StaticExchange(board, move):
+    """material won (negative: lost) by the side playing move once every exchange on its target square is over"""
+    r, c = move.endRow, move.endCol
+    gone = {(move.startRow, move.startCol)}
+    if move.isEnpassant:
+        gains = [SEE_VALUES['p']]
+        gone.add((move.startRow, move.endCol))
+    else:
+        gains = [SEE_VALUES[move.pieceCaptured[1]] if move.pieceCaptured != '--' else 0]
+    onSquare = SEE_VALUES[move.pieceMoved[1]]
+    if move.isPawnPromotion:
+        gains[0] += SEE_VALUES[move.promotionPiece] - SEE_VALUES['p']
+        onSquare = SEE_VALUES[move.promotionPiece]
+    side = 'b' if move.pieceMoved[0] == 'w' else 'w'
+    while True:
+        attacker = LeastValuableAttacker(board, r, c, side, gone)
+        if attacker is None:
+            break
+        value, row, col = attacker
+        gone.add((row, col))
+        other = 'b' if side == 'w' else 'w'
+        if value == SEE_VALUES['K'] and LeastValuableAttacker(board, r, c, other, gone) is not None:
+            break   #the king can not take a defended piece
+        gains.append(onSquare - gains[-1])
+        onSquare = value
+        side = other
+    for i in range(len(gains) - 1, 0, -1):
+        gains[i - 1] = -max(-gains[i - 1], gains[i])
+    return gains[0]
+
+def LosesMaterial(board, move):
+    """SEE below zero, without playing the exchange out when the victim is worth at least the attacker"""
+    victim = 'p' if move.isEnpassant else move.pieceCaptured[1]
+    if victim != '-' and SEE_VALUES[victim] >= SEE_VALUES[move.pieceMoved[1]]:
+        return False
+    return StaticExchange(board, move) < 0
+
+def _Find(moves, code):
+    for move in moves:
+        if move.Encode() == code:
+            return move
+    return None
+
+
+class MoveOrderer():
+    """killer moves and history scores of one Searcher, see Moves and Cutoff"""
+    def __init__(self):
+        self.killers = [[None, None] for i in range(MAX_PLY)]   #packed codes, the newest first
+        self.history = [0] * 8192   #by HistoryIndex
+
+    def NewSearch(self):
+        """killers belong to the tree they were found in, history only fades"""
+        for slot in self.killers:
+            slot[0] = slot[1] = None
+        self.history = [score // 2 for score in self.history]
+
+    def Cutoff(self, move, depth, ply):
+        """move made a beta cutoff at depth / ply, quiet moves become killers and earn history"""
+        if IsTactical(move):
+            return
+        code = move.Encode()
+        slot = self.killers[ply]
+        if slot[0] != code:
+            slot[1] = slot[0]
+            slot[0] = code
+        index = HistoryIndex(move)
+        self.history[index] += depth * depth
+        if self.history[index] > HISTORY_LIMIT:
+            self.history = [score // 2 for score in self.history]
+
+    def Moves(self, gs, first, ply):
+        """
+        Legal moves of gs best first: first (a packed hash move, if legal), winning and even captures, killers,
+        quiet moves, losing captures. Quiet moves are only generated once the captures are used up (unless first
+        is one of them). Like GameStart.GenerateMoves, undo what you made before asking for the next move.
+        """
+        stages = gs.GenerateStages()
+        captures = next(stages)
+        quiets = None
+        hashMove = None
+        if first is not None:
+            hashMove = _Find(captures, first)
+            if hashMove is None:
+                quiets = next(stages)
+                hashMove = _Find(quiets, first)
+            if hashMove is not None:
+                yield hashMove
+
+        board = gs.board
+        good = []
+        bad = []
+        for move in captures:
+            if move is not hashMove:
+                (bad if LosesMaterial(board, move) else good).append(move)
+        good.sort(key = CaptureOrder, reverse = True)
+        for move in good:
+            yield move
+
+        if quiets is None:
+            quiets = next(stages)
+        killers = []
+        for code in self.killers[ply]:
+            if code is not None and (hashMove is None or code != first):
+                killer = _Find(quiets, code)
+                if killer is not None:
+                    killers.append(killer)
+                    yield killer
+        history = self.history
+        rest = [move for move in quiets if move is not hashMove and move not in killers]
+        rest.sort(key = lambda move: history[HistoryIndex(move)] << 16 | move.Encode(), reverse = True)
+        for move in rest:
+            yield move
+
+        bad.sort(key = CaptureOrder, reverse = True)
+        for move in bad:
+            yield move
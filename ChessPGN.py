@@ -0,0 +1,344 @@
+"""
+    PGN reading and SAN (standard algebraic notation) for GameStart.
+    ToSAN / ParseSAN convert between Move and SAN in a given position, ParseGame turns the text of one game into
+    headers and SAN moves, Replay plays them through a GameStart and ReplayFile does that for a whole archive
+    over a process pool, handing out chunks of whole games and giving the results back in file order.
+
+        for record in ChessPGN.ReplayFile("games.pgn", workers = 8):
+            if record.error:
+                print(record.index, record.headers.get("Site"), record.error)
+"""
+
+import argparse
+import collections
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+import ChessEngine
+
+FILES = "abcdefgh"
+RANKS = "12345678"
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+HEADER = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+'''
+movetext tokens: comments, variations and NAGs are skipped, move numbers dropped, the rest is a SAN move or the result
+'''
+TOKEN = re.compile(r'\{[^}]*\}|;[^\n]*|\$\d+|\(|\)|1-0|0-1|1/2-1/2|\*|\d+\.+|[^\s{}();$.]+')
+
+def ToSAN(gs, move, moves = None):
+    """SAN of a legal move in gs, moves is gs.GetValidMove() when the caller already has it"""
+    if move.isCastle:
+        san = "O-O" if move.endCol > move.startCol else "O-O-O"
+    else:
+        piece = move.pieceMoved[1]
+        capture = move.pieceCaptured != '--' or move.isEnpassant
+        square = move.GetRankFile(move.endRow, move.endCol)
+        if piece == 'p':
+            san = (FILES[move.startCol] + "x" if capture else "") + square
+            if move.isPawnPromotion:
+                san += "=" + move.promotionPiece
+        else:
+            if moves is None:
+                moves = gs.GetValidMove()
+            #other pieces of the same kind that can reach the same square decide how much of the start square to show
+            sameFile = sameRank = ambiguous = False
+            for other in moves:
+                if (other.pieceMoved == move.pieceMoved and other.endRow == move.endRow and other.endCol == move.endCol
+                        and (other.startRow != move.startRow or other.startCol != move.startCol)):
+                    ambiguous = True
+                    sameFile = sameFile or other.startCol == move.startCol
+                    sameRank = sameRank or other.startRow == move.startRow
+            start = ""
+            if ambiguous:
+                if not sameFile:
+                    start = FILES[move.startCol]
+                elif not sameRank:
+                    start = move.rowsToRanks[move.startRow]
+                else:
+                    start = move.GetRankFile(move.startRow, move.startCol)
+            san = piece + start + ("x" if capture else "") + square
+
+    #check or mate, without touching the flags the caller may rely on
+    savedFlags = (gs.checkMate, gs.staleMate, gs.inCheck, gs.pins, gs.checks)
+    gs.makeMove(move)
+    if gs.InCheck():
+        san += "+" if gs.hasLegalMove() else "#"
+    gs.undoMove()
+    gs.checkMate, gs.staleMate, gs.inCheck, gs.pins, gs.checks = savedFlags
+    return san
+
+def ParseSAN(gs, san, moves = None):
+    """
+    The legal Move of gs written as san. Check marks and annotations are ignored, "e8Q" and "0-0" are accepted.
+    Raises ValueError when san is no legal move or more than one.
+    """
+    if moves is None and gs.nativePackedMoves:
+        return _ParseSANPacked(gs, san)
+    if moves is None:
+        moves = gs.GetValidMove()
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        endCol = 6 if len(text) == 3 else 2
+        for move in moves:
+            if move.isCastle and move.endCol == endCol:
+                return move
+        raise ValueError("illegal move " + san)
+
+    piece, endRow, endCol, startRow, startCol, promotion = _SplitSAN(text, san)
+    found = None
+    wanted = promotion or 'Q' if gs.allowUnderpromotion else 'Q'   #without underpromotions only the queen is listed
+    for move in moves:
+        if (move.endRow == endRow and move.endCol == endCol and move.pieceMoved[1] == piece
+                and (startCol is None or move.startCol == startCol) and (startRow is None or move.startRow == startRow)
+                and (not move.isPawnPromotion or move.promotionPiece == wanted)):
+            if found is not None:
+                raise ValueError("ambiguous move " + san)
+            found = move
+    return _CheckPromotion(found, promotion, san)
+
+def _ParseSANPacked(gs, san):
+    """ParseSAN over the packed legal moves, only the move found is turned into a Move"""
+    codes = gs.GetValidMovesPacked()
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        flags = ChessEngine.KING_CASTLE if len(text) == 3 else ChessEngine.QUEEN_CASTLE
+        for code in codes:
+            if code >> 12 == flags:
+                return gs.MoveFromCode(code)
+        raise ValueError("illegal move " + san)
+
+    piece, endRow, endCol, startRow, startCol, promotion = _SplitSAN(text, san)
+    end = endRow * 8 + endCol
+    board = gs.board
+    wanted = promotion or 'Q' if gs.allowUnderpromotion else 'Q'
+    found = None
+    for code in codes:
+        start = code & 63
+        if ((code >> 6) & 63 == end and board[start >> 3][start & 7][1] == piece
+                and (startCol is None or start & 7 == startCol) and (startRow is None or start >> 3 == startRow)
+                and (not code >> 12 & ChessEngine.PROMOTION or ChessEngine.PROMOTION_PIECES[code >> 12 & 3] == wanted)):
+            if found is not None:
+                raise ValueError("ambiguous move " + san)
+            found = code
+    return _CheckPromotion(None if found is None else gs.MoveFromCode(found), promotion, san)
+
+def _SplitSAN(text, san):
+    """(piece, endRow, endCol, startRow, startCol, promotion) of a non castling SAN, start and promotion may be None"""
+    promotion = None
+    if "=" in text:
+        text, promotion = text.split("=", 1)
+    elif text and text[-1] in "QRBN" and text[0] in FILES:
+        text, promotion = text[:-1], text[-1]
+    if promotion is not None and promotion not in ("Q", "R", "B", "N"):
+        raise ValueError("bad promotion in " + san)
+    if text and text[0] in "KQRBN":
+        piece = text[0]
+        text = text[1:]
+    else:
+        piece = 'p'
+    text = text.replace("x", "").replace("-", "")
+    if len(text) < 2 or text[-2] not in FILES or text[-1] not in RANKS:
+        raise ValueError("bad move " + san)
+    endCol = FILES.index(text[-2])
+    endRow = 7 - RANKS.index(text[-1])
+    startCol = startRow = None
+    for ch in text[:-2]:
+        if ch in FILES:
+            startCol = FILES.index(ch)
+        elif ch in RANKS:
+            startRow = 7 - RANKS.index(ch)
+        else:
+            raise ValueError("bad move " + san)
+    return piece, endRow, endCol, startRow, startCol, promotion
+
+def _CheckPromotion(found, promotion, san):
+    if found is None:
+        raise ValueError("illegal move " + san)
+    if promotion is not None and not found.isPawnPromotion:
+        raise ValueError("not a promotion " + san)
+    if promotion is not None and found.promotionPiece != promotion:
+        found = found.WithPromotion(promotion)
+    return found
+
+
+class Game():
+    def __init__(self, headers, sans, result):
+        self.headers = headers  #dict of tag pairs in file order
+        self.sans = sans        #list of SAN moves of the main line
+        self.result = result    #result token at the end of the movetext, or the Result tag
+
+def ParseGame(text):
+    """Game from the PGN text of one game (tag pairs, then movetext)"""
+    headers = {}
+    pos = 0
+    for match in HEADER.finditer(text):
+        if text[pos:match.start()].strip():
+            break   #a '[' inside the movetext comments
+        headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+        pos = match.end()
+    sans = []
+    result = headers.get("Result", "*")
+    depth = 0   #variation nesting, only the main line is kept
+    for token in TOKEN.findall(text, pos):
+        first = token[0]
+        if first == '(':
+            depth += 1
+        elif first == ')':
+            depth -= 1
+        elif depth > 0 or first in '{;$' or token[-1] == '.':
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            sans.append(token)
+    return Game(headers, sans, result)
+
+def FormatGame(headers, sans, result, whiteToMove = True, fullmove = 1, width = 80):
+    """PGN text of one game: tag pairs, then the movetext wrapped at width, starting at move fullmove"""
+    lines = ['[%s "%s"]' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in headers.items()]
+    lines.append("")
+    tokens = []
+    for san in sans:
+        if whiteToMove:
+            tokens.append("%d." % fullmove)
+        elif not tokens:
+            tokens.append("%d..." % fullmove)
+        tokens.append(san)
+        if not whiteToMove:
+            fullmove += 1
+        whiteToMove = not whiteToMove
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > width:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+def IterGameTexts(lines):
+    """split PGN lines into the text of every game, a game ends where the tag pairs of the next one start"""
+    game = []
+    inMoves = False
+    for line in lines:
+        if line.startswith('['):
+            if inMoves:
+                yield "".join(game)
+                game = []
+                inMoves = False
+        elif line.strip():
+            inMoves = True
+        game.append(line)
+    if any(line.strip() for line in game):
+        yield "".join(game)
+
+
+class ReplayRecord():
+    def __init__(self, index, headers, result, plies, fen, error = None, moves = None):
+        self.index = index      #game number in the file, from 0
+        self.headers = headers
+        self.result = result
+        self.plies = plies      #half moves replayed, up to the bad move when there is an error
+        self.fen = fen          #position after the last replayed move
+        self.error = error      #None, or what went wrong and at which move
+        self.moves = moves      #coordinate notation of the replayed moves when asked for
+
+def Replay(game, index = 0, backend = "mailbox", keepMoves = False):
+    """play game through a GameStart, the ReplayRecord tells how far it got"""
+    try:
+        if game.headers.get("FEN"):
+            gs = ChessEngine.GameStart.fromFEN(game.headers["FEN"], backend)
+        else:
+            gs = ChessEngine.GameStart(backend)
+    except ValueError as e:
+        return ReplayRecord(index, game.headers, game.result, 0, None, "bad FEN tag: %s" % e)
+    moves = [] if keepMoves else None
+    error = None
+    for san in game.sans:
+        try:
+            move = ParseSAN(gs, san)
+        except ValueError as e:
+            error = "move %d%s %s: %s" % (gs.GetFullmoveNumber(), "." if gs.whiteToMove else "...", san, e)
+            break
+        gs.makeMove(move)
+        if keepMoves:
+            moves.append(move.GetChessNotation())
+    return ReplayRecord(index, game.headers, game.result, len(gs.moveLog), gs.toFEN(), error, moves)
+
+def _ReplayChunk(task):
+    """worker side: records of a list of game texts"""
+    firstIndex, texts, backend, keepMoves = task
+    records = []
+    for i, text in enumerate(texts):
+        try:
+            records.append(Replay(ParseGame(text), firstIndex + i, backend, keepMoves))
+        except Exception as e:     #one broken game must not take the whole chunk down
+            records.append(ReplayRecord(firstIndex + i, {}, "*", 0, None, "%s: %s" % (type(e).__name__, e)))
+    return records
+
+def _Chunks(path, chunkGames, backend, keepMoves):
+    with open(path, encoding = "utf-8", errors = "replace") as f:
+        texts = []
+        index = 0
+        for text in IterGameTexts(f):
+            texts.append(text)
+            if len(texts) == chunkGames:
+                yield index, texts, backend, keepMoves
+                index += len(texts)
+                texts = []
+        if texts:
+            yield index, texts, backend, keepMoves
+
+def ReplayFile(path, workers = None, chunkGames = 200, backend = "mailbox", keepMoves = False):
+    """
+    Yield a ReplayRecord for every game of the PGN file in file order. Only the game boundaries are found in
+    this process, parsing and replay run in the workers. At most a few chunks per worker are in flight, so memory
+    stays flat however big the file is. workers = 1 runs everything in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for task in _Chunks(path, chunkGames, backend, keepMoves):
+            for record in _ReplayChunk(task):
+                yield record
+        return
+    with multiprocessing.Pool(workers) as pool:
+        pending = collections.deque()
+        for task in _Chunks(path, chunkGames, backend, keepMoves):
+            pending.append(pool.apply_async(_ReplayChunk, (task,)))
+            if len(pending) >= workers * 4:
+                for record in pending.popleft().get():
+                    yield record
+        while pending:
+            for record in pending.popleft().get():
+                yield record
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "replay every game of a PGN file and report the games that do not replay")
+    parser.add_argument("path")
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--chunk", type = int, default = 200, help = "games per task")
+    parser.add_argument("--backend", choices = ("mailbox", "bitboard"), default = "mailbox")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    games = plies = errors = 0
+    for record in ReplayFile(args.path, args.workers, args.chunk, args.backend):
+        games += 1
+        plies += record.plies
+        if record.error:
+            errors += 1
+            print("game %d (%s - %s): %s" % (record.index + 1, record.headers.get("White", "?"),
+                                            record.headers.get("Black", "?"), record.error))
+    elapsed = time.perf_counter() - start
+    print("%d games, %d plies, %d errors in %.3fs, %.0f games/s" % (games, plies, errors, elapsed,
+                                                                  games / elapsed if elapsed else 0.0))
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
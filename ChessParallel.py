@@ -0,0 +1,144 @@
+"""
+    Parallel search over a pool of worker processes by splitting the root moves.
+    Every depth the best move of the last iteration is searched first to get a score to beat, then the other
+    root moves are handed out one per task with that score as alpha, so most of them fail low quickly.
+    Each worker keeps its own Searcher (and transposition table) for the life of the pool.
+
+        with ChessParallel.ParallelSearcher(workers = 8) as searcher:
+            result = searcher.Search(gs, movetime = 2.0)
+
+        python ChessParallel.py --depth 4 --workers 1 2 4 8     # speedup over one worker
+"""
+
+import argparse
+import multiprocessing
+import os
+import pickle
+import time
+
+import ChessSearch
+
+_searcher = None    #the Searcher of this worker process
+
+def _InitWorker(ttSizeMB):
+    global _searcher
+    _searcher = ChessSearch.Searcher(ttSizeMB = ttSizeMB)
+
+def _SearchRootMove(task):
+    """worker side: (index, score, pv, nodes) of one root move, score is None if the deadline was hit"""
+    data, index, depth, alpha, deadline = task
+    gs = pickle.loads(data)
+    move = gs.GetValidMove()[index]
+    _searcher.SetLimits(movetime = None if deadline is None else max(0.0, deadline - time.time()))
+    try:
+        score, pv = _searcher.ScoreMove(gs, move, depth, alpha)
+    except ChessSearch.SearchAborted:
+        return index, None, [], _searcher.nodes
+    return index, score, pv, _searcher.nodes
+
+
+class ParallelSearcher():
+    def __init__(self, workers = None, ttSizeMB = 16):
+        self.workers = workers or os.cpu_count() or 1
+        self.ttSizeMB = ttSizeMB
+        self.pool = None
+
+    def Start(self):
+        """start the worker processes, Search does it on first use"""
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers, initializer = _InitWorker, initargs = (self.ttSizeMB,))
+
+    def Close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        self.Start()
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+    def Search(self, gs, depth = None, movetime = None, onIteration = None):
+        """
+        Same contract as ChessSearch.Searcher.Search for depth and movetime limits: iterative deepening that
+        answers with the last depth every root move finished. nodes in the result is summed over all workers.
+        """
+        if depth is None:
+            depth = ChessSearch.MAX_DEPTH if movetime is not None else 4
+        self.Start()
+        start = time.perf_counter()
+        deadline = time.time() + movetime if movetime is not None else None
+        savedFlags = (gs.checkMate, gs.staleMate, gs.inCheck, gs.pins, gs.checks)
+        rootMoves = gs.GetValidMove()
+        gs.checkMate, gs.staleMate, gs.inCheck, gs.pins, gs.checks = savedFlags
+        data = pickle.dumps(gs)
+        result = ChessSearch.SearchResult(rootMoves[0] if rootMoves else None, 0, rootMoves[:1], 0, 0, 0.0)
+        if len(rootMoves) <= 1:
+            return result
+
+        nodes = 0
+        order = list(range(len(rootMoves)))
+        for d in range(1, depth + 1):
+            first, score, pv, used = self.pool.apply(_SearchRootMove, ((data, order[0], d, -ChessSearch.INFINITY, deadline),))
+            nodes += used
+            if score is None:
+                break
+            bestIndex, bestScore, bestPv = first, score, pv
+            scores = {first: score}
+            tasks = [(data, index, d, bestScore, deadline) for index in order[1:]]
+            finished = True
+            for index, score, pv, used in self.pool.imap_unordered(_SearchRootMove, tasks):
+                nodes += used
+                if score is None:
+                    finished = False
+                    continue
+                scores[index] = score
+                if score > bestScore:
+                    bestIndex, bestScore, bestPv = index, score, pv
+            if not finished:
+                break
+            #pv moves came back pickled, the root move itself should be the caller's own object
+            result = ChessSearch.SearchResult(rootMoves[bestIndex], bestScore, [rootMoves[bestIndex]] + bestPv[1:], d,
+                                              nodes, time.perf_counter() - start)
+            if onIteration is not None:
+                onIteration(result)
+            order.sort(key = lambda index: -scores[index])  #best first next time, fail lows keep their bound order
+            if abs(bestScore) > ChessSearch.MATE_BOUND and ChessSearch.MATE - abs(bestScore) <= d:
+                break
+            if deadline is not None and time.time() + (time.perf_counter() - start) > deadline:
+                break
+        result.nodes = nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+
+def Benchmark(fens, depth, workerCounts, backend = "mailbox", out = None):
+    """fixed depth search of every position with each worker count, prints time and speedup over the first count"""
+    import ChessEngine
+    timings = {}
+    for workers in workerCounts:
+        with ParallelSearcher(workers) as searcher:
+            start = time.perf_counter()
+            nodes = 0
+            for fen in fens:
+                nodes += searcher.Search(ChessEngine.GameStart.fromFEN(fen, backend), depth = depth).nodes
+            timings[workers] = time.perf_counter() - start
+        line = "workers %3d  time %8.3fs  nodes %9d  nps %9.0f  speedup %5.2fx" % (
+            workers, timings[workers], nodes, nodes / timings[workers], timings[workerCounts[0]] / timings[workers])
+        print(line, file = out)
+    return timings
+
+def main(argv = None):
+    import Perft
+    parser = argparse.ArgumentParser(description = "speedup of the parallel root split search over one worker")
+    parser.add_argument("--depth", type = int, default = 3)
+    parser.add_argument("--workers", type = int, nargs = "+", default = [1, 2, 4])
+    parser.add_argument("--backend", choices = ("mailbox", "bitboard"), default = "mailbox")
+    args = parser.parse_args(argv)
+    Benchmark([fen for name, fen, expected in Perft.POSITIONS], args.depth, args.workers, args.backend)
+
+if __name__ == "__main__":
+    main()
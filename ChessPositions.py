@@ -0,0 +1,109 @@
+"""
+    Streaming reader for FEN / EPD position files.
+    The file is memory mapped and walked line by line, so a file of any size is read with constant memory and
+    nothing is parsed before the caller asks for it. Blank lines and lines starting with '#' are skipped.
+
+        for fen, ops in ChessPositions.ReadPositions("suite.epd"):
+            gs = ChessEngine.GameStart.fromFEN(fen)
+            print(ops.get("bm"))
+
+        #split a big file between worker processes, every chunk starts on a line boundary
+        for start, end in ChessPositions.SplitOffsets("positions.fen", 8):
+            pool.apply_async(Work, ("positions.fen", start, end))
+"""
+
+import mmap
+import os
+
+def ParseEPD(line):
+    """
+    (fen, ops) of one FEN or EPD line. fen always has the 4 position fields plus the move counters
+    (taken from the line, from the hmvc / fmvn operations or "0 1"), ops maps every EPD opcode to its
+    operand string with the quotes removed ("" for opcodes without an operand).
+    """
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("EPD needs at least 4 fields: " + line)
+    rest = fields[4] if len(fields) > 4 else ""
+    counters = rest.split(None, 2)
+    if len(counters) >= 2 and counters[0].isdigit() and counters[1].isdigit():    #plain FEN
+        return " ".join(fields[:4] + counters[:2]), ParseOperations(counters[2] if len(counters) > 2 else "")
+    ops = ParseOperations(rest)
+    halfmove = ops.get("hmvc", "0")
+    fullmove = ops.get("fmvn", "1")
+    return " ".join(fields[:4] + [halfmove, fullmove]), ops
+
+def ParseOperations(text):
+    """EPD operations "bm e4; id \\"a; b\\";" to {'bm': 'e4', 'id': 'a; b'}, semicolons inside quotes are kept"""
+    ops = {}
+    i = 0
+    n = len(text)
+    while i < n:
+        while i < n and text[i] in " \t;":
+            i += 1
+        if i >= n:
+            break
+        start = i
+        while i < n and text[i] not in " \t;":
+            i += 1
+        opcode = text[start:i]
+        operand = []
+        while i < n and text[i] != ';':
+            if text[i] == '"':
+                end = text.find('"', i + 1)
+                end = n if end < 0 else end
+                operand.append(text[i + 1:end])
+                i = end + 1
+            else:
+                start = i
+                while i < n and text[i] not in '";':
+                    i += 1
+                operand.append(text[start:i])
+        ops[opcode] = "".join(operand).strip()
+        i += 1
+    return ops
+
+def IterLines(path, start = 0, end = None):
+    """
+    Non blank, non comment lines of path as str, from byte offset start up to end (whole file by default).
+    A line belongs to the range it starts in, so ranges from SplitOffsets never share or lose a line.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        end = size if end is None else min(end, size)
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            pos = start
+            if pos > 0 and mm[pos - 1:pos] != b'\n':   #started in the middle of a line, it belongs to the range before
+                pos = mm.find(b'\n', pos)
+                pos = size if pos < 0 else pos + 1
+            while pos < end:
+                newline = mm.find(b'\n', pos)
+                if newline < 0:
+                    newline = size
+                line = mm[pos:newline].strip()
+                pos = newline + 1
+                if line and not line.startswith(b'#'):
+                    yield line.decode("ascii", "replace")
+
+def ReadPositions(path, start = 0, end = None, backend = None):
+    """
+    Lazily yield (fen, ops) for every position in path (see ParseEPD), or a GameStart with the position set up
+    and gs.epd holding the operations when backend is given.
+    """
+    import ChessEngine
+    for line in IterLines(path, start, end):
+        fen, ops = ParseEPD(line)
+        if backend is None:
+            yield fen, ops
+        else:
+            gs = ChessEngine.GameStart.fromFEN(fen, backend)
+            gs.epd = ops
+            yield gs
+
+def SplitOffsets(path, parts):
+    """parts (start, end) byte ranges covering path for IterLines / ReadPositions, empty ranges are dropped"""
+    size = os.path.getsize(path)
+    bounds = [size * i // parts for i in range(parts + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(parts) if bounds[i] < bounds[i + 1]]
@@ -0,0 +1,143 @@
+"""
+    Board renderer for ChessMain that only redraws what changed.
+    The empty board is drawn once into a background surface, highlight surfaces and fonts are made once, and
+    Draw remembers what every square shows so a frame touches only the squares whose piece or highlight changed.
+    Draw returns the dirty rectangles for pygame.display.update(rects) instead of a full flip.
+
+        renderer = ChessRender.BoardRenderer(screen, IMAGES)
+        p.display.update(renderer.Draw(gs, validMoves, sqSelected))
+"""
+
+import pygame as p
+
+LIGHT = "white"
+DARK = "gray"
+SELECTED = "blue"
+TARGET = "yellow"
+HIGHLIGHT_ALPHA = 100   #0 transparent, 255 opaque
+TEXT_COLOR = "Blue"
+ANIMATION_FPS = 60
+FRAMES_PER_SQUARE = 10
+
+'''
+what a square shows: (piece, highlight) with highlight None, SELECTED or TARGET
+'''
+class BoardRenderer():
+    def __init__(self, screen, images, sqSize = None, dimension = 8):
+        self.screen = screen
+        self.images = images
+        self.dimension = dimension
+        self.sqSize = sqSize or screen.get_height() // dimension
+        self.squareRects = [[p.Rect(c * self.sqSize, r * self.sqSize, self.sqSize, self.sqSize) for c in range(dimension)]
+                            for r in range(dimension)]
+        self.background = p.Surface((self.sqSize * dimension, self.sqSize * dimension))
+        colors = [p.Color(LIGHT), p.Color(DARK)]
+        for r in range(dimension):
+            for c in range(dimension):
+                self.background.fill(colors[(r + c) % 2], self.squareRects[r][c])
+        self.highlights = {}
+        for name in (SELECTED, TARGET):
+            surface = p.Surface((self.sqSize, self.sqSize))
+            surface.set_alpha(HIGHLIGHT_ALPHA)
+            surface.fill(p.Color(name))
+            self.highlights[name] = surface
+        self.font = None
+        self.textSurfaces = {}
+        self.shownText = None
+        self.Invalidate()
+
+    def Invalidate(self):
+        """forget what is on screen, the next Draw repaints everything (window exposed, new game)"""
+        self.shown = [[None] * self.dimension for r in range(self.dimension)]
+
+    def TextSurface(self, text):
+        """rendered text and where it goes (centered), made once per message"""
+        if text not in self.textSurfaces:
+            if self.font is None:
+                self.font = p.font.SysFont('Helvitca', 32, True, False)
+            surface = self.font.render(text, 0, p.Color(TEXT_COLOR))
+            rect = surface.get_rect(center = self.background.get_rect().center)
+            self.textSurfaces[text] = (surface, rect)
+        return self.textSurfaces[text]
+
+    def DrawSquare(self, r, c, piece, highlight):
+        rect = self.squareRects[r][c]
+        self.screen.blit(self.background, rect, rect)
+        if highlight is not None:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != '--':
+            self.screen.blit(self.images[piece], rect)
+        self.shown[r][c] = (piece, highlight)
+        return rect
+
+    def Draw(self, gs, validMoves, sqSelected, text = None):
+        """bring the screen up to date with gs, returns the list of rectangles that changed"""
+        wanted = [[None] * self.dimension for r in range(self.dimension)]
+        if sqSelected != ():
+            r, c = sqSelected
+            if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
+                wanted[r][c] = SELECTED
+                for move in validMoves:
+                    if move.startRow == r and move.startCol == c:
+                        wanted[move.endRow][move.endCol] = TARGET
+
+        #squares under a message that comes or goes have to be repainted too
+        textRects = []
+        if text != self.shownText:
+            for shownText in (self.shownText, text):
+                if shownText is not None:
+                    textRects.append(self.TextSurface(shownText)[1])
+        dirty = []
+        board = gs.board
+        for r in range(self.dimension):
+            row = board[r]
+            shownRow = self.shown[r]
+            for c in range(self.dimension):
+                state = (row[c], wanted[r][c])
+                if shownRow[c] != state or (textRects and self.squareRects[r][c].collidelist(textRects) >= 0):
+                    dirty.append(self.DrawSquare(r, c, row[c], wanted[r][c]))
+
+        if text is not None:
+            surface, rect = self.TextSurface(text)
+            if text != self.shownText or rect.collidelist(dirty) >= 0:
+                self.screen.blit(surface, rect)
+                dirty.append(rect)
+        self.shownText = text
+        if len(dirty) > 16:
+            return [self.background.get_rect()]    #one big rectangle is cheaper than many small ones
+        return dirty
+
+    def AnimateMove(self, move, board, clock):
+        """
+        slide move.pieceMoved from its start to its end square, board is the position after the move.
+        Every frame only the rectangles the piece left and entered are repainted, from a still image of the board
+        """
+        still = self.background.copy()
+        for r in range(self.dimension):
+            for c in range(self.dimension):
+                piece = board[r][c]
+                if (r, c) == (move.endRow, move.endCol):
+                    piece = '--' if move.isEnpassant else move.pieceCaptured
+                elif move.isEnpassant and (r, c) == (move.startRow, move.endCol):
+                    piece = move.pieceCaptured
+                if piece != '--':
+                    still.blit(self.images[piece], self.squareRects[r][c])
+                self.shown[r][c] = (piece, None)
+        self.screen.blit(still, (0, 0))
+        p.display.update(self.background.get_rect())
+
+        dR = move.endRow - move.startRow
+        dC = move.endCol - move.startCol
+        frameCount = (abs(dR) + abs(dC)) * FRAMES_PER_SQUARE
+        last = None
+        for frame in range(frameCount + 1):
+            rect = p.Rect((move.startCol + dC * frame / frameCount) * self.sqSize,
+                          (move.startRow + dR * frame / frameCount) * self.sqSize, self.sqSize, self.sqSize)
+            if last is not None:
+                self.screen.blit(still, last, last)
+            self.screen.blit(self.images[move.pieceMoved], rect)
+            p.display.update([last, rect] if last is not None else [rect])
+            last = rect
+            clock.tick(ANIMATION_FPS)
+        #the end square now shows the moved piece over the still image, Draw fixes it up on the next frame
+        self.shown[move.endRow][move.endCol] = None
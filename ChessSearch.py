@@ -0,0 +1,327 @@
+"""
+    Search for the best move of a GameStart: negamax with alpha-beta pruning and iterative deepening.
+    The search can be limited by depth, node count and wall clock time (any mix of them) and always answers
+    with the result of the last iteration it finished, so it never runs past its time limit waiting for a deeper one.
+
+        result = ChessSearch.FindBestMove(gs, movetime = 0.5)
+        gs.makeMove(result.bestMove)
+"""
+
+import time
+
+import ChessBitbase
+import ChessEngine
+import ChessEval
+import ChessHash
+import ChessOrder
+
+MATE = 100000
+MATE_BOUND = MATE - 1000    #scores beyond this are mate in some number of plies
+INFINITY = MATE + 1
+MAX_DEPTH = 64
+QS_MAX_PLY = 2 * MAX_DEPTH  #quiescence evaluates instead of going on this far from the root
+CHECK_EVERY = 32    #nodes between two looks at the clock / stop flag
+
+Evaluate = ChessEval.Evaluate   #material and piece-square tables, kept up to date by makeMove/undoMove
+
+'''
+mate scores are stored in the transposition table relative to the node, not to the root
+'''
+def ScoreToTT(score, ply):
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+def ScoreFromTT(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class SearchAborted(Exception):
+    """raised inside the tree when a limit is hit, the root catches it and unwinds the board"""
+
+
+class SearchResult():
+    def __init__(self, bestMove, score, pv, depth, nodes, elapsed):
+        self.bestMove = bestMove
+        self.score = score      #centipawns for the side to move, +-(MATE - plies) for a forced mate
+        self.pv = pv            #list of Move, principal variation starting with bestMove
+        self.depth = depth      #last fully searched depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.elapsed) if self.elapsed > 0 else 0
+
+    def IsMate(self):
+        return abs(self.score) > MATE_BOUND
+
+    def __str__(self):
+        return "depth %d score %d nodes %d time %.3fs pv %s" % (self.depth, self.score, self.nodes, self.elapsed,
+                                                             " ".join(move.GetChessNotation() for move in self.pv))
+
+
+class Searcher():
+    """
+    Holds what survives between searches (the transposition table) and what a running search needs to stop
+    itself: counters, the deadline and a stop flag that another thread may set through Stop().
+    shouldStop is an optional callable polled with the clock, for stop signals that outlive one search
+    (a threading.Event's is_set, a flag shared with another process).
+    book is an optional ChessBook.PolyglotBook, positions found in it are answered from the book without a search.
+    """
+    def __init__(self, tt = None, ttSizeMB = 16, shouldStop = None, book = None):
+        self.tt = tt if tt is not None else ChessHash.TranspositionTable(ttSizeMB)
+        self.shouldStop = shouldStop
+        self.book = book
+        self.bookBest = False   #always the heaviest book move instead of a weighted random one
+        self.orderer = ChessOrder.MoveOrderer()
+        self.ordering = True    #hash move, MVV-LVA, killers and history. Off: moves in generation order, to compare node counts
+        self.quiescence = True  #captures searched past depth 0, off: the evaluation of the leaf as it is
+        self.stopped = False
+        self.nodes = 0
+        self.deadline = None
+        self.nodeLimit = None
+        self.nextCheck = CHECK_EVERY
+        self.pv = []
+
+    def Stop(self):
+        self.stopped = True
+
+    def SetLimits(self, nodes = None, movetime = None):
+        """reset the counters and arm the limits of a new search, movetime in seconds from now"""
+        self.tt.Allocate()
+        self.stopped = False
+        self.nodes = 0
+        self.nodeLimit = nodes
+        self.deadline = time.perf_counter() + movetime if movetime is not None else None
+        self.nextCheck = 0
+
+    def CheckLimits(self):
+        if self.stopped or (self.shouldStop is not None and self.shouldStop()):
+            raise SearchAborted()
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchAborted()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+        self.nextCheck = self.nodes + CHECK_EVERY
+        if self.nodeLimit is not None:
+            self.nextCheck = min(self.nextCheck, self.nodeLimit)
+
+    def Search(self, gs, depth = None, nodes = None, movetime = None, onIteration = None):
+        """
+        Iterative deepening from depth 1 up to depth (MAX_DEPTH when only nodes/movetime are given, 4 when
+        nothing is given). movetime is in seconds. onIteration(result) is called after every finished depth.
+        Returns the SearchResult of the deepest finished iteration, bestMove is None if there is no legal move.
+        A book move comes back at depth 0 with no nodes searched.
+        """
+        if depth is None:
+            depth = MAX_DEPTH if (nodes is not None or movetime is not None) else 4
+        start = time.perf_counter()
+        self.SetLimits(nodes, movetime)
+        self.tt.NewSearch()
+        self.orderer.NewSearch()
+        savedFlags = (gs.checkMate, gs.staleMate, gs.inCheck, gs.pins, gs.checks)
+        rootLength = len(gs.moveLog)
+
+        rootMoves = gs.GetValidMove()
+        bookMove = self.book.Choose(gs, self.bookBest) if self.book is not None and rootMoves else None
+        if bookMove is not None:
+            result = SearchResult(bookMove, 0, [bookMove], 0, 0, 0.0)
+        else:
+            result = SearchResult(rootMoves[0] if rootMoves else None, 0, rootMoves[:1], 0, 0, 0.0)
+        if len(rootMoves) > 1 and bookMove is None:
+            for d in range(1, depth + 1):
+                self.pv = [[] for i in range(d + 1)]
+                try:
+                    score = self.Negamax(gs, d, -INFINITY, INFINITY, 0)
+                except SearchAborted:
+                    while len(gs.moveLog) > rootLength:
+                        gs.undoMove()
+                    break
+                elapsed = time.perf_counter() - start
+                result = SearchResult(self.pv[0][0], score, self.HashPV(gs, self.pv[0], d), d, self.nodes, elapsed)
+                if onIteration is not None:
+                    onIteration(result)
+                if abs(score) > MATE_BOUND and MATE - abs(score) <= d:
+                    break   #found the shortest mate there is
+                if self.deadline is not None and time.perf_counter() - start > (self.deadline - start) / 2:
+                    break   #the next depth takes longer than everything so far, it would not finish in time
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+
+        gs.checkMate, gs.staleMate, gs.inCheck, gs.pins, gs.checks = savedFlags
+        return result
+
+    def HashPV(self, gs, pv, length):
+        """
+        pv followed by the hash moves of the positions after it, up to length moves. The line the search collects
+        ends at a transposition table hit (always, on a second search of the same position), the table knows the rest
+        """
+        pv = list(pv)
+        for move in pv:
+            gs.makeMove(move)
+        seen = {gs.zobristKey}
+        while len(pv) < length:
+            entry = self.tt.Probe(gs.zobristKey)
+            if entry is None:
+                break
+            move = None
+            for candidate in gs.GetValidMove():
+                if candidate.Encode() == entry[3]:
+                    move = candidate
+                    break
+            if move is None:
+                break
+            gs.makeMove(move)
+            pv.append(move)
+            if gs.zobristKey in seen:
+                break   #a repetition, the line goes round in circles from here
+            seen.add(gs.zobristKey)
+        for move in pv:
+            gs.undoMove()
+        return pv
+
+    def ScoreMove(self, gs, move, depth, alpha = -INFINITY):
+        """
+        Score of playing the root move searched to depth, and its principal variation. Scores at or below alpha
+        are only upper bounds. Uses the limits set by SetLimits and raises SearchAborted when one is hit,
+        the board is back to the root position either way.
+        """
+        rootLength = len(gs.moveLog)
+        self.pv = [[] for i in range(depth + 1)]
+        gs.makeMove(move)
+        try:
+            score = -self.Negamax(gs, depth - 1, -INFINITY, -alpha, 1)
+        finally:
+            while len(gs.moveLog) > rootLength:
+                gs.undoMove()
+        return score, [move] + self.pv[1]
+
+    def Negamax(self, gs, depth, alpha, beta, ply):
+        if self.nodes >= self.nextCheck:
+            self.CheckLimits()
+        self.nodes += 1
+        self.pv[ply] = []
+
+        #a position met before (in the game or on this line) is a draw: whoever repeats it could repeat it again
+        if ply > 0 and gs.halfmoveClock >= 4 and gs.IsDrawByRule(2):
+            if gs.halfmoveClock < ChessEngine.FIFTY_MOVE_PLIES or gs.hasLegalMove():
+                return 0
+
+        alphaOriginal = alpha
+        key = gs.zobristKey
+        ttMove = None
+        entry = self.tt.Probe(key)
+        if entry is not None:
+            ttDepth, ttScore, ttFlag, ttMove = entry
+            if ply > 0 and ttDepth >= depth:
+                ttScore = ScoreFromTT(ttScore, ply)
+                if ttFlag == ChessHash.EXACT:
+                    return ttScore
+                if ttFlag == ChessHash.LOWER and ttScore >= beta:
+                    return ttScore
+                if ttFlag == ChessHash.UPPER and ttScore <= alpha:
+                    return ttScore
+
+        #KQK, KRK, KPK: known draws end here, known wins keep searching (for the mate) with a winning evaluation
+        known = ChessBitbase.Probe(gs) if ply > 0 and gs.pieceCount == 3 else None
+        if known == 0:
+            return 0
+
+        if depth == 0:
+            if known is None and self.quiescence:
+                return self.Quiesce(gs, alpha, beta, ply)
+            if not gs.hasLegalMove():
+                return -MATE + ply if gs.inCheck else 0
+            if known is not None:
+                return ChessBitbase.Score(gs, known, Evaluate(gs))
+            return Evaluate(gs)
+
+        #best first (see ChessOrder), quiet moves generated only if the search gets that far before a cutoff
+        bestScore = -INFINITY
+        bestMove = None
+        moves = self.orderer.Moves(gs, ttMove, ply) if self.ordering else gs.GetValidMove()
+        for move in moves:
+            gs.makeMove(move)
+            score = -self.Negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if alpha >= beta:
+                        if self.ordering:
+                            self.orderer.Cutoff(move, depth, ply)
+                        break
+        if bestMove is None:
+            return -MATE + ply if gs.inCheck else 0
+
+        if bestScore <= alphaOriginal:
+            flag = ChessHash.UPPER
+        elif bestScore >= beta:
+            flag = ChessHash.LOWER
+        else:
+            flag = ChessHash.EXACT
+        self.tt.Store(key, depth, ScoreToTT(bestScore, ply), flag, bestMove.Encode())
+        return bestScore
+
+    def Quiesce(self, gs, alpha, beta, ply):
+        """
+        Captures and promotions only, until the position is quiet, so no leaf is scored in the middle of an exchange.
+        The side to move may stand pat on the evaluation instead of capturing, and captures that lose material by
+        SEE are not tried. In check there is no standing pat and every evasion is searched, quiet ones too, so
+        checks and evasions could go on forever: repetitions are draws and QS_MAX_PLY stops the line.
+        """
+        if self.nodes >= self.nextCheck:
+            self.CheckLimits()
+        self.nodes += 1
+
+        if gs.halfmoveClock >= 4 and gs.IsDrawByRule(2):
+            if gs.halfmoveClock < ChessEngine.FIFTY_MOVE_PLIES or gs.hasLegalMove():
+                return 0
+        if ply >= QS_MAX_PLY:
+            return Evaluate(gs)
+
+        kingRow, kingCol = gs.WhiteKingLocation if gs.whiteToMove else gs.BlackKingLocation
+        inCheck = gs.SquareIsAttacked(kingRow, kingCol)
+        if inCheck:
+            bestScore = -MATE + ply     #stays that way if there is no evasion
+        else:
+            bestScore = Evaluate(gs)
+            if bestScore >= beta:
+                return bestScore
+            alpha = max(alpha, bestScore)
+
+        stages = gs.GenerateStages()
+        moves = next(stages)
+        if inCheck:
+            moves = moves + next(stages)
+        else:
+            board = gs.board
+            moves = [move for move in moves if not ChessOrder.LosesMaterial(board, move)]
+        if self.ordering:
+            moves.sort(key = ChessOrder.CaptureOrder, reverse = True)
+        for move in moves:
+            gs.makeMove(move)
+            score = -self.Quiesce(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return bestScore
+
+
+def FindBestMove(gs, depth = None, nodes = None, movetime = None):
+    """one-off search with a fresh transposition table, see Searcher.Search"""
+    return Searcher().Search(gs, depth, nodes, movetime)
@@ -0,0 +1,398 @@
+"""
+    Local analysis service, so tools can ask for a search over HTTP/JSON instead of embedding ChessEngine.
+    asyncio takes the connections, the searches run on a pool of worker processes (each keeps its own Searcher and
+    transposition table for the life of the pool). A job already being searched is joined by identical requests
+    instead of searched again, and finished jobs are answered from an LRU cache.
+
+        POST /analyze   {"fen": "...", "depth": 4}          one job, depth / nodes / movetime (seconds) limits
+                        {"jobs": [{"fen": ...}, ...]}       a batch, answered once every job is done
+        GET  /metrics   queue depth, running searches, cache, latency percentiles (ms) and throughput (jobs/s)
+        GET  /health
+
+        python ChessService.py --port 8765 --workers 4
+        curl -d '{"fen": "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1", "depth": 4}' localhost:8765/analyze
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import http
+import json
+import math
+import os
+import signal
+import sys
+import time
+
+import ChessEngine
+import ChessSearch
+
+DEFAULT_PORT = 8765
+DEFAULT_DEPTH = 4       #jobs that give no limit at all
+MAX_MOVETIME = 60.0     #seconds, longer jobs are refused
+MAX_NODES = 10 ** 9
+MAX_BATCH = 256         #jobs per request
+MAX_BODY = 1 << 20
+CACHE_SIZE = 4096       #results kept
+LATENCY_WINDOW = 4096   #latest jobs the percentiles are taken over
+THROUGHPUT_WINDOW = 60.0    #seconds the throughput is averaged over
+
+_searcher = None    #the Searcher of this worker process
+
+def _InitWorker(ttSizeMB):
+    global _searcher
+    _searcher = ChessSearch.Searcher(ttSizeMB = ttSizeMB)
+
+def _Analyze(fen, backend, depth, nodes, movetime):
+    """worker side: the answer to one job as a plain dict"""
+    gs = ChessEngine.GameStart.fromFEN(fen, backend)
+    status = None
+    if gs.IsGameOver():
+        status = "checkmate" if gs.checkMate else "stalemate" if gs.staleMate else gs.drawByRule
+    result = _searcher.Search(gs, depth, nodes, movetime)
+    mate = None
+    if status == "checkmate":
+        result.score, mate = -ChessSearch.MATE, 0
+    elif result.bestMove is not None and result.IsMate():
+        plies = ChessSearch.MATE - abs(result.score)
+        mate = (plies + 1) // 2 if result.score > 0 else -(plies // 2)
+    return {"fen": fen, "bestmove": result.bestMove.GetChessNotation() if result.bestMove is not None else None,
+            "score": result.score, "mate": mate, "pv": [move.GetChessNotation() for move in result.pv],
+            "depth": result.depth, "nodes": result.nodes, "time": round(result.elapsed, 4), "status": status}
+
+def _Limit(job, name, kind, low, high):
+    if job.get(name) is None:
+        return None
+    if isinstance(job[name], bool):     #json true would pass for 1
+        raise ValueError("%s must be a number" % name)
+    if kind is int and isinstance(job[name], float) and not job[name].is_integer():
+        raise ValueError("%s must be a whole number" % name)
+    try:
+        value = kind(job[name])
+    except (TypeError, ValueError):
+        raise ValueError("%s must be a number" % name)
+    if not low <= value <= high:
+        raise ValueError("%s must be between %s and %s" % (name, low, high))
+    return value
+
+def ParseJob(job, backend = "mailbox"):
+    """
+    (fen, backend, depth, nodes, movetime) of one job object, the key of the cache and of the jobs in flight.
+    The FEN is read and written back so the same position always gives the same key. ValueError if the job is bad
+    """
+    if not isinstance(job, dict) or not isinstance(job.get("fen"), str):
+        raise ValueError("a job is an object with a fen")
+    backend = job.get("backend", backend)
+    if backend not in ("mailbox", "bitboard"):
+        raise ValueError("backend is mailbox or bitboard")
+    try:
+        fen = ChessEngine.GameStart.fromFEN(job["fen"]).toFEN()
+    except (ValueError, IndexError):
+        raise ValueError("bad FEN: " + job["fen"])
+    depth = _Limit(job, "depth", int, 1, ChessSearch.MAX_DEPTH)
+    nodes = _Limit(job, "nodes", int, 1, MAX_NODES)
+    movetime = _Limit(job, "movetime", float, 0.001, MAX_MOVETIME)
+    if depth is None and nodes is None and movetime is None:
+        depth = DEFAULT_DEPTH
+    return fen, backend, depth, nodes, movetime
+
+def Percentile(ordered, p):
+    """p (0 - 100) percentile of an already sorted list, nearest rank"""
+    if not ordered:
+        return None
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p * len(ordered) / 100.0) - 1))]
+
+
+class LRUCache():
+    def __init__(self, capacity = CACHE_SIZE):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def Get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def Put(self, key, value):
+        if self.capacity <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last = False)
+
+
+class Metrics():
+    """counters since the start, latencies of the latest jobs and the jobs finished in the last THROUGHPUT_WINDOW"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.jobs = 0
+        self.searched = 0   #jobs that went to a worker
+        self.cacheHits = 0
+        self.joined = 0     #jobs that waited for an identical one already in flight
+        self.errors = 0
+        self.latencies = collections.deque(maxlen = LATENCY_WINDOW)   #seconds from arrival to answer
+        self.finished = collections.deque()
+
+    def JobDone(self, latency):
+        now = time.perf_counter()
+        self.latencies.append(latency)
+        self.finished.append(now)
+        while self.finished and self.finished[0] < now - THROUGHPUT_WINDOW:
+            self.finished.popleft()
+
+    def Snapshot(self):
+        now = time.perf_counter()
+        while self.finished and self.finished[0] < now - THROUGHPUT_WINDOW:
+            self.finished.popleft()
+        window = min(THROUGHPUT_WINDOW, now - self.started)
+        ordered = sorted(self.latencies)
+        latency = {"samples": len(ordered)}
+        for name, p in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)):
+            value = Percentile(ordered, p)
+            latency[name] = round(value * 1e3, 2) if value is not None else None
+        return {"uptime": round(now - self.started, 1), "requests": self.requests, "jobs": self.jobs,
+                "searched": self.searched, "cacheHits": self.cacheHits, "joined": self.joined, "errors": self.errors,
+                "latencyMs": latency, "throughput": round(len(self.finished) / window, 2) if window > 0 else 0.0}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ShuttingDown(Exception):
+    """what the jobs no worker will finish get once Close has started, answered with 503"""
+
+async def ReadRequest(reader):
+    """(method, path, headers, body, keepAlive) of the next request on the connection, None once the client is gone"""
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise HttpError(400, "bad request line")
+    method, path, version = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, sep, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0") or 0)
+    if length > MAX_BODY:
+        raise HttpError(413, "body over %d bytes" % MAX_BODY)
+    body = await reader.readexactly(length) if length > 0 else b""
+    connection = headers.get("connection", "").lower()
+    keepAlive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+    return method, path.split("?")[0], headers, body, keepAlive
+
+def WriteResponse(writer, status, payload, keepAlive):
+    body = json.dumps(payload).encode()
+    head = "HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n" % (
+        status, http.HTTPStatus(status).phrase, len(body), "keep-alive" if keepAlive else "close")
+    writer.write(head.encode("latin-1") + body)
+
+
+class AnalysisService():
+    """
+    The queue, the jobs in flight, the cache and the metrics. Start it inside a running event loop, every
+    worker process gets one dispatcher task that feeds it jobs from the queue one at a time, so the queue depth
+    is the number of jobs no worker has started yet.
+    """
+    def __init__(self, workers = None, ttSizeMB = 16, backend = "mailbox", cacheSize = CACHE_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.ttSizeMB = ttSizeMB
+        self.backend = backend
+        self.cache = LRUCache(cacheSize)
+        self.metrics = Metrics()
+        self.inflight = {}  #key -> future of the search
+        self.queue = None
+        self.running = 0
+        self.executor = None
+        self.dispatchers = []
+        self.server = None
+        self.closing = False
+
+    async def Start(self, host = "127.0.0.1", port = DEFAULT_PORT):
+        self.queue = asyncio.Queue()
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, initializer = _InitWorker,
+                                                               initargs = (self.ttSizeMB,))
+        self.dispatchers = [asyncio.create_task(self._Dispatch()) for i in range(self.workers)]
+        self.server = await asyncio.start_server(self.HandleConnection, host, port)
+        return self.server
+
+    async def Close(self):
+        """
+        stop listening, fail every job still queued or searched (ShuttingDown, 503 to its clients) and wait for
+        the workers to finish their current search and exit. The wait happens in a thread, the event loop keeps
+        answering the connections still open meanwhile
+        """
+        self.closing = True
+        if self.server is not None:
+            self.server.close()
+        for task in self.dispatchers:
+            task.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions = True)
+        futures = list(self.inflight.values())
+        while self.queue is not None and not self.queue.empty():
+            futures.append(self.queue.get_nowait()[1])
+        self.inflight.clear()
+        for future in futures:
+            if not future.done():
+                future.set_exception(ShuttingDown("the service is shutting down"))
+        if self.executor is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(self.executor.shutdown, wait = True, cancel_futures = True))
+
+    async def _Dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            key, future = await self.queue.get()
+            self.running += 1
+            try:
+                result = await loop.run_in_executor(self.executor, _Analyze, *key)
+            except Exception as e:
+                self.metrics.errors += 1
+                self.inflight.pop(key, None)
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.cache.Put(key, result)     #cached before it leaves inflight, a repeat always finds one of them
+                self.inflight.pop(key, None)
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.running -= 1
+
+    async def Analyze(self, key):
+        """the result of one parsed job (see ParseJob) plus "source": cache, joined or search"""
+        start = time.perf_counter()
+        self.metrics.jobs += 1
+        result = self.cache.Get(key)
+        if result is not None:
+            self.metrics.cacheHits += 1
+            source = "cache"
+        else:
+            future = self.inflight.get(key)
+            if future is not None:
+                self.metrics.joined += 1
+                source = "joined"
+            elif self.closing:
+                raise ShuttingDown("the service is shutting down")
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self.inflight[key] = future
+                self.queue.put_nowait((key, future))
+                self.metrics.searched += 1
+                source = "search"
+            result = await asyncio.shield(future)   #a client that goes away must not cancel the others' search
+        self.metrics.JobDone(time.perf_counter() - start)
+        return dict(result, source = source)
+
+    def Status(self):
+        status = self.metrics.Snapshot()
+        status.update({"workers": self.workers, "queueDepth": self.queue.qsize() if self.queue else 0,
+                       "running": self.running, "inFlight": len(self.inflight),
+                       "cache": {"size": len(self.cache), "capacity": self.cache.capacity}})
+        return status
+
+    async def Route(self, method, path, body):
+        """(status, payload) of one request"""
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/metrics":
+            return 200, self.Status()
+        if path != "/analyze":
+            return 404, {"error": "not found: " + path}
+        if method != "POST":
+            return 405, {"error": "POST a job or {\"jobs\": [...]}"}
+        try:
+            request = json.loads(body or b"null")
+        except ValueError:
+            return 400, {"error": "body is not JSON"}
+        batch = isinstance(request, dict) and "jobs" in request
+        jobs = request["jobs"] if batch else [request]
+        if not isinstance(jobs, list) or not jobs or len(jobs) > MAX_BATCH:
+            return 400, {"error": "jobs is a list of 1 to %d jobs" % MAX_BATCH}
+        keys = []
+        for i, job in enumerate(jobs):
+            try:
+                keys.append(ParseJob(job, self.backend))
+            except ValueError as e:
+                return 400, {"error": ("job %d: %s" % (i, e)) if batch else str(e)}
+        try:
+            results = await asyncio.gather(*[self.Analyze(key) for key in keys])
+        except ShuttingDown as e:
+            return 503, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": "search failed: %r" % e}
+        return 200, {"results": results} if batch else results[0]
+
+    async def HandleConnection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await ReadRequest(reader)
+                except HttpError as e:
+                    self.metrics.errors += 1
+                    WriteResponse(writer, e.status, {"error": str(e)}, False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, headers, body, keepAlive = request
+                self.metrics.requests += 1
+                status, payload = await self.Route(method, path, body)
+                if status >= 400:
+                    self.metrics.errors += 1
+                WriteResponse(writer, status, payload, keepAlive)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass    #the client went away mid request
+        finally:
+            writer.close()
+
+async def Serve(host = "127.0.0.1", port = DEFAULT_PORT, workers = None, ttSizeMB = 16, backend = "mailbox",
+                cacheSize = CACHE_SIZE):
+    """run the service until SIGTERM or Ctrl+C, the worker processes are shut down either way"""
+    service = AnalysisService(workers, ttSizeMB, backend, cacheSize)
+    await service.Start(host, port)
+    print("analysis service on http://%s:%d with %d workers" % (host, port, service.workers), flush = True)
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    except NotImplementedError:
+        pass    #no loop signal handlers on Windows, Ctrl+C still ends it
+    try:
+        await stop.wait()
+    finally:
+        await service.Close()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "HTTP/JSON position analysis on a pool of worker processes")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = DEFAULT_PORT)
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--hash", type = int, default = 16, help = "transposition table MB per worker")
+    parser.add_argument("--backend", choices = ("mailbox", "bitboard"), default = "mailbox")
+    parser.add_argument("--cache", type = int, default = CACHE_SIZE, help = "results kept, 0 turns the cache off")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(Serve(args.host, args.port, args.workers, args.hash, args.backend, args.cache))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
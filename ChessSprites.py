@@ -0,0 +1,82 @@
+"""
+    Piece sprites for ChessMain, read straight from the images zip that ships with the repo (the loose images/
+    folder is used instead when someone has unpacked it).
+    The twelve pieces scaled to one square size are packed side by side into a single atlas image and saved to a
+    disk cache, so later starts (and window resizes back to a size seen before) load one file and scale nothing.
+
+        IMAGES = ChessSprites.LoadSprites(64)     # {'wp': Surface, ...}
+"""
+
+import io
+import os
+import zipfile
+
+import pygame as p
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ZIP_PATH = os.path.join(HERE, "images-20220403T014241Z-001.zip")
+IMAGE_DIR = os.path.join(HERE, "images")
+PIECES = ('wR', 'wN', 'wB', 'wQ', 'wK', 'wp', 'bR', 'bN', 'bB', 'bQ', 'bK', 'bp')  #order in the atlas
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                         "ChessProject")
+
+_loaded = {}    #sqSize -> sprites, for this process
+
+def SourceStamp():
+    """short tag of the sprite source, part of the cache file name so a new zip never serves stale sprites"""
+    path = ZIP_PATH if os.path.exists(ZIP_PATH) else IMAGE_DIR
+    info = os.stat(path)
+    return "%x%x" % (info.st_size, int(info.st_mtime))
+
+def ReadOriginals():
+    """full size piece surfaces from the zip, or from images/ when there is no zip"""
+    images = {}
+    if os.path.exists(ZIP_PATH):
+        with zipfile.ZipFile(ZIP_PATH) as archive:
+            names = {os.path.basename(name): name for name in archive.namelist()}
+            for piece in PIECES:
+                data = archive.read(names[piece + ".png"])
+                images[piece] = p.image.load(io.BytesIO(data), piece + ".png")
+    else:
+        for piece in PIECES:
+            images[piece] = p.image.load(os.path.join(IMAGE_DIR, piece + ".png"))
+    return images
+
+def BuildAtlas(sqSize):
+    """one SRCALPHA surface, sqSize high, with every piece scaled to sqSize in PIECES order"""
+    atlas = p.Surface((sqSize * len(PIECES), sqSize), p.SRCALPHA)
+    originals = ReadOriginals()
+    for i, piece in enumerate(PIECES):
+        image = p.Surface(originals[piece].get_size(), p.SRCALPHA)    #32 bit whatever the png is, smoothscale needs it
+        image.blit(originals[piece], (0, 0))
+        atlas.blit(p.transform.smoothscale(image, (sqSize, sqSize)), (i * sqSize, 0))
+    return atlas
+
+def AtlasPath(sqSize, cacheDir = None):
+    return os.path.join(cacheDir or CACHE_DIR, "atlas_%d_%s.png" % (sqSize, SourceStamp()))
+
+def LoadSprites(sqSize, cacheDir = None):
+    """{piece: Surface} scaled to sqSize, from memory, the disk cache, or the zip (and then cached)"""
+    if sqSize in _loaded:
+        return _loaded[sqSize]
+    path = AtlasPath(sqSize, cacheDir)
+    atlas = None
+    if os.path.exists(path):
+        try:
+            atlas = p.image.load(path)
+        except p.error:
+            atlas = None    #half written or corrupt, build it again
+    if atlas is None or atlas.get_size() != (sqSize * len(PIECES), sqSize):
+        atlas = BuildAtlas(sqSize)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            temp = "%s.%d.tmp.png" % (path, os.getpid())
+            p.image.save(atlas, temp)
+            os.replace(temp, path)  #other processes see the whole file or none of it
+        except (OSError, p.error):
+            pass    #read only home or no space: still works, just without the cache
+    if p.display.get_surface() is not None:
+        atlas = atlas.convert_alpha()   #same pixel format as the screen, fast blits
+    sprites = {piece: atlas.subsurface((i * sqSize, 0, sqSize, sqSize)) for i, piece in enumerate(PIECES)}
+    _loaded[sqSize] = sprites
+    return sprites
@@ -0,0 +1,255 @@
+"""
+    UCI front end, for running the engine headless behind a chess GUI or a tournament manager.
+    stdin is read by an asyncio loop while the search runs on a worker thread, so "stop", "isready" and "quit"
+    are answered at once even in the middle of a search.
+
+        python ChessUCI.py [--backend bitboard] [--hash 64] [--book book.bin]
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import sys
+import threading
+import time
+
+import ChessBook
+import ChessEngine
+import ChessSearch
+
+ENGINE_NAME = "ChessProject"
+ENGINE_AUTHOR = "ChessProject authors"
+
+MOVE_OVERHEAD = 0.05    #seconds kept back from every clock budget for the GUI round trip
+DEFAULT_MOVES_TO_GO = 30
+
+def BudgetFromClock(remaining, increment, movesToGo):
+    """seconds to spend on this move given the clock (all in seconds)"""
+    budget = remaining / (movesToGo or DEFAULT_MOVES_TO_GO) + increment * 0.75
+    return max(0.01, min(budget, remaining - MOVE_OVERHEAD))
+
+def FormatScore(score):
+    """UCI score: cp in centipawns, or mate in moves (negative when we get mated)"""
+    if abs(score) > ChessSearch.MATE_BOUND:
+        plies = ChessSearch.MATE - abs(score)
+        return "mate %d" % ((plies + 1) // 2 if score > 0 else -(plies // 2))
+    return "cp %d" % score
+
+
+class UCIEngine():
+    def __init__(self, out = None, backend = "mailbox", ttSizeMB = 16, bookFile = None):
+        self.out = out if out is not None else sys.stdout
+        self.backend = backend
+        self.outLock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.releaseEvent = threading.Event()   #an infinite / ponder search may send its bestmove
+        self.ponderBudget = None
+        #stopping on the event too means a stop that arrives before the search has started is not lost
+        self.searcher = ChessSearch.Searcher(ttSizeMB = ttSizeMB, shouldStop = self.stopEvent.is_set)
+        self.bookFile = None
+        self.OpenBook(bookFile)
+        self.searchExecutor = concurrent.futures.ThreadPoolExecutor(1)
+        self.searchFuture = None
+        self.gs = self.NewGame()
+        self.commands = {"uci": self.Uci, "isready": self.IsReady, "setoption": self.SetOption,
+                         "ucinewgame": self.UciNewGame, "position": self.Position, "go": self.Go, "stop": self.Stop,
+                         "ponderhit": self.PonderHit}
+
+    def NewGame(self, fen = None):
+        gs = ChessEngine.GameStart.fromFEN(fen or ChessEngine.STARTING_FEN, self.backend)
+        gs.allowUnderpromotion = True
+        return gs
+
+    def OpenBook(self, path):
+        """probe the Polyglot book at path from now on, no book when path is empty"""
+        if self.searcher.book is not None:
+            self.searcher.book.Close()
+            self.searcher.book = None
+        self.bookFile = path or None
+        if self.bookFile is not None:
+            self.searcher.book = ChessBook.PolyglotBook(self.bookFile)
+
+    def Send(self, line):
+        with self.outLock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    async def Run(self, stream = None):
+        """answer commands from stream (stdin) until "quit" or end of input"""
+        stream = stream if stream is not None else sys.stdin
+        loop = asyncio.get_running_loop()
+        reader = concurrent.futures.ThreadPoolExecutor(1)   #a blocking readline that works on pipes and consoles alike
+        try:
+            while True:
+                line = await loop.run_in_executor(reader, stream.readline)
+                if not line:
+                    break
+                tokens = line.split()
+                if not tokens:
+                    continue
+                if tokens[0] == "quit":
+                    break
+                handler = self.commands.get(tokens[0])
+                if handler is None:
+                    self.Send("info string unknown command " + tokens[0])
+                    continue
+                try:
+                    await handler(tokens[1:])
+                except (ValueError, IndexError) as e:
+                    self.Send("info string error in '%s': %s" % (line.strip(), e))
+        finally:
+            await self.Stop([])
+            reader.shutdown(wait = False)
+            self.searchExecutor.shutdown(wait = True)
+
+    async def WaitSearch(self):
+        if self.searchFuture is not None:
+            await self.searchFuture
+            self.searchFuture = None
+
+    async def Uci(self, args):
+        self.Send("id name " + ENGINE_NAME)
+        self.Send("id author " + ENGINE_AUTHOR)
+        self.Send("option name Hash type spin default %d min 1 max 4096" % self.searcher.tt.sizeMB)
+        self.Send("option name BookFile type string default " + (self.bookFile or "<empty>"))
+        self.Send("option name BestBookMove type check default false")
+        self.Send("uciok")
+
+    async def IsReady(self, args):
+        self.Send("readyok")
+
+    async def SetOption(self, args):
+        #setoption name <name> value <value>
+        text = " ".join(args)
+        name, _, value = text.partition(" value ")
+        name = name.replace("name", "", 1).strip().lower()
+        if name == "hash":
+            await self.Stop([])
+            book, bookBest = self.searcher.book, self.searcher.bookBest
+            self.searcher = ChessSearch.Searcher(ttSizeMB = int(value), shouldStop = self.stopEvent.is_set, book = book)
+            self.searcher.bookBest = bookBest
+        elif name == "bookfile":
+            await self.Stop([])
+            try:
+                self.OpenBook("" if value.strip() == "<empty>" else value.strip())
+            except OSError as e:
+                self.Send("info string cannot open book: %s" % e)
+        elif name == "bestbookmove":
+            self.searcher.bookBest = value.strip().lower() == "true"
+        else:
+            self.Send("info string unknown option " + name)
+
+    async def UciNewGame(self, args):
+        await self.Stop([])
+        self.searcher.tt.Clear()
+        self.gs = self.NewGame()
+
+    async def Position(self, args):
+        """position startpos | fen <fen> [moves <move> ...] with moves in coordinate notation"""
+        await self.Stop([])
+        if "moves" in args:
+            split = args.index("moves")
+            setup, moves = args[:split], args[split + 1:]
+        else:
+            setup, moves = args, []
+        if setup[0] == "startpos":
+            gs = self.NewGame()
+        elif setup[0] == "fen":
+            gs = self.NewGame(" ".join(setup[1:]))
+        else:
+            raise ValueError("expected startpos or fen")
+        for notation in moves:
+            for move in gs.GetValidMove():
+                if move.GetChessNotation() == notation:
+                    gs.makeMove(move)
+                    break
+            else:
+                raise ValueError("illegal move " + notation)
+        self.gs = gs
+
+    async def Go(self, args):
+        await self.Stop([])
+        limits = {}
+        i = 0
+        while i < len(args):
+            if args[i] in ("infinite", "ponder"):
+                limits[args[i]] = True
+                i += 1
+            elif args[i] == "searchmoves":
+                break   #not supported, search every move
+            else:
+                limits[args[i]] = int(args[i + 1])
+                i += 2
+
+        depth = limits.get("depth")
+        nodes = limits.get("nodes")
+        movetime = limits["movetime"] / 1000.0 if "movetime" in limits else None
+        clock, increment = ("wtime", "winc") if self.gs.whiteToMove else ("btime", "binc")
+        budget = None
+        if clock in limits:
+            budget = BudgetFromClock(limits[clock] / 1000.0, limits.get(increment, 0) / 1000.0, limits.get("movestogo"))
+        infinite = limits.get("infinite", False) or limits.get("ponder", False)
+        if movetime is None and not infinite:
+            movetime = budget
+        self.ponderBudget = budget if limits.get("ponder") else None
+        if depth is None and nodes is None and movetime is None and not infinite:
+            depth = 4   #plain "go"
+        self.stopEvent.clear()
+        self.releaseEvent.clear()
+        loop = asyncio.get_running_loop()
+        self.searchFuture = loop.run_in_executor(self.searchExecutor, self.SearchAndReport, depth, nodes, movetime, infinite)
+
+    async def Stop(self, args):
+        self.stopEvent.set()
+        self.releaseEvent.set()
+        self.searcher.Stop()
+        await self.WaitSearch()
+
+    async def PonderHit(self, args):
+        """the opponent played the expected move: the ponder search goes on as a normal timed search"""
+        if self.ponderBudget is not None:
+            self.searcher.deadline = time.perf_counter() + self.ponderBudget
+        self.releaseEvent.set()
+
+    def SearchAndReport(self, depth, nodes, movetime, infinite):
+        """
+        search thread: info line per finished depth, then bestmove (after stop when infinite). A search that fails
+        is reported as an info string and still ends in bestmove, the move of its last finished depth or 0000
+        """
+        finished = []
+        def OnIteration(result):
+            finished.append(result.bestMove)
+            self.SendInfo(result)
+
+        rootLength = len(self.gs.moveLog)
+        try:
+            bestMove = self.searcher.Search(self.gs, depth or ChessSearch.MAX_DEPTH, nodes, movetime,
+                                            onIteration = OnIteration).bestMove
+        except Exception as e:
+            self.Send("info string search failed: %r" % e)
+            while len(self.gs.moveLog) > rootLength:
+                self.gs.undoMove()  #the next go starts from the same position
+            bestMove = finished[-1] if finished else None
+        if infinite:
+            self.releaseEvent.wait()    #UCI: no bestmove before stop (or ponderhit)
+        if bestMove is None:
+            self.Send("bestmove 0000")
+        else:
+            self.Send("bestmove " + bestMove.GetChessNotation())
+
+    def SendInfo(self, result):
+        self.Send("info depth %d score %s nodes %d nps %d time %d hashfull %d pv %s" % (
+            result.depth, FormatScore(result.score), result.nodes, result.nps, int(result.elapsed * 1000),
+            self.searcher.tt.Hashfull(), " ".join(move.GetChessNotation() for move in result.pv)))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "UCI engine on stdin/stdout")
+    parser.add_argument("--backend", choices = ("mailbox", "bitboard"), default = "mailbox")
+    parser.add_argument("--hash", type = int, default = 16, help = "transposition table size in MB")
+    parser.add_argument("--book", help = "Polyglot opening book (.bin)")
+    args = parser.parse_args(argv)
+    asyncio.run(UCIEngine(backend = args.backend, ttSizeMB = args.hash, bookFile = args.book).Run())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
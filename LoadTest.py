@@ -0,0 +1,183 @@
+"""
+    Load test of a ChessService instance: concurrent keep-alive clients post analysis jobs as fast as the answers
+    come back, then the latencies and throughput seen by the clients are printed next to the service's /metrics.
+    Positions are random playouts from the perft positions (or the FEN / EPD file given). A --repeat share of the
+    jobs asks for a position already sent, to show the cache and the joining of identical jobs in flight.
+
+        python LoadTest.py --spawn --workers 4 --clients 16 --requests 400 --depth 3
+        python LoadTest.py --port 8765 --positions suite.epd --batch 8 --repeat 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+import ChessEngine
+import ChessPositions
+import ChessService
+import Perft
+
+class Connection():
+    """one keep-alive HTTP/1.1 connection to the service, JSON in and out"""
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def Request(self, method, path, payload = None):
+        """(status, JSON answer)"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.writer.write(("%s %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" % (
+            method, path, self.host, len(body))).encode("latin-1") + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, sep, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def Close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+def RandomPositions(fens, count, seed = 1, plies = 8):
+    """count positions a few random legal plies away from the given ones"""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        gs = ChessEngine.GameStart.fromFEN(rng.choice(fens))
+        for i in range(rng.randint(0, plies)):
+            moves = gs.GetValidMove()
+            if not moves:
+                break
+            gs.makeMove(rng.choice(moves))
+        positions.append(gs.toFEN())
+    return positions
+
+async def WaitForService(host, port, timeout = 30.0):
+    deadline = time.perf_counter() + timeout
+    while True:
+        connection = Connection(host, port)
+        try:
+            status, answer = await connection.Request("GET", "/health")
+            if status == 200:
+                return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+        finally:
+            connection.Close()
+
+async def RunLoad(host, port, positions, clients, requests, batch, limits, repeat, seed):
+    """(latencies of the requests in seconds, seconds taken, jobs answered, errors, sources seen)"""
+    rng = random.Random(seed)
+    sent = []
+    fresh = iter(positions)
+    remaining = [requests]
+    latencies = []
+    sources = {}
+    errors = [0]
+
+    def NextFen():
+        fen = next(fresh, None) if not sent or rng.random() >= repeat else None
+        fen = fen or rng.choice(sent or positions)
+        sent.append(fen)
+        return fen
+
+    async def Client():
+        connection = Connection(host, port)
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                jobs = [dict(limits, fen = NextFen()) for i in range(batch)]
+                payload = {"jobs": jobs} if batch > 1 else jobs[0]
+                start = time.perf_counter()
+                status, answer = await connection.Request("POST", "/analyze", payload)
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    errors[0] += 1
+                    continue
+                for result in answer["results"] if batch > 1 else [answer]:
+                    sources[result["source"]] = sources.get(result["source"], 0) + 1
+        finally:
+            connection.Close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[Client() for i in range(clients)])
+    elapsed = time.perf_counter() - start
+    return latencies, elapsed, sum(sources.values()), errors[0], sources
+
+async def LoadTest(args):
+    limits = {key: value for key, value in (("depth", args.depth), ("nodes", args.nodes), ("movetime", args.movetime))
+              if value is not None}
+    if args.positions:
+        fens = [fen for fen, ops in ChessPositions.ReadPositions(args.positions)]
+    else:
+        fens = [fen for name, fen, expected in Perft.POSITIONS]
+    positions = RandomPositions(fens, args.requests * args.batch, args.seed)
+
+    latencies, elapsed, jobs, errors, sources = await RunLoad(args.host, args.port, positions, args.clients,
+                                                              args.requests, args.batch, limits, args.repeat, args.seed)
+    ordered = sorted(latencies)
+    print("%d requests (%d jobs, %d errors) from %d clients in %.2fs: %.1f requests/s, %.1f jobs/s" % (
+        len(latencies), jobs, errors, args.clients, elapsed, len(latencies) / elapsed, jobs / elapsed))
+    print("request latency ms  p50 %.1f  p90 %.1f  p99 %.1f  max %.1f" % tuple(
+        ChessService.Percentile(ordered, p) * 1e3 for p in (50, 90, 99, 100)))
+    print("answered from: " + ", ".join("%s %d" % item for item in sorted(sources.items())))
+    connection = Connection(args.host, args.port)
+    try:
+        status, metrics = await connection.Request("GET", "/metrics")
+    finally:
+        connection.Close()
+    print("service metrics: " + json.dumps(metrics, indent = 2, sort_keys = True))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "load test of a local ChessService")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = ChessService.DEFAULT_PORT)
+    parser.add_argument("--spawn", action = "store_true", help = "start a ChessService for the test and stop it after")
+    parser.add_argument("--workers", type = int, default = None, help = "workers of the spawned service")
+    parser.add_argument("--clients", type = int, default = 8)
+    parser.add_argument("--requests", type = int, default = 200)
+    parser.add_argument("--batch", type = int, default = 1, help = "jobs per request")
+    parser.add_argument("--depth", type = int, default = None)
+    parser.add_argument("--nodes", type = int, default = None)
+    parser.add_argument("--movetime", type = float, default = None, help = "seconds per job")
+    parser.add_argument("--positions", help = "FEN or EPD file to start the random playouts from")
+    parser.add_argument("--repeat", type = float, default = 0.2, help = "share of jobs asking for a position already sent")
+    parser.add_argument("--seed", type = int, default = 1)
+    args = parser.parse_args(argv)
+    if args.depth is None and args.nodes is None and args.movetime is None:
+        args.depth = 3
+
+    service = None
+    if args.spawn:
+        command = [sys.executable, ChessService.__file__, "--host", args.host, "--port", str(args.port)]
+        if args.workers is not None:
+            command += ["--workers", str(args.workers)]
+        service = subprocess.Popen(command)
+    try:
+        asyncio.run(WaitForService(args.host, args.port))
+        asyncio.run(LoadTest(args))
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+    Perft: count every leaf of the legal move tree to a fixed depth and compare with the published numbers.
+    This is the regression gate for move generation, run it after every change to ChessEngine.py
+
+        python Perft.py                          # whole suite to depth 3
+        python Perft.py --depth 4 --position kiwipete --backend bitboard
+        python Perft.py --fen "<fen>" --depth 2 --divide
+"""
+
+import argparse
+import sys
+import time
+
+import ChessEngine
+import ChessSearch
+
+'''
+name, fen, node counts for depth 1, 2, 3, ... (from the chessprogramming wiki perft results)
+'''
+POSITIONS = [
+    ("startpos", ChessEngine.STARTING_FEN, [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862, 4085603]),
+    ("enpassant", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+    ("castling", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333]),
+    ("promotion", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", [46, 2079, 89890, 3894594]),
+]
+
+def Perft(gs, depth):
+    """number of leaf nodes depth plies below the current position"""
+    if gs.nativePackedMoves:
+        return PerftPacked(gs, depth)
+    moves = gs.GetValidMove()
+    if depth == 1:
+        return len(moves)   #bulk count, no need to make the last ply
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += Perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+def PerftPacked(gs, depth):
+    """Perft over packed moves, a Move is only built for the moves that get made"""
+    codes = gs.GetValidMovesPacked()
+    if depth == 1:
+        return len(codes)
+    nodes = 0
+    for code in codes:
+        gs.makeMove(gs.MoveFromCode(code))
+        nodes += PerftPacked(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+'''
+A search suspends the staged generator of a node while it expands the children, and resumes it afterwards.
+StagedErrors does the same and checks that the moves still come out exactly as GetValidMove lists them
+'''
+STAGED_DEPTH = 2
+
+def StagedErrors(gs, depth):
+    """FENs of the positions up to depth plies below gs where resumed staged generation went wrong"""
+    expected = sorted(move.Encode() for move in gs.GetValidMove())
+    generated = []
+    errors = []
+    for move in gs.GenerateMoves():
+        generated.append(move.Encode())
+        gs.makeMove(move)
+        if depth > 1:
+            errors += StagedErrors(gs, depth - 1)
+        else:
+            gs.GetValidMove()   #a leaf still generates, and overwrites the legality state of the position
+        gs.undoMove()
+    if sorted(generated) != expected:
+        errors.append(gs.toFEN())
+    return errors
+
+'''
+The backends only differ in how they generate, so a fixed depth search has to play out the very same tree on both:
+same score, same node count, same principal variation
+'''
+SEARCH_DEPTH = 3
+
+def SearchDifference(fen, depth):
+    """None when a depth search of fen gives the same result on both backends, else a text of the two results"""
+    results = []
+    for backend in ("mailbox", "bitboard"):
+        result = ChessSearch.Searcher().Search(ChessEngine.GameStart.fromFEN(fen, backend), depth = depth)
+        results.append("%s score %d nodes %d pv %s" % (backend, result.score, result.nodes,
+                                                       " ".join(move.GetChessNotation() for move in result.pv)))
+    if results[0].split(" ", 1)[1] == results[1].split(" ", 1)[1]:
+        return None
+    return ", ".join(results)
+
+def Divide(gs, depth):
+    """leaf count below every root move, keyed by coordinate notation. Diff it against another engine to find a bug"""
+    result = {}
+    for move in gs.GetValidMove():
+        gs.makeMove(move)
+        result[move.GetChessNotation()] = Perft(gs, depth - 1) if depth > 1 else 1
+        gs.undoMove()
+    return result
+
+def RunPosition(name, fen, expected, depth, backend = "mailbox", out = sys.stdout):
+    """perft one position for depth 1..depth, print nodes/timing per depth.
+       Returns (every count matched, nodes searched)"""
+    gs = ChessEngine.GameStart.fromFEN(fen, backend)
+    gs.allowUnderpromotion = True
+    ok = True
+    total = 0
+    for d in range(1, depth + 1):
+        start = time.perf_counter()
+        nodes = Perft(gs, d)
+        elapsed = time.perf_counter() - start
+        total += nodes
+        nps = nodes / elapsed if elapsed > 0 else 0.0
+        if d <= len(expected):
+            status = "ok" if nodes == expected[d - 1] else "FAIL (expected %d)" % expected[d - 1]
+            ok = ok and nodes == expected[d - 1]
+        else:
+            status = "unchecked"
+        out.write("%-12s depth %d  nodes %10d  time %8.3fs  %10.0f nps  %s\n" % (name, d, nodes, elapsed, nps, status))
+    return ok, total
+
+def RunSuite(depth = 3, backend = "mailbox", names = None, out = sys.stdout):
+    ok = True
+    totalNodes = 0
+    start = time.perf_counter()
+    for name, fen, expected in POSITIONS:
+        if names and name not in names:
+            continue
+        passed, nodes = RunPosition(name, fen, expected, min(depth, len(expected)), backend, out)
+        ok = ok and passed
+        totalNodes += nodes
+    elapsed = time.perf_counter() - start
+    for name, fen, expected in POSITIONS:
+        if names and name not in names:
+            continue
+        gs = ChessEngine.GameStart.fromFEN(fen, backend)
+        gs.allowUnderpromotion = True
+        errors = StagedErrors(gs, min(depth, STAGED_DEPTH))
+        ok = ok and not errors
+        out.write("%-12s staged generation resumed after a child: %s\n" % (name, "FAIL at " + errors[0] if errors else "ok"))
+        difference = SearchDifference(fen, min(depth, SEARCH_DEPTH))
+        ok = ok and difference is None
+        out.write("%-12s search same on both backends: %s\n" % (name, "FAIL " + difference if difference else "ok"))
+    out.write("total %d nodes in %.3fs, %.0f nps, %s\n" % (totalNodes, elapsed, totalNodes / elapsed if elapsed else 0.0,
+                                                       "all passed" if ok else "FAILED"))
+    return ok
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "perft correctness and speed check for ChessEngine")
+    parser.add_argument("--depth", type = int, default = 3)
+    parser.add_argument("--backend", choices = ("mailbox", "bitboard"), default = "mailbox")
+    parser.add_argument("--position", action = "append", help = "name from the suite, can be repeated: " +
+                        ", ".join(name for name, fen, expected in POSITIONS))
+    parser.add_argument("--fen", help = "perft a custom position instead of the suite (nothing to check against)")
+    parser.add_argument("--divide", action = "store_true", help = "print the node count below every root move")
+    args = parser.parse_args(argv)
+
+    if args.divide:
+        fen = args.fen
+        if fen is None:
+            fen = dict((name, fen) for name, fen, expected in POSITIONS)[(args.position or ["startpos"])[0]]
+        gs = ChessEngine.GameStart.fromFEN(fen, args.backend)
+        gs.allowUnderpromotion = True
+        start = time.perf_counter()
+        result = Divide(gs, args.depth)
+        elapsed = time.perf_counter() - start
+        for notation in sorted(result):
+            print("%s: %d" % (notation, result[notation]))
+        total = sum(result.values())
+        print("moves %d  nodes %d  time %.3fs  %.0f nps" % (len(result), total, elapsed, total / elapsed if elapsed else 0.0))
+        return 0
+    if args.fen:
+        return 0 if RunPosition("fen", args.fen, [], args.depth, args.backend)[0] else 1
+    return 0 if RunSuite(args.depth, args.backend, args.position) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())